@@ -1,332 +1,556 @@
-"""
-ChromaDB向量数据库集成模块
-用于存储和检索文档向量
-"""
-
-import os
-import chromadb
-from typing import List, Dict, Any, Optional
-import uuid
-import json
-from datetime import datetime
-
-
-class ChromaVectorDB:
-    """ChromaDB向量数据库管理器"""
-    
-    def __init__(self, host: str = None, port: int = None, persist_directory: str = "./chroma_db"):
-        """
-        初始化ChromaDB
-        
-        Args:
-            host: ChromaDB服务器主机 (用于Docker环境)
-            port: ChromaDB服务器端口
-            persist_directory: 数据库持久化目录 (本地模式)
-        """
-        # 从环境变量获取配置
-        chroma_host = host or os.getenv('CHROMA_HOST')
-        chroma_port = port or int(os.getenv('CHROMA_PORT', '8000'))
-        
-        try:
-            if chroma_host and chroma_host != 'localhost':
-                # Docker环境，连接到ChromaDB服务
-                print(f"🔗 连接到ChromaDB服务: {chroma_host}:{chroma_port}")
-                self.client = chromadb.HttpClient(
-                    host=chroma_host,
-                    port=chroma_port
-                )
-                self.persist_directory = None  # HTTP客户端没有持久化目录
-            else:
-                # 本地环境，使用持久化客户端
-                print(f"📁 使用本地ChromaDB: {persist_directory}")
-                self.persist_directory = persist_directory
-                os.makedirs(persist_directory, exist_ok=True)
-                self.client = chromadb.PersistentClient(path=persist_directory)
-            
-            # 获取或创建集合
-            self.collection = self.client.get_or_create_collection(
-                name="documents",
-                metadata={"description": "文档向量存储集合"}
-            )
-            
-            # 减少日志频率，只在调试时显示
-            # print(f"✅ ChromaDB初始化成功")
-            
-        except Exception as e:
-            print(f"❌ ChromaDB初始化失败: {str(e)}")
-            raise
-    
-    def store_document_chunks(self, file_id: str, filename: str, chunks: List[Dict[str, Any]], embeddings: List[List[float]]) -> bool:
-        """
-        存储文档块到向量数据库
-        
-        Args:
-            file_id: 文件ID
-            filename: 文件名
-            chunks: 文档块列表
-            embeddings: 对应的向量嵌入列表
-            
-        Returns:
-            存储是否成功
-        """
-        try:
-            if len(chunks) != len(embeddings):
-                raise ValueError(f"块数量({len(chunks)})与向量数量({len(embeddings)})不匹配")
-            
-            # 准备数据
-            ids = []
-            documents = []
-            metadatas = []
-            
-            for i, (chunk, embedding) in enumerate(zip(chunks, embeddings)):
-                chunk_id = f"{file_id}_chunk_{i}"
-                ids.append(chunk_id)
-                
-                # 文档内容
-                documents.append(chunk.get('content', ''))
-                
-                # 元数据
-                metadata = {
-                    "file_id": str(file_id),  # 确保UUID转换为字符串
-                    "filename": str(filename),
-                    "chunk_index": i,
-                    "chunk_title": str(chunk.get('title', '')),
-                    "chunk_summary": str(chunk.get('summary', '')),
-                    "chunk_type": str(chunk.get('type', 'unknown')),
-                    "created_at": datetime.now().isoformat(),
-                    "content_length": len(chunk.get('content', ''))
-                }
-                metadatas.append(metadata)
-            
-            # 添加到集合
-            self.collection.add(
-                ids=ids,
-                documents=documents,
-                embeddings=embeddings,
-                metadatas=metadatas
-            )
-            
-            print(f"✅ 文档块存储成功: {filename} ({len(chunks)} 块)")
-            return True
-            
-        except Exception as e:
-            print(f"❌ 存储文档块失败: {str(e)}")
-            return False
-    
-    def search_similar_documents(self, query_text: str, n_results: int = 5, file_id: Optional[str] = None) -> List[Dict[str, Any]]:
-        """
-        搜索相似文档
-        
-        Args:
-            query_text: 查询文本
-            n_results: 返回结果数量
-            file_id: 可选，限制搜索特定文件
-            
-        Returns:
-            相似文档列表
-        """
-        try:
-            # 构建查询条件
-            where_clause = {}
-            if file_id:
-                where_clause["file_id"] = str(file_id)
-            
-            # 执行搜索
-            results = self.collection.query(
-                query_texts=[query_text],
-                n_results=n_results,
-                where=where_clause if where_clause else None
-            )
-            
-            # 格式化结果
-            formatted_results = []
-            if results['documents'] and len(results['documents']) > 0:
-                for i in range(len(results['documents'][0])):
-                    result = {
-                        "id": results['ids'][0][i],
-                        "content": results['documents'][0][i],
-                        "distance": results['distances'][0][i],
-                        "metadata": results['metadatas'][0][i]
-                    }
-                    formatted_results.append(result)
-            
-            return formatted_results
-            
-        except Exception as e:
-            print(f"❌ 搜索失败: {str(e)}")
-            return []
-    
-    def get_file_chunks(self, file_id: str) -> List[Dict[str, Any]]:
-        """
-        获取特定文件的所有块
-        
-        Args:
-            file_id: 文件ID
-            
-        Returns:
-            文件块列表
-        """
-        try:
-            results = self.collection.get(
-                where={"file_id": str(file_id)}
-            )
-            
-            chunks = []
-            if results['documents']:
-                for i in range(len(results['documents'])):
-                    chunk = {
-                        "id": results['ids'][i],
-                        "content": results['documents'][i],
-                        "metadata": results['metadatas'][i]
-                    }
-                    chunks.append(chunk)
-            
-            # 按chunk_index排序
-            chunks.sort(key=lambda x: x['metadata'].get('chunk_index', 0))
-            return chunks
-            
-        except Exception as e:
-            print(f"❌ 获取文件块失败: {str(e)}")
-            return []
-    
-    def delete_file_chunks(self, file_id: str) -> bool:
-        """
-        删除特定文件的所有块
-        
-        Args:
-            file_id: 文件ID
-            
-        Returns:
-            删除是否成功
-        """
-        try:
-            # 获取要删除的块ID
-            results = self.collection.get(
-                where={"file_id": str(file_id)}
-            )
-            
-            if results['ids']:
-                self.collection.delete(ids=results['ids'])
-                print(f"✅ 已删除文件块: {file_id} ({len(results['ids'])} 块)")
-                return True
-            else:
-                print(f"⚠️  文件块不存在: {file_id}")
-                return True
-                
-        except Exception as e:
-            print(f"❌ 删除文件块失败: {str(e)}")
-            return False
-    
-    def get_collection_stats(self) -> Dict[str, Any]:
-        """
-        获取集合统计信息
-        
-        Returns:
-            统计信息字典
-        """
-        try:
-            # 获取所有数据
-            all_data = self.collection.get()
-            
-            total_chunks = len(all_data['ids']) if all_data['ids'] else 0
-            
-            # 统计文件数量
-            file_ids = set()
-            if all_data['metadatas']:
-                for metadata in all_data['metadatas']:
-                    file_ids.add(metadata.get('file_id', ''))
-            
-            stats = {
-                "total_files": len(file_ids),
-                "total_chunks": total_chunks,
-                "collection_name": self.collection.name,
-                "storage_mode": "HTTP" if self.persist_directory is None else "Persistent",
-                "persist_directory": self.persist_directory or "N/A (HTTP Mode)"
-            }
-            
-            return stats
-            
-        except Exception as e:
-            print(f"❌ 获取统计信息失败: {str(e)}")
-            return {"error": str(e)}
-    
-    def backup_collection(self, backup_path: str) -> bool:
-        """
-        备份集合数据
-        
-        Args:
-            backup_path: 备份文件路径
-            
-        Returns:
-            备份是否成功
-        """
-        try:
-            all_data = self.collection.get()
-            
-            backup_data = {
-                "collection_name": self.collection.name,
-                "backup_time": datetime.now().isoformat(),
-                "data": all_data
-            }
-            
-            with open(backup_path, 'w', encoding='utf-8') as f:
-                json.dump(backup_data, f, ensure_ascii=False, indent=2)
-            
-            print(f"✅ 数据备份成功: {backup_path}")
-            return True
-            
-        except Exception as e:
-            print(f"❌ 数据备份失败: {str(e)}")
-            return False
-
-
-def test_chroma_db():
-    """测试ChromaDB功能"""
-    try:
-        # 创建测试实例
-        db = ChromaVectorDB("./test_chroma_db")
-        
-        # 测试数据
-        test_chunks = [
-            {
-                "title": "测试标题1",
-                "content": "这是第一个测试文档块的内容",
-                "summary": "第一个块的摘要",
-                "type": "test"
-            },
-            {
-                "title": "测试标题2", 
-                "content": "这是第二个测试文档块的内容",
-                "summary": "第二个块的摘要",
-                "type": "test"
-            }
-        ]
-        
-        # 测试向量（随机）
-        import random
-        test_embeddings = [[random.random() for _ in range(1536)] for _ in range(2)]
-        
-        # 测试存储
-        success = db.store_document_chunks(
-            file_id="test_file_1",
-            filename="test_document.pdf",
-            chunks=test_chunks,
-            embeddings=test_embeddings
-        )
-        
-        if success:
-            print("✅ ChromaDB测试成功")
-            
-            # 测试统计
-            stats = db.get_collection_stats()
-            print(f"📊 数据库统计: {stats}")
-            
-        else:
-            print("❌ ChromaDB测试失败")
-            
-    except Exception as e:
-        print(f"❌ ChromaDB测试出错: {str(e)}")
-
-
-if __name__ == "__main__":
+"""
+ChromaDB向量数据库集成模块
+用于存储和检索文档向量
+"""
+
+import os
+import chromadb
+import numpy as np
+import orjson
+from typing import List, Dict, Any, Optional, Union
+import uuid
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+# 单次写入ChromaDB的块数量，过大的批次会拖慢底层SQLite事务
+BATCH_SIZE = 128
+
+# 按ID删除时每批的块数量
+DELETE_BATCH_SIZE = 1000
+
+
+def normalize_embeddings(embeddings: Union[np.ndarray, List[List[float]]]) -> np.ndarray:
+    """
+    将向量转换为连续的float32矩阵并归一化为单位长度
+    
+    ChromaDB内部以float32存储，提前转换可避免逐元素处理Python浮点列表。
+    单位向量下L2距离与余弦距离排序一致；新建集合时也可在metadata中
+    指定{"hnsw:space": "ip"}直接使用内积（已有集合的距离函数不可修改）。
+    """
+    vectors = np.array(embeddings, dtype=np.float32, ndmin=2)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    vectors /= norms
+    return vectors
+
+# 本地持久化模式下底层SQLite的调优参数
+SQLITE_PRAGMAS = (
+    "journal_mode=WAL",
+    "synchronous=NORMAL",
+    "temp_store=memory",
+    "cache_size=-65536",
+    "mmap_size=268435456",
+)
+
+
+class QueryCache:
+    """线程安全的LRU+TTL查询结果缓存"""
+    
+    def __init__(self, max_size: int = 2000, ttl: float = 30.0):
+        """
+        Args:
+            max_size: 最大缓存条目数，超出后淘汰最久未使用的条目
+            ttl: 缓存有效期（秒）
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+    
+    @staticmethod
+    def make_key(*parts: Any) -> bytes:
+        """根据查询参数生成缓存键"""
+        hasher = hashlib.blake2b(digest_size=16)
+        for part in parts:
+            hasher.update(part if isinstance(part, bytes) else str(part).encode('utf-8'))
+            hasher.update(b'|')
+        return hasher.digest()
+    
+    def get(self, key: bytes) -> Optional[Any]:
+        """获取缓存结果，未命中或已过期时返回None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            
+            timestamp, value = entry
+            if time.monotonic() - timestamp > self.ttl:
+                del self._entries[key]
+                return None
+            
+            self._entries.move_to_end(key)
+            return value
+    
+    def set(self, key: bytes, value: Any):
+        """写入缓存结果"""
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+    
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._entries.clear()
+
+
+class ChromaVectorDB:
+    """ChromaDB向量数据库管理器"""
+    
+    def __init__(self, host: str = None, port: int = None, persist_directory: str = "./chroma_db", batch_size: int = BATCH_SIZE):
+        """
+        初始化ChromaDB
+        
+        Args:
+            host: ChromaDB服务器主机 (用于Docker环境)
+            port: ChromaDB服务器端口
+            persist_directory: 数据库持久化目录 (本地模式)
+            batch_size: 每次写入集合的块数量 (建议100-250)
+        """
+        self.batch_size = max(1, batch_size)
+        self._query_cache = QueryCache()
+        
+        # 从环境变量获取配置
+        chroma_host = host or os.getenv('CHROMA_HOST')
+        chroma_port = port or int(os.getenv('CHROMA_PORT', '8000'))
+        
+        try:
+            if chroma_host and chroma_host != 'localhost':
+                # Docker环境，连接到ChromaDB服务
+                print(f"🔗 连接到ChromaDB服务: {chroma_host}:{chroma_port}")
+                self.client = chromadb.HttpClient(
+                    host=chroma_host,
+                    port=chroma_port
+                )
+                self.persist_directory = None  # HTTP客户端没有持久化目录
+            else:
+                # 本地环境，使用持久化客户端
+                print(f"📁 使用本地ChromaDB: {persist_directory}")
+                self.persist_directory = persist_directory
+                os.makedirs(persist_directory, exist_ok=True)
+                self.client = chromadb.PersistentClient(path=persist_directory)
+                self._tune_sqlite()
+            
+            # 获取或创建集合
+            self.collection = self.client.get_or_create_collection(
+                name="documents",
+                metadata={"description": "文档向量存储集合"}
+            )
+            
+            # 减少日志频率，只在调试时显示
+            # print(f"✅ ChromaDB初始化成功")
+            
+        except Exception as e:
+            print(f"❌ ChromaDB初始化失败: {str(e)}")
+            raise
+    
+    def _index_version(self) -> int:
+        """
+        本地集合的版本号：底层SQLite文件（含WAL）的最新修改时间（纳秒）
+        
+        每次写入或删除都会写SQLite，不需要访问集合即可判断数据是否变化；
+        HTTP客户端模式无法读取服务端文件，返回0，此时只依赖缓存TTL失效
+        """
+        if not self.persist_directory:
+            return 0
+        sqlite_path = os.path.join(self.persist_directory, "chroma.sqlite3")
+        version = 0
+        for path in (sqlite_path, sqlite_path + "-wal"):
+            try:
+                version = max(version, os.stat(path).st_mtime_ns)
+            except FileNotFoundError:
+                pass
+        return version
+    
+    def _tune_sqlite(self):
+        """调整本地ChromaDB底层SQLite的PRAGMA，减少写入时的fsync开销"""
+        # 依赖ChromaDB私有API，不同版本可能不存在，失败时保持默认配置
+        try:
+            from chromadb.db.impl.sqlite import SqliteDB
+            conn = self.client._system.instance(SqliteDB)._conn_pool.connect()
+            for pragma in SQLITE_PRAGMAS:
+                conn.execute(f"pragma {pragma}")
+        except Exception:
+            pass
+    
+    def _prepare_chunks(self, file_id: str, filename: str, chunks: List[Dict[str, Any]], embeddings: Union[np.ndarray, List[List[float]]]) -> tuple:
+        """构建写入集合所需的ids、documents、metadatas和归一化后的向量"""
+        if len(chunks) != len(embeddings):
+            raise ValueError(f"块数量({len(chunks)})与向量数量({len(embeddings)})不匹配")
+        
+        vectors = normalize_embeddings(embeddings)
+        
+        # 文件级字段和时间戳对所有块相同，只计算一次
+        file_id_str = str(file_id)  # 确保UUID转换为字符串
+        filename_str = str(filename)
+        now_iso = datetime.now().isoformat()
+        
+        ids = self._chunk_ids(file_id_str, len(chunks))
+        documents = [chunk.get('content', '') for chunk in chunks]
+        metadatas = [
+            {
+                "file_id": file_id_str,
+                "filename": filename_str,
+                "chunk_index": i,
+                "chunk_title": str(chunk.get('title', '')),
+                "chunk_summary": str(chunk.get('summary', '')),
+                "chunk_type": str(chunk.get('type', 'unknown')),
+                "created_at": now_iso,
+                "content_length": len(content)
+            }
+            for i, (chunk, content) in enumerate(zip(chunks, documents))
+        ]
+        return ids, documents, metadatas, vectors
+    
+    def _add_chunks(self, ids: List[str], documents: List[str], metadatas: List[Dict[str, Any]], vectors: np.ndarray):
+        """分批添加到集合"""
+        batch_size = self.batch_size
+        for start in range(0, len(ids), batch_size):
+            end = start + batch_size
+            self.collection.add(
+                ids=ids[start:end],
+                documents=documents[start:end],
+                embeddings=vectors[start:end],
+                metadatas=metadatas[start:end]
+            )
+        self._query_cache.clear()
+    
+    def store_document_chunks(self, file_id: str, filename: str, chunks: List[Dict[str, Any]], embeddings: Union[np.ndarray, List[List[float]]]) -> bool:
+        """
+        存储文档块到向量数据库
+        
+        Args:
+            file_id: 文件ID
+            filename: 文件名
+            chunks: 文档块列表
+            embeddings: 对应的向量嵌入（列表或N×D数组），存储前会归一化
+            
+        Returns:
+            存储是否成功
+        """
+        try:
+            if not chunks and not len(embeddings):
+                return True
+            
+            self._add_chunks(*self._prepare_chunks(file_id, filename, chunks, embeddings))
+            
+            print(f"✅ 文档块存储成功: {filename} ({len(chunks)} 块)")
+            return True
+            
+        except Exception as e:
+            print(f"❌ 存储文档块失败: {str(e)}")
+            return False
+    
+    def needs_training(self) -> bool:
+        """与FaissVectorDB接口一致；HNSW索引无需训练"""
+        return False
+    
+    def train_index(self) -> bool:
+        """与FaissVectorDB接口一致；HNSW索引无需训练"""
+        return False
+    
+    def search_similar_documents(self, query_embedding: Optional[List[float]] = None, n_results: int = 5, file_id: Optional[str] = None, query_text: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        搜索相似文档
+        
+        Args:
+            query_embedding: 查询向量（推荐，由调用方使用与入库相同的嵌入模型生成）
+            n_results: 返回结果数量
+            file_id: 可选，限制搜索特定文件
+            query_text: 查询文本，未提供query_embedding时由ChromaDB嵌入
+            
+        Returns:
+            相似文档列表
+        """
+        if query_embedding is None and not query_text:
+            raise ValueError("query_embedding和query_text至少需要提供一个")
+        
+        if query_embedding is not None:
+            # 与入库向量一致地归一化，并以其float32字节作为缓存键
+            query_vectors = normalize_embeddings([query_embedding])
+            query_key = query_vectors.tobytes()
+        else:
+            query_key = query_text
+        
+        try:
+            # 写入发生在Celery Worker进程中，不会清空本进程的缓存；键中带上本地SQLite文件版本，
+            # 有文档入库或删除后自动失效（HTTP模式只依赖TTL），命中缓存时不访问ChromaDB
+            cache_key = QueryCache.make_key(query_key, n_results, file_id, self._index_version())
+            cached = self._query_cache.get(cache_key)
+            if cached is not None:
+                return list(cached)
+            
+            # 构建查询条件
+            where_clause = {}
+            if file_id:
+                where_clause["file_id"] = str(file_id)
+            
+            # 执行搜索
+            if query_embedding is not None:
+                results = self.collection.query(
+                    query_embeddings=query_vectors,
+                    n_results=n_results,
+                    where=where_clause if where_clause else None
+                )
+            else:
+                results = self.collection.query(
+                    query_texts=[query_text],
+                    n_results=n_results,
+                    where=where_clause if where_clause else None
+                )
+            
+            # 格式化结果
+            formatted_results = []
+            if results['documents'] and len(results['documents']) > 0:
+                for i in range(len(results['documents'][0])):
+                    result = {
+                        "id": results['ids'][0][i],
+                        "content": results['documents'][0][i],
+                        "distance": results['distances'][0][i],
+                        "metadata": results['metadatas'][0][i]
+                    }
+                    formatted_results.append(result)
+            
+            self._query_cache.set(cache_key, formatted_results)
+            return list(formatted_results)
+            
+        except Exception as e:
+            print(f"❌ 搜索失败: {str(e)}")
+            return []
+    
+    @staticmethod
+    def _chunk_ids(file_id: str, count: int) -> List[str]:
+        """按存储时的命名规则生成文件块ID"""
+        file_id_str = str(file_id)
+        return [f"{file_id_str}_chunk_{i}" for i in range(count)]
+    
+    def get_file_chunks(self, file_id: str, chunks_count: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        获取特定文件的所有块
+        
+        Args:
+            file_id: 文件ID
+            chunks_count: 可选，文件块数量（来自数据库记录），提供时按ID直接读取
+            
+        Returns:
+            文件块列表
+        """
+        try:
+            if chunks_count:
+                # 块ID是确定的，按ID读取可避开较慢的元数据过滤
+                ids = self._chunk_ids(file_id, chunks_count)
+                results = self.collection.get(
+                    ids=ids,
+                    include=["documents", "metadatas"]
+                )
+                
+                # 按请求的ID顺序（即chunk_index顺序）组装结果
+                positions = {chunk_id: i for i, chunk_id in enumerate(results['ids'])}
+                chunks = []
+                for chunk_id in ids:
+                    i = positions.get(chunk_id)
+                    if i is not None:
+                        chunks.append({
+                            "id": chunk_id,
+                            "content": results['documents'][i],
+                            "metadata": results['metadatas'][i]
+                        })
+                return chunks
+            
+            results = self.collection.get(
+                where={"file_id": str(file_id)}
+            )
+            
+            chunks = []
+            if results['documents']:
+                for i in range(len(results['documents'])):
+                    chunk = {
+                        "id": results['ids'][i],
+                        "content": results['documents'][i],
+                        "metadata": results['metadatas'][i]
+                    }
+                    chunks.append(chunk)
+            
+            # 按chunk_index排序
+            chunks.sort(key=lambda x: x['metadata'].get('chunk_index', 0))
+            return chunks
+            
+        except Exception as e:
+            print(f"❌ 获取文件块失败: {str(e)}")
+            return []
+    
+    def delete_file_chunks(self, file_id: str, chunks_count: Optional[int] = None) -> bool:
+        """
+        删除特定文件的所有块
+        
+        Args:
+            file_id: 文件ID
+            chunks_count: 可选，文件块数量（来自数据库记录），提供时按ID直接分批删除
+            
+        Returns:
+            删除是否成功
+        """
+        try:
+            if chunks_count:
+                # 块ID是确定的，无需先用元数据过滤查询
+                ids = self._chunk_ids(file_id, chunks_count)
+                for start in range(0, len(ids), DELETE_BATCH_SIZE):
+                    self.collection.delete(ids=ids[start:start + DELETE_BATCH_SIZE])
+                self._query_cache.clear()
+                print(f"✅ 已删除文件块: {file_id} ({len(ids)} 块)")
+                return True
+            
+            # 获取要删除的块ID
+            results = self.collection.get(
+                where={"file_id": str(file_id)},
+                include=[]
+            )
+            
+            if results['ids']:
+                self.collection.delete(ids=results['ids'])
+                self._query_cache.clear()
+                print(f"✅ 已删除文件块: {file_id} ({len(results['ids'])} 块)")
+                return True
+            else:
+                print(f"⚠️  文件块不存在: {file_id}")
+                return True
+                
+        except Exception as e:
+            print(f"❌ 删除文件块失败: {str(e)}")
+            return False
+    
+    def get_collection_stats(self) -> Dict[str, Any]:
+        """
+        获取集合统计信息
+        
+        Returns:
+            统计信息字典
+        """
+        try:
+            # count()只返回行数，无需把所有块传回客户端；ChromaDB无法廉价地统计不同文件数，
+            # 文件数量见处理统计（PostgreSQL）
+            total_chunks = self.collection.count()
+            
+            stats = {
+                "total_chunks": total_chunks,
+                "collection_name": self.collection.name,
+                "storage_mode": "HTTP" if self.persist_directory is None else "Persistent",
+                "persist_directory": self.persist_directory or "N/A (HTTP Mode)"
+            }
+            
+            return stats
+            
+        except Exception as e:
+            print(f"❌ 获取统计信息失败: {str(e)}")
+            return {"error": str(e)}
+    
+    def backup_collection(self, backup_path: str, page_size: int = 10_000) -> bool:
+        """
+        备份集合数据
+        
+        按页流式读取集合，内存占用与集合大小无关：
+        - backup_path: NDJSON文件，首行为集合信息，之后每行一个文档块(id/document/metadata)
+        - <backup_path去扩展名>.embeddings.npy: 向量以float16按页依次np.save，
+          读取时对同一文件句柄依次np.load，行顺序与NDJSON一致
+        
+        Args:
+            backup_path: 备份文件路径
+            page_size: 每页读取的块数量
+            
+        Returns:
+            备份是否成功
+        """
+        try:
+            embeddings_path = os.path.splitext(backup_path)[0] + ".embeddings.npy"
+            total = 0
+            
+            with open(backup_path, 'wb') as f, open(embeddings_path, 'wb') as emb_file:
+                header = {
+                    "collection_name": self.collection.name,
+                    "backup_time": datetime.now(),
+                    "embeddings_file": os.path.basename(embeddings_path)
+                }
+                f.write(orjson.dumps(header, option=orjson.OPT_APPEND_NEWLINE))
+                
+                offset = 0
+                while True:
+                    page = self.collection.get(
+                        limit=page_size,
+                        offset=offset,
+                        include=["documents", "metadatas", "embeddings"]
+                    )
+                    ids = page['ids']
+                    if not ids:
+                        break
+                    
+                    for chunk_id, document, metadata in zip(ids, page['documents'], page['metadatas']):
+                        record = {"id": chunk_id, "document": document, "metadata": metadata}
+                        f.write(orjson.dumps(record, option=orjson.OPT_APPEND_NEWLINE))
+                    np.save(emb_file, np.asarray(page['embeddings'], dtype=np.float16))
+                    
+                    total += len(ids)
+                    offset += len(ids)
+                    if len(ids) < page_size:
+                        break
+            
+            print(f"✅ 数据备份成功: {backup_path} ({total} 块)")
+            return True
+            
+        except Exception as e:
+            print(f"❌ 数据备份失败: {str(e)}")
+            return False
+
+
+def test_chroma_db():
+    """测试ChromaDB功能"""
+    try:
+        # 创建测试实例
+        db = ChromaVectorDB("./test_chroma_db")
+        
+        # 测试数据
+        test_chunks = [
+            {
+                "title": "测试标题1",
+                "content": "这是第一个测试文档块的内容",
+                "summary": "第一个块的摘要",
+                "type": "test"
+            },
+            {
+                "title": "测试标题2", 
+                "content": "这是第二个测试文档块的内容",
+                "summary": "第二个块的摘要",
+                "type": "test"
+            }
+        ]
+        
+        # 测试向量（随机）
+        test_embeddings = np.random.default_rng().random((len(test_chunks), 1536), dtype=np.float32)
+        
+        # 测试存储
+        success = db.store_document_chunks(
+            file_id="test_file_1",
+            filename="test_document.pdf",
+            chunks=test_chunks,
+            embeddings=test_embeddings
+        )
+        
+        if success:
+            print("✅ ChromaDB测试成功")
+            
+            # 测试统计
+            stats = db.get_collection_stats()
+            print(f"📊 数据库统计: {stats}")
+            
+        else:
+            print("❌ ChromaDB测试失败")
+            
+    except Exception as e:
+        print(f"❌ ChromaDB测试出错: {str(e)}")
+
+
+if __name__ == "__main__":
     test_chroma_db()
\ No newline at end of file
@@ -0,0 +1,112 @@
+"""
+向量嵌入缓存模块
+按(嵌入模型, 文本哈希)缓存向量，相同文本不再重复调用嵌入接口
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, List, Optional
+
+
+class EmbeddingCache:
+    """向量嵌入缓存：进程内LRU + 可选的diskcache磁盘缓存（多个Worker进程共享）"""
+    
+    def __init__(self, directory: str = None, memory_size: int = 10_000):
+        """
+        初始化缓存
+        
+        Args:
+            directory: 磁盘缓存目录
+            memory_size: 进程内最多缓存的向量数
+        """
+        self.memory_size = memory_size
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        
+        directory = directory or os.getenv('EMBED_CACHE_DIRECTORY', './.embed_cache')
+        try:
+            import diskcache
+            self._disk = diskcache.Cache(directory)
+        except ImportError:
+            print("⚠️ diskcache 未安装，向量缓存仅保存在进程内存中")
+            self._disk = None
+    
+    @staticmethod
+    def make_key(model: str, text: str) -> str:
+        """生成缓存键"""
+        return f"{model}:{hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()}"
+    
+    def _remember(self, key: str, embedding: List[float]):
+        """写入进程内LRU，超出容量时淘汰最久未使用的向量"""
+        with self._lock:
+            self._memory[key] = embedding
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_size:
+                self._memory.popitem(last=False)
+    
+    def get(self, model: str, text: str) -> Optional[List[float]]:
+        """读取缓存的向量，未命中返回None"""
+        key = self.make_key(model, text)
+        with self._lock:
+            embedding = self._memory.get(key)
+            if embedding is not None:
+                self._memory.move_to_end(key)
+                return embedding
+        
+        if self._disk is not None:
+            embedding = self._disk.get(key)
+            if embedding is not None:
+                self._remember(key, embedding)
+        return embedding
+    
+    def set_many(self, model: str, texts: List[str], embeddings: List[List[float]]):
+        """写入一批向量"""
+        for text, embedding in zip(texts, embeddings):
+            key = self.make_key(model, text)
+            self._remember(key, embedding)
+            if self._disk is not None:
+                self._disk.set(key, embedding)
+    
+    def embed(self, model: str, texts: List[str], compute: Callable[[List[str]], List[List[float]]]) -> List[List[float]]:
+        """
+        优先从缓存读取向量，只对未命中的文本调用compute
+        
+        Args:
+            model: 嵌入模型名称
+            texts: 待向量化文本
+            compute: 实际调用嵌入接口的函数，失败时应抛出异常（失败结果不会被缓存）
+        
+        Returns:
+            与texts顺序一致的向量列表
+        """
+        embeddings = [self.get(model, text) for text in texts]
+        misses = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if not misses:
+            print(f"向量缓存全部命中: {len(texts)} 个")
+            return embeddings
+        
+        # 同一批内的重复文本只计算一次
+        unique_texts = list(dict.fromkeys(texts[i] for i in misses))
+        computed = compute(unique_texts)
+        self.set_many(model, unique_texts, computed)
+        
+        by_text = dict(zip(unique_texts, computed))
+        for i in misses:
+            embeddings[i] = by_text[texts[i]]
+        
+        if len(misses) < len(texts):
+            print(f"向量缓存命中 {len(texts) - len(misses)}/{len(texts)} 个")
+        return embeddings
+
+
+# 全局缓存实例
+_embedding_cache = None
+
+def get_embedding_cache() -> EmbeddingCache:
+    """获取向量嵌入缓存实例（单例模式）"""
+    global _embedding_cache
+    if _embedding_cache is None:
+        _embedding_cache = EmbeddingCache()
+    return _embedding_cache
\ No newline at end of file
@@ -1,274 +1,515 @@
-"""
-错误处理和重试机制模块
-提供统一的错误处理、重试逻辑和异常管理
-"""
-
-import time
-import functools
-import logging
-from typing import Callable, Any, Optional, Type
-import traceback
-from enum import Enum
-
-# 设置日志
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
-
-class ErrorType(Enum):
-    """错误类型枚举"""
-    NETWORK_ERROR = "network_error"
-    API_ERROR = "api_error"
-    FILE_ERROR = "file_error"
-    PARSING_ERROR = "parsing_error"
-    DATABASE_ERROR = "database_error"
-    UNKNOWN_ERROR = "unknown_error"
-
-class RetryableError(Exception):
-    """可重试的错误"""
-    def __init__(self, message: str, error_type: ErrorType, original_error: Exception = None):
-        self.message = message
-        self.error_type = error_type
-        self.original_error = original_error
-        super().__init__(message)
-
-class NonRetryableError(Exception):
-    """不可重试的错误"""
-    def __init__(self, message: str, error_type: ErrorType, original_error: Exception = None):
-        self.message = message
-        self.error_type = error_type
-        self.original_error = original_error
-        super().__init__(message)
-
-def retry_with_backoff(
-    max_retries: int = 3,
-    base_delay: float = 1.0,
-    max_delay: float = 60.0,
-    backoff_factor: float = 2.0,
-    retryable_exceptions: tuple = (RetryableError, ConnectionError, TimeoutError)
-):
-    """
-    带指数退避的重试装饰器
-    
-    Args:
-        max_retries: 最大重试次数
-        base_delay: 基础延迟时间（秒）
-        max_delay: 最大延迟时间（秒）
-        backoff_factor: 退避因子
-        retryable_exceptions: 可重试的异常类型
-    """
-    def decorator(func: Callable) -> Callable:
-        @functools.wraps(func)
-        def wrapper(*args, **kwargs) -> Any:
-            last_exception = None
-            
-            for attempt in range(max_retries + 1):
-                try:
-                    return func(*args, **kwargs)
-                    
-                except retryable_exceptions as e:
-                    last_exception = e
-                    
-                    if attempt == max_retries:
-                        logger.error(f"函数 {func.__name__} 在 {max_retries} 次重试后仍然失败: {str(e)}")
-                        raise
-                    
-                    # 计算延迟时间
-                    delay = min(base_delay * (backoff_factor ** attempt), max_delay)
-                    
-                    logger.warning(f"函数 {func.__name__} 第 {attempt + 1} 次尝试失败: {str(e)}, {delay:.1f}秒后重试")
-                    time.sleep(delay)
-                    
-                except NonRetryableError as e:
-                    logger.error(f"函数 {func.__name__} 发生不可重试错误: {str(e)}")
-                    raise
-                    
-                except Exception as e:
-                    # 未知错误，默认不重试
-                    logger.error(f"函数 {func.__name__} 发生未知错误: {str(e)}")
-                    raise NonRetryableError(f"未知错误: {str(e)}", ErrorType.UNKNOWN_ERROR, e)
-            
-            # 如果到这里，说明重试次数用完了
-            raise last_exception
-            
-        return wrapper
-    return decorator
-
-class ErrorHandler:
-    """错误处理器"""
-    
-    @staticmethod
-    def handle_file_error(e: Exception, file_path: str) -> NonRetryableError:
-        """处理文件相关错误"""
-        if isinstance(e, FileNotFoundError):
-            return NonRetryableError(f"文件不存在: {file_path}", ErrorType.FILE_ERROR, e)
-        elif isinstance(e, PermissionError):
-            return NonRetryableError(f"文件权限错误: {file_path}", ErrorType.FILE_ERROR, e)
-        elif isinstance(e, IOError):
-            return RetryableError(f"文件IO错误: {file_path}", ErrorType.FILE_ERROR, e)
-        else:
-            return NonRetryableError(f"文件处理错误: {str(e)}", ErrorType.FILE_ERROR, e)
-    
-    @staticmethod
-    def handle_api_error(e: Exception, api_name: str) -> Exception:
-        """处理API相关错误"""
-        error_msg = str(e).lower()
-        
-        # OpenAI API 错误处理
-        if "rate limit" in error_msg or "quota" in error_msg:
-            return RetryableError(f"{api_name} API限额错误: {str(e)}", ErrorType.API_ERROR, e)
-        elif "timeout" in error_msg:
-            return RetryableError(f"{api_name} API超时: {str(e)}", ErrorType.API_ERROR, e)
-        elif "connection" in error_msg or "network" in error_msg:
-            return RetryableError(f"{api_name} 网络连接错误: {str(e)}", ErrorType.NETWORK_ERROR, e)
-        elif "unauthorized" in error_msg or "authentication" in error_msg:
-            return NonRetryableError(f"{api_name} 认证失败: {str(e)}", ErrorType.API_ERROR, e)
-        elif "bad request" in error_msg or "invalid" in error_msg:
-            return NonRetryableError(f"{api_name} 请求参数错误: {str(e)}", ErrorType.API_ERROR, e)
-        else:
-            return RetryableError(f"{api_name} API错误: {str(e)}", ErrorType.API_ERROR, e)
-    
-    @staticmethod
-    def handle_database_error(e: Exception, operation: str) -> Exception:
-        """处理数据库相关错误"""
-        error_msg = str(e).lower()
-        
-        if "connection" in error_msg or "timeout" in error_msg:
-            return RetryableError(f"数据库连接错误 ({operation}): {str(e)}", ErrorType.DATABASE_ERROR, e)
-        elif "lock" in error_msg or "busy" in error_msg:
-            return RetryableError(f"数据库忙碌 ({operation}): {str(e)}", ErrorType.DATABASE_ERROR, e)
-        elif "disk" in error_msg or "space" in error_msg:
-            return NonRetryableError(f"数据库存储空间不足 ({operation}): {str(e)}", ErrorType.DATABASE_ERROR, e)
-        else:
-            return RetryableError(f"数据库操作错误 ({operation}): {str(e)}", ErrorType.DATABASE_ERROR, e)
-    
-    @staticmethod
-    def handle_parsing_error(e: Exception, file_name: str) -> Exception:
-        """处理文档解析相关错误"""
-        error_msg = str(e).lower()
-        
-        if "corrupted" in error_msg or "damaged" in error_msg:
-            return NonRetryableError(f"文档损坏 ({file_name}): {str(e)}", ErrorType.PARSING_ERROR, e)
-        elif "unsupported" in error_msg or "format" in error_msg:
-            return NonRetryableError(f"不支持的文档格式 ({file_name}): {str(e)}", ErrorType.PARSING_ERROR, e)
-        elif "memory" in error_msg or "resource" in error_msg:
-            return RetryableError(f"解析资源不足 ({file_name}): {str(e)}", ErrorType.PARSING_ERROR, e)
-        else:
-            return RetryableError(f"文档解析错误 ({file_name}): {str(e)}", ErrorType.PARSING_ERROR, e)
-
-def safe_execute(func: Callable, *args, **kwargs) -> tuple[bool, Any, Optional[Exception]]:
-    """
-    安全执行函数，捕获所有异常
-    
-    Returns:
-        (success, result, error)
-    """
-    try:
-        result = func(*args, **kwargs)
-        return True, result, None
-    except Exception as e:
-        logger.error(f"执行 {func.__name__} 时发生错误: {str(e)}")
-        logger.debug(traceback.format_exc())
-        return False, None, e
-
-class TaskErrorTracker:
-    """任务错误跟踪器"""
-    
-    def __init__(self):
-        self.error_counts = {}
-        self.error_history = []
-    
-    def record_error(self, task_id: str, error: Exception):
-        """记录错误"""
-        if task_id not in self.error_counts:
-            self.error_counts[task_id] = 0
-        
-        self.error_counts[task_id] += 1
-        
-        error_record = {
-            "task_id": task_id,
-            "error_type": type(error).__name__,
-            "error_message": str(error),
-            "timestamp": time.time()
-        }
-        
-        self.error_history.append(error_record)
-        
-        # 保持历史记录在合理范围内
-        if len(self.error_history) > 1000:
-            self.error_history = self.error_history[-500:]
-    
-    def get_error_count(self, task_id: str) -> int:
-        """获取任务错误次数"""
-        return self.error_counts.get(task_id, 0)
-    
-    def should_skip_task(self, task_id: str, max_errors: int = 5) -> bool:
-        """判断是否应该跳过任务"""
-        return self.get_error_count(task_id) >= max_errors
-    
-    def get_error_summary(self) -> dict:
-        """获取错误摘要"""
-        total_errors = len(self.error_history)
-        error_types = {}
-        
-        for record in self.error_history[-100:]:  # 最近100个错误
-            error_type = record["error_type"]
-            error_types[error_type] = error_types.get(error_type, 0) + 1
-        
-        return {
-            "total_errors": total_errors,
-            "error_types": error_types,
-            "tasks_with_errors": len(self.error_counts)
-        }
-
-# 全局错误跟踪器实例
-error_tracker = TaskErrorTracker()
-
-def log_and_handle_error(task_id: str, error: Exception, context: str = "") -> Exception:
-    """
-    记录并处理错误
-    
-    Args:
-        task_id: 任务ID
-        error: 原始错误
-        context: 错误上下文
-        
-    Returns:
-        处理后的错误
-    """
-    # 记录错误
-    error_tracker.record_error(task_id, error)
-    
-    # 记录日志
-    logger.error(f"任务 {task_id} 在 {context} 阶段发生错误: {str(error)}")
-    
-    # 根据错误类型返回适当的异常
-    if "openai" in str(error).lower() or "api" in str(error).lower():
-        return ErrorHandler.handle_api_error(error, "OpenAI")
-    elif "file" in str(error).lower() or "path" in str(error).lower():
-        return ErrorHandler.handle_file_error(error, context)
-    elif "database" in str(error).lower() or "chroma" in str(error).lower():
-        return ErrorHandler.handle_database_error(error, context)
-    elif "parse" in str(error).lower() or "mineru" in str(error).lower():
-        return ErrorHandler.handle_parsing_error(error, context)
-    else:
-        return RetryableError(f"未分类错误: {str(error)}", ErrorType.UNKNOWN_ERROR, error)
-
-if __name__ == "__main__":
-    # 测试重试机制
-    @retry_with_backoff(max_retries=2, base_delay=0.1)
-    def test_function():
-        import random
-        if random.random() < 0.7:
-            raise RetryableError("模拟可重试错误", ErrorType.API_ERROR)
-        return "成功"
-    
-    try:
-        result = test_function()
-        print(f"测试结果: {result}")
-    except Exception as e:
-        print(f"测试失败: {str(e)}")
-    
-    # 测试错误跟踪
-    print("错误跟踪测试:")
-    error_tracker.record_error("test_task", Exception("测试错误"))
+"""
+错误处理和重试机制模块
+提供统一的错误处理、重试逻辑和异常管理
+"""
+
+import time
+import random
+import asyncio
+import functools
+import itertools
+import re
+import threading
+import logging
+from typing import Callable, Any, Optional, Type
+import traceback
+from enum import Enum
+from collections import OrderedDict, deque
+from contextvars import ContextVar, Token
+
+# 设置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class ErrorType(Enum):
+    """错误类型枚举"""
+    NETWORK_ERROR = "network_error"
+    API_ERROR = "api_error"
+    FILE_ERROR = "file_error"
+    PARSING_ERROR = "parsing_error"
+    DATABASE_ERROR = "database_error"
+    UNKNOWN_ERROR = "unknown_error"
+
+class RetryableError(Exception):
+    """可重试的错误"""
+    def __init__(self, message: str, error_type: ErrorType, original_error: Exception = None):
+        self.message = message
+        self.error_type = error_type
+        self.original_error = original_error
+        super().__init__(message)
+
+class NonRetryableError(Exception):
+    """不可重试的错误"""
+    def __init__(self, message: str, error_type: ErrorType, original_error: Exception = None):
+        self.message = message
+        self.error_type = error_type
+        self.original_error = original_error
+        super().__init__(message)
+
+class EmbeddingError(RetryableError):
+    """向量生成失败的错误（不再用随机向量代替，避免污染向量索引）"""
+    def __init__(self, message: str, original_error: Exception = None):
+        super().__init__(message, ErrorType.API_ERROR, original_error)
+
+class ChunkParseError(ValueError):
+    """AI返回的分块结果无法解析"""
+    pass
+
+class CircuitOpenError(NonRetryableError):
+    """熔断器打开时直接拒绝调用的错误（retry_after为距离放行探测调用的秒数）"""
+    def __init__(self, message: str, error_type: ErrorType, retry_after: float = 0.0):
+        super().__init__(message, error_type)
+        self.retry_after = retry_after
+
+class CircuitBreaker:
+    """
+    熔断器（进程内）
+    
+    连续失败达到阈值后打开，冷却期内直接拒绝调用；冷却结束后放行一次探测调用（半开），
+    探测成功则关闭，失败则重新打开
+    """
+    
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+    
+    def __init__(self, name: str, failure_threshold: int = 5, cooldown: float = 30.0):
+        """
+        Args:
+            name: 保护的依赖名称（如ollama、vector_db、broker）
+            failure_threshold: 打开熔断器所需的连续失败次数
+            cooldown: 打开后等待多久（秒）放行探测调用
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self.failure_count = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+    
+    def allow(self) -> bool:
+        """判断是否允许本次调用"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.cooldown:
+                # 冷却结束，只放行一次探测，其余调用仍被拒绝直到探测有结果
+                self.state = self.HALF_OPEN
+                return True
+            return False
+    
+    def record_success(self):
+        """记录调用成功（或依赖已正常响应），关闭熔断器"""
+        with self._lock:
+            self.state = self.CLOSED
+            self.failure_count = 0
+    
+    def record_failure(self):
+        """记录一次依赖失败，达到阈值或探测失败时打开熔断器"""
+        with self._lock:
+            self.failure_count += 1
+            if self.state == self.HALF_OPEN or self.failure_count >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logger.warning(f"熔断器 {self.name} 打开: 连续失败 {self.failure_count} 次")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+    
+    @property
+    def is_open(self) -> bool:
+        return self.state == self.OPEN
+    
+    @property
+    def retry_after(self) -> float:
+        """距离冷却结束还有多少秒（未打开时为0）"""
+        if self.state != self.OPEN:
+            return 0.0
+        return max(0.0, self.cooldown - (time.monotonic() - self.opened_at))
+
+# 按依赖名称共享的熔断器
+_circuit_breakers = {}
+_circuit_breakers_lock = threading.Lock()
+
+def get_circuit_breaker(name: str, failure_threshold: int = 5, cooldown: float = 30.0) -> CircuitBreaker:
+    """获取指定依赖的熔断器（首次获取时按参数创建）"""
+    with _circuit_breakers_lock:
+        breaker = _circuit_breakers.get(name)
+        if breaker is None:
+            breaker = _circuit_breakers[name] = CircuitBreaker(name, failure_threshold, cooldown)
+        return breaker
+
+# 当前请求的截止时间（time.monotonic()时刻），由Web中间件设置
+_request_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+
+def set_request_deadline(timeout: float) -> Token:
+    """设置当前上下文的请求截止时间（timeout秒后），返回用于恢复的token"""
+    return _request_deadline.set(time.monotonic() + timeout)
+
+def reset_request_deadline(token: Token):
+    """恢复设置截止时间之前的状态"""
+    _request_deadline.reset(token)
+
+def retry_with_backoff(
+    max_retries: int = 3,
+    base_delay: float = 1.0,
+    max_delay: float = 60.0,
+    backoff_factor: float = 2.0,
+    retryable_exceptions: tuple = (RetryableError, ConnectionError, TimeoutError),
+    jitter: float = 1.0,
+    rng: Optional[random.Random] = None,
+    target: Optional[str] = None,
+    failure_threshold: int = 5,
+    cooldown: float = 30.0,
+    timeout: Optional[float] = None
+):
+    """
+    带指数退避的重试装饰器，同时支持普通函数和协程函数
+    
+    Args:
+        max_retries: 最大重试次数
+        base_delay: 基础延迟时间（秒）
+        max_delay: 最大延迟时间（秒）
+        backoff_factor: 退避因子
+        retryable_exceptions: 可重试的异常类型
+        jitter: 随机抖动比例，1.0为完全抖动（在0到退避上限间均匀取值），
+                0.5为等量抖动，0为不抖动；用于错开多个worker的重试时间
+        rng: 随机数生成器，默认使用random模块（测试时可传入固定种子的实例）
+        target: 可选，被调用的依赖名称；指定后由该依赖的熔断器保护，
+                熔断期间直接抛出CircuitOpenError，不再重试等待
+        failure_threshold: 熔断器打开所需的连续失败次数
+        cooldown: 熔断器打开后放行探测调用前的冷却时间（秒）
+        timeout: 可选，单次调用（含所有重试）的总时间预算（秒）；与请求截止时间
+                 一起决定截止时刻，剩余时间不足下次等待时直接抛出最后的异常
+    """
+    uniform = (rng or random).uniform
+    breaker = get_circuit_breaker(target, failure_threshold, cooldown) if target else None
+    
+    def decorator(func: Callable) -> Callable:
+        def get_deadline() -> Optional[float]:
+            """本次调用的截止时刻：请求截止时间与timeout预算中较早者"""
+            deadline = _request_deadline.get()
+            if timeout is not None:
+                call_deadline = time.monotonic() + timeout
+                deadline = call_deadline if deadline is None else min(deadline, call_deadline)
+            return deadline
+        
+        def handle_failure(attempt: int, e: Exception, deadline: Optional[float]) -> float:
+            """处理一次失败：不可重试或重试次数用完时抛出异常，否则返回退避时间"""
+            if isinstance(e, retryable_exceptions):
+                if breaker is not None:
+                    breaker.record_failure()
+                    if breaker.is_open:
+                        logger.error(f"函数 {func.__name__} 的依赖 {target} 已熔断，停止重试: {str(e)}")
+                        raise e
+                
+                if attempt == max_retries:
+                    logger.error(f"函数 {func.__name__} 在 {max_retries} 次重试后仍然失败: {str(e)}")
+                    raise e
+                
+                # 计算延迟时间：指数退避上限内随机抖动
+                capped = min(base_delay * (backoff_factor ** attempt), max_delay)
+                delay = capped - uniform(0, capped * jitter)
+                
+                if deadline is not None and time.monotonic() + delay > deadline:
+                    logger.error(f"函数 {func.__name__} 剩余时间不足以等待 {delay:.1f}秒后重试: {str(e)}")
+                    raise e
+                
+                logger.warning(f"函数 {func.__name__} 第 {attempt + 1} 次尝试失败: {str(e)}, {delay:.1f}秒后重试")
+                return delay
+            
+            # 依赖已正常响应，错误来自请求本身
+            if breaker is not None:
+                breaker.record_success()
+            
+            if isinstance(e, NonRetryableError):
+                logger.error(f"函数 {func.__name__} 发生不可重试错误: {str(e)}")
+                raise e
+            
+            # 未知错误，默认不重试
+            logger.error(f"函数 {func.__name__} 发生未知错误: {str(e)}")
+            raise NonRetryableError(f"未知错误: {str(e)}", ErrorType.UNKNOWN_ERROR, e) from e
+        
+        def check_circuit():
+            """熔断器打开时直接拒绝调用"""
+            if breaker is not None and not breaker.allow():
+                raise CircuitOpenError(
+                    f"{target} 暂时不可用（熔断中），跳过 {func.__name__}",
+                    ErrorType.NETWORK_ERROR,
+                    retry_after=breaker.retry_after or breaker.cooldown
+                )
+        
+        def on_success(result: Any) -> Any:
+            if breaker is not None:
+                breaker.record_success()
+            return result
+        
+        if asyncio.iscoroutinefunction(func):
+            # 协程使用asyncio.sleep等待，退避期间不阻塞事件循环
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs) -> Any:
+                deadline = get_deadline()
+                for attempt in range(max_retries + 1):
+                    check_circuit()
+                    try:
+                        return on_success(await func(*args, **kwargs))
+                    except Exception as e:
+                        delay = handle_failure(attempt, e, deadline)
+                    await asyncio.sleep(delay)
+            
+            return async_wrapper
+        
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs) -> Any:
+            deadline = get_deadline()
+            for attempt in range(max_retries + 1):
+                check_circuit()
+                try:
+                    return on_success(func(*args, **kwargs))
+                except Exception as e:
+                    delay = handle_failure(attempt, e, deadline)
+                time.sleep(delay)
+            
+        return wrapper
+    return decorator
+
+# 与retry_with_backoff相同，按被装饰函数是否为协程自动选择等待方式
+async_retry_with_backoff = retry_with_backoff
+
+def _compile_rules(rules: list) -> tuple:
+    """
+    编译按优先级排列的(关键词元组, 结果)分类规则
+    
+    所有关键词合并为一个正则，一次扫描即可找出消息中命中的全部关键词，
+    再取优先级最高的结果，与逐条 if ... in ... 判断的结果一致
+    """
+    lookup = {}
+    for priority, (keywords, result) in enumerate(rules):
+        for keyword in keywords:
+            lookup.setdefault(keyword, (priority, result))
+    pattern = re.compile("|".join(sorted(map(re.escape, lookup), key=len, reverse=True)), re.IGNORECASE)
+    return pattern, lookup
+
+def _classify(rules: tuple, message: str) -> Optional[Any]:
+    """返回消息命中的最高优先级规则结果，未命中时返回None"""
+    pattern, lookup = rules
+    matches = [lookup[keyword.lower()] for keyword in pattern.findall(message)]
+    return min(matches, key=lambda match: match[0])[1] if matches else None
+
+# 各类错误的分类规则：(关键词, (异常类型, 消息前缀, 错误类型))，按优先级排列
+_API_ERROR_RULES = _compile_rules([
+    (("rate limit", "quota"), (RetryableError, "{name} API限额错误", ErrorType.API_ERROR)),
+    (("timeout",), (RetryableError, "{name} API超时", ErrorType.API_ERROR)),
+    (("connection", "network"), (RetryableError, "{name} 网络连接错误", ErrorType.NETWORK_ERROR)),
+    (("unauthorized", "authentication"), (NonRetryableError, "{name} 认证失败", ErrorType.API_ERROR)),
+    (("bad request", "invalid"), (NonRetryableError, "{name} 请求参数错误", ErrorType.API_ERROR)),
+])
+_API_ERROR_DEFAULT = (RetryableError, "{name} API错误", ErrorType.API_ERROR)
+
+_DATABASE_ERROR_RULES = _compile_rules([
+    (("connection", "timeout"), (RetryableError, "数据库连接错误 ({name})", ErrorType.DATABASE_ERROR)),
+    (("lock", "busy"), (RetryableError, "数据库忙碌 ({name})", ErrorType.DATABASE_ERROR)),
+    (("disk", "space"), (NonRetryableError, "数据库存储空间不足 ({name})", ErrorType.DATABASE_ERROR)),
+])
+_DATABASE_ERROR_DEFAULT = (RetryableError, "数据库操作错误 ({name})", ErrorType.DATABASE_ERROR)
+
+_PARSING_ERROR_RULES = _compile_rules([
+    (("corrupted", "damaged"), (NonRetryableError, "文档损坏 ({name})", ErrorType.PARSING_ERROR)),
+    (("unsupported", "format"), (NonRetryableError, "不支持的文档格式 ({name})", ErrorType.PARSING_ERROR)),
+    (("memory", "resource"), (RetryableError, "解析资源不足 ({name})", ErrorType.PARSING_ERROR)),
+])
+_PARSING_ERROR_DEFAULT = (RetryableError, "文档解析错误 ({name})", ErrorType.PARSING_ERROR)
+
+# log_and_handle_error中按错误消息选择处理器的规则
+# 规则结果为处理函数 (error, context, error_msg) -> Exception
+_ERROR_ROUTES = _compile_rules([
+    (("openai", "api"), lambda e, context, msg: ErrorHandler.handle_api_error(e, "OpenAI", msg)),
+    (("file", "path"), lambda e, context, msg: ErrorHandler.handle_file_error(e, context, msg)),
+    (("database", "chroma"), lambda e, context, msg: ErrorHandler.handle_database_error(e, context, msg)),
+    (("parse", "mineru"), lambda e, context, msg: ErrorHandler.handle_parsing_error(e, context, msg)),
+])
+
+def _handle_unclassified_error(e: Exception, context: str, error_msg: str) -> Exception:
+    return RetryableError(f"未分类错误: {error_msg}", ErrorType.UNKNOWN_ERROR, e)
+
+def _build_error(e: Exception, error_msg: str, rules: tuple, default: tuple, name: str) -> Exception:
+    """按分类规则构造对应的异常"""
+    error_cls, prefix, error_type = _classify(rules, error_msg) or default
+    return error_cls(f"{prefix.format(name=name)}: {error_msg}", error_type, e)
+
+class ErrorHandler:
+    """错误处理器"""
+    
+    @staticmethod
+    def handle_file_error(e: Exception, file_path: str, error_msg: str = None) -> NonRetryableError:
+        """处理文件相关错误（error_msg为已计算的str(e)，可省略）"""
+        if isinstance(e, FileNotFoundError):
+            return NonRetryableError(f"文件不存在: {file_path}", ErrorType.FILE_ERROR, e)
+        elif isinstance(e, PermissionError):
+            return NonRetryableError(f"文件权限错误: {file_path}", ErrorType.FILE_ERROR, e)
+        elif isinstance(e, IOError):
+            return RetryableError(f"文件IO错误: {file_path}", ErrorType.FILE_ERROR, e)
+        else:
+            error_msg = str(e) if error_msg is None else error_msg
+            return NonRetryableError(f"文件处理错误: {error_msg}", ErrorType.FILE_ERROR, e)
+    
+    @staticmethod
+    def handle_api_error(e: Exception, api_name: str, error_msg: str = None) -> Exception:
+        """处理API相关错误（error_msg为已计算的str(e)，可省略）"""
+        error_msg = str(e) if error_msg is None else error_msg
+        return _build_error(e, error_msg, _API_ERROR_RULES, _API_ERROR_DEFAULT, api_name)
+    
+    @staticmethod
+    def handle_database_error(e: Exception, operation: str, error_msg: str = None) -> Exception:
+        """处理数据库相关错误（error_msg为已计算的str(e)，可省略）"""
+        error_msg = str(e) if error_msg is None else error_msg
+        return _build_error(e, error_msg, _DATABASE_ERROR_RULES, _DATABASE_ERROR_DEFAULT, operation)
+    
+    @staticmethod
+    def handle_parsing_error(e: Exception, file_name: str, error_msg: str = None) -> Exception:
+        """处理文档解析相关错误（error_msg为已计算的str(e)，可省略）"""
+        error_msg = str(e) if error_msg is None else error_msg
+        return _build_error(e, error_msg, _PARSING_ERROR_RULES, _PARSING_ERROR_DEFAULT, file_name)
+
+def safe_execute(func: Callable, *args, **kwargs) -> tuple[bool, Any, Optional[Exception]]:
+    """
+    安全执行函数，捕获所有异常
+    
+    Returns:
+        (success, result, error)
+    """
+    try:
+        result = func(*args, **kwargs)
+        return True, result, None
+    except Exception as e:
+        logger.error(f"执行 {func.__name__} 时发生错误: {str(e)}")
+        logger.debug(traceback.format_exc())
+        return False, None, e
+
+class TaskErrorTracker:
+    """任务错误跟踪器"""
+    
+    def __init__(self, max_history: int = 1000, max_tasks: int = 10_000, ttl: float = 86_400.0):
+        """
+        Args:
+            max_history: 保留的错误记录条数
+            max_tasks: 最多跟踪的任务数量，超出时淘汰最久未出错的任务
+            ttl: 任务错误计数的有效期（秒），超过此时间未再出错则清零
+        """
+        # 任务ID -> (错误次数, 最近一次错误时间)，按最近错误时间排序
+        self.error_counts = OrderedDict()
+        self.max_tasks = max_tasks
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # 定长队列，超出时O(1)淘汰最旧的记录
+        self.error_history = deque(maxlen=max_history)
+    
+    def _evict(self, now: float):
+        """淘汰超出数量上限或已过期的任务计数（调用方持有锁）"""
+        while self.error_counts:
+            _, last_error_time = next(iter(self.error_counts.values()))
+            if len(self.error_counts) > self.max_tasks or now - last_error_time > self.ttl:
+                self.error_counts.popitem(last=False)
+            else:
+                break
+    
+    def record_error(self, task_id: str, error: Exception):
+        """记录错误"""
+        now = time.monotonic()
+        with self._lock:
+            count, _ = self.error_counts.pop(task_id, (0, now))
+            self.error_counts[task_id] = (count + 1, now)
+            self._evict(now)
+        
+        error_record = {
+            "task_id": task_id,
+            "error_type": type(error).__name__,
+            "error_message": str(error),
+            "timestamp": time.time()
+        }
+        
+        self.error_history.append(error_record)
+    
+    def get_error_count(self, task_id: str) -> int:
+        """获取任务错误次数"""
+        with self._lock:
+            entry = self.error_counts.get(task_id)
+            if entry is None:
+                return 0
+            count, last_error_time = entry
+            if time.monotonic() - last_error_time > self.ttl:
+                del self.error_counts[task_id]
+                return 0
+            return count
+    
+    def clear_task(self, task_id: str):
+        """任务成功完成后清除其错误计数"""
+        with self._lock:
+            self.error_counts.pop(task_id, None)
+    
+    def should_skip_task(self, task_id: str, max_errors: int = 5) -> bool:
+        """判断是否应该跳过任务"""
+        return self.get_error_count(task_id) >= max_errors
+    
+    def get_error_summary(self) -> dict:
+        """获取错误摘要"""
+        total_errors = len(self.error_history)
+        error_types = {}
+        with self._lock:
+            self._evict(time.monotonic())
+            tasks_with_errors = len(self.error_counts)
+        
+        for record in itertools.islice(reversed(self.error_history), 100):  # 最近100个错误
+            error_type = record["error_type"]
+            error_types[error_type] = error_types.get(error_type, 0) + 1
+        
+        return {
+            "total_errors": total_errors,
+            "error_types": error_types,
+            "tasks_with_errors": tasks_with_errors
+        }
+
+# 全局错误跟踪器实例
+error_tracker = TaskErrorTracker()
+
+def log_and_handle_error(task_id: str, error: Exception, context: str = "") -> Exception:
+    """
+    记录并处理错误
+    
+    Args:
+        task_id: 任务ID
+        error: 原始错误
+        context: 错误上下文
+        
+    Returns:
+        处理后的错误
+    """
+    # 记录错误
+    error_tracker.record_error(task_id, error)
+    
+    # 记录日志
+    error_msg = str(error)
+    logger.error(f"任务 {task_id} 在 {context} 阶段发生错误: {error_msg}")
+    
+    # 根据错误类型返回适当的异常
+    handler = _classify(_ERROR_ROUTES, error_msg) or _handle_unclassified_error
+    return handler(error, context, error_msg)
+
+if __name__ == "__main__":
+    # 测试重试机制
+    @retry_with_backoff(max_retries=2, base_delay=0.1)
+    def test_function():
+        import random
+        if random.random() < 0.7:
+            raise RetryableError("模拟可重试错误", ErrorType.API_ERROR)
+        return "成功"
+    
+    try:
+        result = test_function()
+        print(f"测试结果: {result}")
+    except Exception as e:
+        print(f"测试失败: {str(e)}")
+    
+    # 测试错误跟踪
+    print("错误跟踪测试:")
+    error_tracker.record_error("test_task", Exception("测试错误"))
     print(error_tracker.get_error_summary())
\ No newline at end of file
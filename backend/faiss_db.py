@@ -0,0 +1,463 @@
+"""
+FAISS向量数据库集成模块
+向量存储在FAISS IVF-PQ索引中，文档块内容和元数据存储在PostgreSQL的chunks表中，
+接口与ChromaVectorDB一致，适用于百万级以上的向量规模
+"""
+
+import os
+import fcntl
+import hashlib
+import threading
+import numpy as np
+import orjson
+from contextlib import contextmanager
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Union
+from sqlalchemy import delete, select, func
+
+from chroma_db import ChromaVectorDB, QueryCache, normalize_embeddings, BATCH_SIZE
+from database import get_database_manager, VectorChunk
+
+# IVF-PQ索引结构（PQ段数需整除向量维度），可通过环境变量调整
+FAISS_INDEX_FACTORY = os.getenv('FAISS_INDEX_FACTORY', 'IVF4096,PQ64')
+
+# 训练IVF-PQ所需的最少向量数（约为聚类中心数的39倍），达到前使用精确的Flat索引
+FAISS_TRAIN_SIZE = int(os.getenv('FAISS_TRAIN_SIZE', str(4096 * 39)))
+
+# 每次查询探测的倒排列表数量，越大召回越高、速度越慢
+FAISS_NPROBE = int(os.getenv('FAISS_NPROBE', '32'))
+
+
+class FaissVectorDB:
+    """FAISS向量数据库管理器（元数据存储在PostgreSQL）"""
+    
+    def __init__(self, persist_directory: str = "./faiss_db", batch_size: int = BATCH_SIZE):
+        """
+        初始化FAISS索引
+        
+        Args:
+            persist_directory: 索引文件持久化目录
+            batch_size: 每次写入PostgreSQL的块数量
+        """
+        import faiss  # 可选依赖，仅在使用FAISS后端时需要
+        
+        self.faiss = faiss
+        self.batch_size = max(1, batch_size)
+        self.persist_directory = persist_directory
+        self.index_path = os.path.join(persist_directory, "documents.faiss")
+        # 多个Worker进程共用索引文件：写入和训练各用一个文件锁串行化
+        self.lock_path = self.index_path + ".lock"
+        self.train_lock_path = self.index_path + ".train.lock"
+        self.db_manager = get_database_manager()
+        self._query_cache = QueryCache()
+        self._lock = threading.RLock()
+        self._index = None
+        self._index_mtime = None
+        
+        os.makedirs(persist_directory, exist_ok=True)
+        print(f"📁 使用本地FAISS索引: {self.index_path}")
+    
+    @staticmethod
+    def _vector_id(chunk_id: str) -> int:
+        """由块ID（与ChromaDB命名规则一致）派生稳定的int64向量ID"""
+        return int.from_bytes(hashlib.blake2b(chunk_id.encode(), digest_size=8).digest(), "big") & 0x7FFF_FFFF_FFFF_FFFF
+    
+    @classmethod
+    def _vector_ids(cls, file_id: str, count: int) -> np.ndarray:
+        """生成文件各块的向量ID"""
+        return np.array([cls._vector_id(chunk_id) for chunk_id in ChromaVectorDB._chunk_ids(file_id, count)], dtype=np.int64)
+    
+    def _index_version(self) -> int:
+        """索引文件的修改时间（纳秒），文件不存在时返回0"""
+        try:
+            return os.stat(self.index_path).st_mtime_ns
+        except FileNotFoundError:
+            return 0
+    
+    def _load_index(self, dim: Optional[int] = None, reload: bool = False):
+        """
+        加载索引；其他进程写入后索引文件会更新，这里按修改时间重新加载
+        
+        修改索引前必须持有写锁并传入reload=True：修改时间的精度不足以区分短时间内的多次写入
+        """
+        try:
+            mtime = os.path.getmtime(self.index_path)
+        except FileNotFoundError:
+            mtime = None
+        if mtime is not None and (reload or mtime != self._index_mtime):
+            self._index = self.faiss.read_index(self.index_path)
+            self._index_mtime = mtime
+        elif self._index is None and dim is not None:
+            # 向量较少时使用精确检索，足够训练后再切换为IVF-PQ
+            self._index = self.faiss.index_factory(dim, "IDMap2,Flat", self.faiss.METRIC_INNER_PRODUCT)
+        
+        if self._index is not None and self._index.is_trained and self.faiss.try_extract_index_ivf(self._index) is not None:
+            self.faiss.extract_index_ivf(self._index).nprobe = FAISS_NPROBE
+        return self._index
+    
+    @contextmanager
+    def _write_lock(self):
+        """
+        跨进程写锁：Celery的多个prefork进程各自加载-修改-保存整个索引文件，
+        不串行化时后保存的进程会覆盖其他进程写入的向量
+        """
+        with self._lock, open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+    
+    def needs_training(self) -> bool:
+        """Flat索引中的向量是否已足够训练IVF-PQ索引"""
+        with self._lock:
+            index = self._load_index()
+            return index is not None and self.faiss.try_extract_index_ivf(index) is None and index.ntotal >= FAISS_TRAIN_SIZE
+    
+    def train_index(self) -> bool:
+        """
+        将Flat索引迁移到IVF-PQ索引（耗时较长，由单独的任务调用，不在文档存储路径上执行）
+        
+        训练基于向量快照在写锁之外进行，只在最后填充并保存新索引时持有写锁；
+        同一时间只有一个进程训练，其他进程直接返回
+        
+        Returns:
+            是否完成了迁移
+        """
+        with open(self.train_lock_path, "a") as train_lock:
+            try:
+                fcntl.flock(train_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                print("⏳ FAISS索引正在由其他进程训练")
+                return False
+            
+            with self._write_lock():
+                index = self._load_index(reload=True)
+                if index is None or self.faiss.try_extract_index_ivf(index) is not None or index.ntotal < FAISS_TRAIN_SIZE:
+                    return False
+                training_vectors = index.index.reconstruct_n(0, index.ntotal)
+            
+            print(f"🔧 训练FAISS IVF-PQ索引: {FAISS_INDEX_FACTORY} ({len(training_vectors)} 个向量)")
+            ivf_index = self.faiss.index_factory(index.d, FAISS_INDEX_FACTORY, self.faiss.METRIC_INNER_PRODUCT)
+            ivf_index.train(training_vectors)
+            
+            with self._write_lock():
+                # 训练期间其他进程可能写入或删除了向量，按最新的索引填充
+                index = self._load_index(reload=True)
+                if index is None or self.faiss.try_extract_index_ivf(index) is not None:
+                    return False
+                vectors = index.index.reconstruct_n(0, index.ntotal)
+                ids = self.faiss.vector_to_array(index.id_map)
+                ivf_index.add_with_ids(vectors, ids)
+                self.faiss.extract_index_ivf(ivf_index).nprobe = FAISS_NPROBE
+                self._index = ivf_index
+                self._save_index()
+        
+        print(f"✅ FAISS索引已迁移到 {FAISS_INDEX_FACTORY}")
+        return True
+    
+    def _save_index(self):
+        """写入临时文件后原子替换，避免读取方加载到不完整的索引"""
+        tmp_path = self.index_path + ".tmp"
+        self.faiss.write_index(self._index, tmp_path)
+        os.replace(tmp_path, self.index_path)
+        self._index_mtime = os.path.getmtime(self.index_path)
+    
+    def store_document_chunks(self, file_id: str, filename: str, chunks: List[Dict[str, Any]], embeddings: Union[np.ndarray, List[List[float]]]) -> bool:
+        """
+        存储文档块：向量写入FAISS索引，内容和元数据写入chunks表
+        
+        Args:
+            file_id: 文件ID
+            filename: 文件名
+            chunks: 文档块列表
+            embeddings: 对应的向量嵌入（列表或N×D数组），存储前会归一化
+        
+        Returns:
+            存储是否成功
+        """
+        try:
+            if len(chunks) != len(embeddings):
+                raise ValueError(f"块数量({len(chunks)})与向量数量({len(embeddings)})不匹配")
+            if not chunks:
+                return True
+            
+            vectors = normalize_embeddings(embeddings)
+            ids = self._vector_ids(file_id, len(chunks))
+            file_uuid = self.db_manager._to_uuid(file_id)
+            file_id_str = str(file_id)
+            filename_str = str(filename)
+            now_iso = datetime.now().isoformat()
+            
+            rows = [
+                {
+                    "id": int(vector_id),
+                    "file_id": file_uuid,
+                    "chunk_index": i,
+                    "content": chunk.get('content', ''),
+                    "chunk_metadata": {
+                        "file_id": file_id_str,
+                        "filename": filename_str,
+                        "chunk_index": i,
+                        "chunk_title": str(chunk.get('title', '')),
+                        "chunk_summary": str(chunk.get('summary', '')),
+                        "chunk_type": str(chunk.get('type', 'unknown')),
+                        "created_at": now_iso,
+                        "content_length": len(chunk.get('content', ''))
+                    }
+                }
+                for i, (vector_id, chunk) in enumerate(zip(ids, chunks))
+            ]
+            
+            # 重新处理同一文件时覆盖该文件的全部旧块（新块数可能少于旧块数）
+            with self.db_manager.session() as db:
+                old_ids = db.execute(
+                    delete(VectorChunk).where(VectorChunk.file_id == file_uuid).returning(VectorChunk.id)
+                ).scalars().all()
+                for start in range(0, len(rows), self.batch_size):
+                    db.bulk_insert_mappings(VectorChunk, rows[start:start + self.batch_size])
+            
+            with self._write_lock():
+                index = self._load_index(vectors.shape[1], reload=True)
+                index.remove_ids(np.union1d(np.array(old_ids, dtype=np.int64), ids))
+                index.add_with_ids(vectors, ids)
+                self._save_index()
+            
+            self._query_cache.clear()
+            print(f"✅ 文档块存储成功: {filename} ({len(chunks)} 块)")
+            return True
+        
+        except Exception as e:
+            print(f"❌ 存储文档块失败: {str(e)}")
+            return False
+    
+    def _fetch_chunks(self, ids: List[int]) -> Dict[int, VectorChunk]:
+        """按向量ID批量读取块记录"""
+        with self.db_manager.session() as db:
+            records = db.execute(select(VectorChunk).where(VectorChunk.id.in_(ids))).scalars().all()
+        return {record.id: record for record in records}
+    
+    @staticmethod
+    def _chunk_to_dict(record: VectorChunk) -> Dict[str, Any]:
+        """将块记录转换为与ChromaVectorDB一致的结果格式"""
+        return {
+            "id": f"{record.file_id}_chunk_{record.chunk_index}",
+            "content": record.content,
+            "metadata": record.chunk_metadata or {}
+        }
+    
+    def search_similar_documents(self, query_embedding: Optional[List[float]] = None, n_results: int = 5, file_id: Optional[str] = None, query_text: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        搜索相似文档
+        
+        Args:
+            query_embedding: 查询向量（FAISS后端必需）
+            n_results: 返回结果数量
+            file_id: 可选，限制搜索特定文件
+            query_text: 未使用，FAISS无法嵌入文本
+        
+        Returns:
+            相似文档列表
+        """
+        if query_embedding is None:
+            raise ValueError("FAISS后端需要提供query_embedding")
+        
+        query_vectors = normalize_embeddings([query_embedding])
+        # 写入发生在Celery Worker进程中，不会清空本进程的缓存；键中带上索引文件版本，索引更新后自动失效
+        cache_key = QueryCache.make_key(query_vectors.tobytes(), n_results, file_id, self._index_version())
+        cached = self._query_cache.get(cache_key)
+        if cached is not None:
+            return list(cached)
+        
+        try:
+            sel = None
+            if file_id:
+                # 只在该文件的向量中搜索
+                file_uuid = self.db_manager._to_uuid(file_id)
+                with self.db_manager.session() as db:
+                    file_ids = db.execute(select(VectorChunk.id).where(VectorChunk.file_id == file_uuid)).scalars().all()
+                if not file_ids:
+                    return []
+                # 参数对象不持有选择器的所有权，选择器必须保存在局部变量中直到搜索结束
+                sel = self.faiss.IDSelectorBatch(np.array(file_ids, dtype=np.int64))
+            
+            with self._lock:
+                index = self._load_index()
+                if index is None or index.ntotal == 0:
+                    return []
+                params = None
+                if sel is not None:
+                    if self.faiss.try_extract_index_ivf(index) is not None:
+                        params = self.faiss.SearchParametersIVF(sel=sel, nprobe=FAISS_NPROBE)
+                    else:
+                        params = self.faiss.SearchParameters(sel=sel)
+                scores, ids = index.search(query_vectors, n_results, params=params)
+            
+            hits = [(int(vector_id), float(score)) for vector_id, score in zip(ids[0], scores[0]) if vector_id != -1]
+            records = self._fetch_chunks([vector_id for vector_id, _ in hits])
+            
+            formatted_results = []
+            for vector_id, score in hits:
+                record = records.get(vector_id)
+                if record is not None:
+                    result = self._chunk_to_dict(record)
+                    # 单位向量的内积即余弦相似度，转换为与ChromaDB一致的距离语义
+                    result["distance"] = 1.0 - score
+                    formatted_results.append(result)
+            
+            self._query_cache.set(cache_key, formatted_results)
+            return list(formatted_results)
+        
+        except Exception as e:
+            print(f"❌ 搜索失败: {str(e)}")
+            return []
+    
+    def get_file_chunks(self, file_id: str, chunks_count: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        获取特定文件的所有块
+        
+        Args:
+            file_id: 文件ID
+            chunks_count: 未使用，与ChromaVectorDB接口保持一致
+        
+        Returns:
+            文件块列表
+        """
+        try:
+            file_uuid = self.db_manager._to_uuid(file_id)
+            with self.db_manager.session() as db:
+                records = db.execute(
+                    select(VectorChunk)
+                    .where(VectorChunk.file_id == file_uuid)
+                    .order_by(VectorChunk.chunk_index)
+                ).scalars().all()
+            return [self._chunk_to_dict(record) for record in records]
+        
+        except Exception as e:
+            print(f"❌ 获取文件块失败: {str(e)}")
+            return []
+    
+    def delete_file_chunks(self, file_id: str, chunks_count: Optional[int] = None) -> bool:
+        """
+        删除特定文件的所有块
+        
+        Args:
+            file_id: 文件ID
+            chunks_count: 未使用，与ChromaVectorDB接口保持一致
+        
+        Returns:
+            删除是否成功
+        """
+        try:
+            file_uuid = self.db_manager._to_uuid(file_id)
+            with self.db_manager.session() as db:
+                ids = db.execute(
+                    delete(VectorChunk).where(VectorChunk.file_id == file_uuid).returning(VectorChunk.id)
+                ).scalars().all()
+            
+            if not ids:
+                print(f"⚠️  文件块不存在: {file_id}")
+                return True
+            
+            with self._write_lock():
+                index = self._load_index(reload=True)
+                if index is not None:
+                    index.remove_ids(np.array(ids, dtype=np.int64))
+                    self._save_index()
+            
+            self._query_cache.clear()
+            print(f"✅ 已删除文件块: {file_id} ({len(ids)} 块)")
+            return True
+        
+        except Exception as e:
+            print(f"❌ 删除文件块失败: {str(e)}")
+            return False
+    
+    def get_collection_stats(self) -> Dict[str, Any]:
+        """
+        获取索引统计信息
+        
+        Returns:
+            统计信息字典
+        """
+        try:
+            with self._lock:
+                index = self._load_index()
+                total_chunks = index.ntotal if index is not None else 0
+                index_type = "IVF-PQ" if index is not None and self.faiss.try_extract_index_ivf(index) is not None else "Flat"
+            
+            with self.db_manager.session() as db:
+                total_files = db.execute(select(func.count(func.distinct(VectorChunk.file_id)))).scalar()
+            
+            return {
+                "total_files": total_files,
+                "total_chunks": total_chunks,
+                "collection_name": "documents",
+                "storage_mode": f"FAISS ({index_type})",
+                "persist_directory": self.persist_directory
+            }
+        
+        except Exception as e:
+            print(f"❌ 获取统计信息失败: {str(e)}")
+            return {"error": str(e)}
+    
+    def backup_collection(self, backup_path: str, page_size: int = 10_000) -> bool:
+        """
+        备份索引和块数据
+        
+        - backup_path: NDJSON文件，首行为索引信息，之后每行一个文档块(id/document/metadata)
+        - <backup_path去扩展名>.faiss: FAISS索引文件
+        
+        Args:
+            backup_path: 备份文件路径
+            page_size: 每次从数据库读取的块数量
+        
+        Returns:
+            备份是否成功
+        """
+        try:
+            index_backup_path = os.path.splitext(backup_path)[0] + ".faiss"
+            total = 0
+            
+            with self._lock:
+                index = self._load_index()
+                if index is not None:
+                    self.faiss.write_index(index, index_backup_path)
+            
+            with open(backup_path, 'wb') as f, self.db_manager.session() as db:
+                header = {
+                    "collection_name": "documents",
+                    "backup_time": datetime.now(),
+                    "index_file": os.path.basename(index_backup_path)
+                }
+                f.write(orjson.dumps(header, option=orjson.OPT_APPEND_NEWLINE))
+                
+                records = db.execute(
+                    select(VectorChunk).execution_options(yield_per=page_size)
+                ).scalars()
+                for record in records:
+                    chunk = self._chunk_to_dict(record)
+                    record_data = {"id": chunk["id"], "vector_id": record.id, "document": chunk["content"], "metadata": chunk["metadata"]}
+                    f.write(orjson.dumps(record_data, option=orjson.OPT_APPEND_NEWLINE))
+                    total += 1
+            
+            print(f"✅ 数据备份成功: {backup_path} ({total} 块)")
+            return True
+        
+        except Exception as e:
+            print(f"❌ 数据备份失败: {str(e)}")
+            return False
+
+
+def create_vector_db():
+    """
+    按VECTOR_BACKEND环境变量创建向量数据库（chroma或faiss，默认chroma）
+    
+    FAISS未安装或初始化失败时回退到ChromaDB
+    """
+    if os.getenv('VECTOR_BACKEND', 'chroma').lower() == 'faiss':
+        try:
+            return FaissVectorDB(os.getenv('FAISS_PERSIST_DIRECTORY', './faiss_db'))
+        except Exception as e:
+            print(f"⚠️  FAISS初始化失败，回退到ChromaDB: {str(e)}")
+    return ChromaVectorDB()
\ No newline at end of file
@@ -1,290 +1,377 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
-from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from typing import List, Dict, Any
-import uuid
-import os
-from datetime import datetime
-from database import get_database_manager, file_record_to_dict
-from chroma_db import ChromaVectorDB
-
-app = FastAPI(title="Document Vector Processing API")
-
-# CORS设置
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["http://localhost:3000", "http://localhost:5173"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-# 数据库管理器
-db_manager = get_database_manager()
-
-# 全局ChromaDB实例
-vector_db = None
-
-def get_vector_db():
-    """获取ChromaDB实例（单例模式）"""
-    global vector_db
-    if vector_db is None:
-        vector_db = ChromaVectorDB()
-    return vector_db
-
-# 确保上传目录存在
-UPLOAD_DIR = "uploads"
-os.makedirs(UPLOAD_DIR, exist_ok=True)
-
-@app.get("/")
-async def root():
-    return {"message": "Document Vector Processing API"}
-
-@app.post("/api/upload-files")
-async def upload_files(files: List[UploadFile] = File(...)):
-    """批量上传PDF文件"""
-    uploaded_files = []
-    
-    for file in files:
-        if not file.filename.endswith('.pdf'):
-            raise HTTPException(status_code=400, detail=f"只支持PDF文件: {file.filename}")
-        
-        # 生成唯一文件ID
-        file_id = str(uuid.uuid4())
-        file_path = os.path.join(UPLOAD_DIR, f"{file_id}.pdf")
-        
-        # 保存文件
-        content = await file.read()
-        with open(file_path, "wb") as f:
-            f.write(content)
-        
-        # 创建数据库记录
-        try:
-            db_manager.create_file_record(
-                file_id=file_id,
-                filename=file.filename,
-                filepath=file_path
-            )
-            
-            uploaded_files.append({
-                "id": file_id,
-                "filename": file.filename,
-                "status": "pending"
-            })
-        except Exception as e:
-            # 如果数据库操作失败，删除已保存的文件
-            if os.path.exists(file_path):
-                os.remove(file_path)
-            raise HTTPException(status_code=500, detail=f"数据库操作失败: {str(e)}")
-    
-    return {"files": uploaded_files, "message": f"成功上传 {len(uploaded_files)} 个文件"}
-
-@app.get("/api/files/status")
-async def get_all_files_status():
-    """获取所有文件的处理状态"""
-    try:
-        file_records = db_manager.get_all_file_records()
-        files = [file_record_to_dict(record) for record in file_records]
-        return {"files": files}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"获取文件状态失败: {str(e)}")
-
-@app.get("/api/files/{file_id}/status")
-async def get_file_status(file_id: str):
-    """获取单个文件的处理状态"""
-    try:
-        file_record = db_manager.get_file_record(file_id)
-        if not file_record:
-            raise HTTPException(status_code=404, detail="文件不存在")
-        
-        return file_record_to_dict(file_record)
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"获取文件状态失败: {str(e)}")
-
-@app.post("/api/files/{file_id}/process")
-async def process_file(file_id: str):
-    """开始处理单个文件"""
-    try:
-        file_record = db_manager.get_file_record(file_id)
-        if not file_record:
-            raise HTTPException(status_code=404, detail="文件不存在")
-        
-        # 导入Celery任务
-        from tasks import process_document
-        
-        # 更新状态为等待处理
-        db_manager.update_file_status(file_id, "pending", 0, "已加入处理队列...")
-        
-        # 提交到Celery队列
-        task = process_document.delay(file_id)
-        
-        return {"message": f"文件 {file_id} 已加入处理队列", "task_id": task.id}
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"启动处理失败: {str(e)}")
-
-@app.post("/api/process-all")
-async def process_all_files():
-    """开始处理所有待处理的文件"""
-    try:
-        from tasks import process_document
-        
-        # 获取所有待处理的文件
-        all_records = db_manager.get_all_file_records()
-        pending_files = [record for record in all_records if record.status == "pending"]
-        
-        task_ids = []
-        for file_record in pending_files:
-            # 提交到Celery队列
-            task = process_document.delay(file_record.id)
-            task_ids.append(task.id)
-        
-        return {
-            "message": f"已将 {len(pending_files)} 个文件加入处理队列",
-            "task_ids": task_ids
-        }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"批量处理失败: {str(e)}")
-
-@app.delete("/api/files/{file_id}")
-async def delete_file(file_id: str):
-    """删除文件"""
-    try:
-        file_record = db_manager.get_file_record(file_id)
-        if not file_record:
-            raise HTTPException(status_code=404, detail="文件不存在")
-        
-        # 删除向量数据库中的数据
-        try:
-            db = get_vector_db()
-            db.delete_file_chunks(file_id)
-        except Exception as e:
-            print(f"删除向量数据失败: {str(e)}")
-        
-        # 删除物理文件
-        if os.path.exists(file_record.filepath):
-            os.remove(file_record.filepath)
-        
-        # 删除数据库记录
-        db_manager.delete_file_record(file_id)
-        
-        return {"message": f"文件 {file_record.filename} 已删除"}
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"删除文件失败: {str(e)}")
-
-@app.post("/api/search")
-async def search_documents(query: dict):
-    """向量搜索文档"""
-    try:
-        query_text = query.get("query", "")
-        n_results = query.get("n_results", 5)
-        file_id = query.get("file_id")  # 可选：限制搜索特定文件
-        
-        if not query_text.strip():
-            raise HTTPException(status_code=400, detail="查询文本不能为空")
-        
-        db = get_vector_db()
-        results = db.search_similar_documents(
-            query_text=query_text,
-            n_results=n_results,
-            file_id=file_id
-        )
-        
-        return {"query": query_text, "results": results}
-        
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"搜索失败: {str(e)}")
-
-@app.get("/api/database/stats")
-async def get_database_stats():
-    """获取数据库统计信息"""
-    try:
-        # 获取处理统计
-        processing_stats = db_manager.get_processing_statistics()
-        
-        # 获取向量数据库统计
-        try:
-            vector_db_instance = get_vector_db()
-            vector_stats = vector_db_instance.get_collection_stats()
-        except Exception as e:
-            print(f"获取向量数据库统计失败: {str(e)}")
-            vector_stats = {"error": "无法获取向量数据库统计"}
-        
-        return {
-            "stats": {
-                **processing_stats,
-                "vector_db": vector_stats
-            }
-        }
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"获取统计信息失败: {str(e)}")
-
-@app.get("/api/files/{file_id}/chunks")
-async def get_file_chunks(file_id: str):
-    """获取文件的所有文档块"""
-    try:
-        # 检查文件是否存在
-        file_record = db_manager.get_file_record(file_id)
-        if not file_record:
-            raise HTTPException(status_code=404, detail="文件不存在")
-        
-        db = get_vector_db()
-        chunks = db.get_file_chunks(file_id)
-        
-        return {"file_id": file_id, "chunks": chunks}
-        
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"获取文档块失败: {str(e)}")
-
-@app.get("/api/files/{file_id}/logs")
-async def get_file_processing_logs(file_id: str):
-    """获取文件处理日志"""
-    try:
-        file_record = db_manager.get_file_record(file_id)
-        if not file_record:
-            raise HTTPException(status_code=404, detail="文件不存在")
-        
-        logs = db_manager.get_processing_logs(file_id)
-        log_data = []
-        for log in logs:
-            log_data.append({
-                "stage": log.stage,
-                "status": log.status,
-                "message": log.message,
-                "duration": log.duration,
-                "created_at": log.created_at.isoformat()
-            })
-        
-        return {"file_id": file_id, "logs": log_data}
-        
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"获取处理日志失败: {str(e)}")
-
-@app.post("/api/database/cleanup")
-async def cleanup_old_records():
-    """清理旧记录"""
-    try:
-        result = db_manager.cleanup_old_records(days=7)
-        return {
-            "message": "清理完成",
-            "deleted_files": result["deleted_files"],
-            "deleted_logs": result["deleted_logs"]
-        }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"清理失败: {str(e)}")
-
-if __name__ == "__main__":
-    import uvicorn
+from fastapi import FastAPI, UploadFile, File, HTTPException, Request
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, ORJSONResponse
+from typing import List, Dict, Any
+import uuid
+import os
+import shutil
+import asyncio
+from pathlib import Path
+from datetime import datetime
+from database import get_database_manager, file_record_to_dict
+from faiss_db import create_vector_db
+from ollama_processor import OllamaProcessor
+from error_handler import retry_with_backoff, CircuitOpenError, set_request_deadline, reset_request_deadline
+from tasks import process_document, process_documents_pipelined, PIPELINE_BATCH_SIZE
+from kombu.exceptions import OperationalError
+from celery import group
+
+# 使用orjson序列化响应，文件列表、搜索结果等较大响应的编码更快
+app = FastAPI(title="Document Vector Processing API", default_response_class=ORJSONResponse)
+
+# 请求默认超时时间（秒），客户端可通过X-Request-Timeout请求头指定
+REQUEST_TIMEOUT = float(os.getenv('REQUEST_TIMEOUT', '30'))
+
+@app.middleware("http")
+async def request_deadline_middleware(request: Request, call_next):
+    """设置请求截止时间，重试等待超过截止时间时直接失败，不在客户端已放弃的请求上空等"""
+    try:
+        timeout = float(request.headers.get("X-Request-Timeout", REQUEST_TIMEOUT))
+    except ValueError:
+        timeout = REQUEST_TIMEOUT
+    token = set_request_deadline(timeout)
+    try:
+        return await call_next(request)
+    finally:
+        reset_request_deadline(token)
+
+# 调用数据库、ChromaDB、Ollama等同步客户端的接口定义为普通def，
+# 由FastAPI在线程池中执行，避免阻塞事件循环
+
+# CORS设置
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["http://localhost:3000", "http://localhost:5173"],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
+# 数据库管理器
+db_manager = get_database_manager()
+
+# 全局ChromaDB实例
+vector_db = None
+
+def get_vector_db():
+    """获取向量数据库实例（单例模式）"""
+    global vector_db
+    if vector_db is None:
+        vector_db = create_vector_db()
+    return vector_db
+
+# 全局Ollama实例（用于查询向量化）
+embedding_processor = None
+
+def get_embedding_processor():
+    """获取Ollama实例（单例模式）"""
+    global embedding_processor
+    if embedding_processor is None:
+        embedding_processor = OllamaProcessor()
+    return embedding_processor
+
+# 确保上传目录存在
+UPLOAD_DIR = "uploads"
+os.makedirs(UPLOAD_DIR, exist_ok=True)
+
+# 在请求处理中调用，不做重试等待，只用熔断器快速失败
+broker_guard = retry_with_backoff(
+    max_retries=0,
+    retryable_exceptions=(ConnectionError, TimeoutError, OperationalError),
+    target="broker"
+)
+
+@broker_guard
+def dispatch_document(file_id: str):
+    """提交文档处理任务；broker持续不可用时熔断，直接返回503而不是逐个请求等待重试"""
+    return process_document.delay(str(file_id))
+
+@broker_guard
+def dispatch_documents(file_ids: List[str]) -> List[str]:
+    """
+    以group一次性提交多个文档处理任务（共用一个broker连接），返回任务ID列表
+    
+    每PIPELINE_BATCH_SIZE个文件提交为一个流水线任务，任务内解析、分块、向量化重叠执行
+    """
+    if not file_ids:
+        return []
+    file_ids = [str(file_id) for file_id in file_ids]
+    batches = [file_ids[i:i + PIPELINE_BATCH_SIZE] for i in range(0, len(file_ids), PIPELINE_BATCH_SIZE)]
+    job = group(process_documents_pipelined.s(batch) for batch in batches).apply_async()
+    return [result.id for result in job.results]
+
+def create_file_records(saved_files: list):
+    """在同一事务中为已保存的上传文件创建数据库记录"""
+    with db_manager.session() as db:
+        for file_id, file, file_path, file_size in saved_files:
+            db_manager.create_file_record(
+                file_id=file_id,
+                filename=file.filename,
+                filepath=file_path,
+                file_size=file_size,
+                mime_type=file.content_type,
+                db=db
+            )
+
+# 上传文件写入磁盘时每次复制的字节数
+UPLOAD_COPY_BUFFER = 1 << 20  # 1 MiB
+
+def save_upload_file(file: UploadFile, file_path: str) -> int:
+    """将上传文件分块复制到磁盘，返回文件大小（字节）；复制失败时删除写了一半的文件"""
+    try:
+        with open(file_path, "wb") as f:
+            shutil.copyfileobj(file.file, f, length=UPLOAD_COPY_BUFFER)
+            return f.tell()
+    except BaseException:
+        Path(file_path).unlink(missing_ok=True)
+        raise
+
+@app.get("/")
+async def root():
+    return {"message": "Document Vector Processing API"}
+
+@app.post("/api/upload-files")
+async def upload_files(files: List[UploadFile] = File(...)):
+    """批量上传PDF文件"""
+    for file in files:
+        if not file.filename.endswith('.pdf'):
+            raise HTTPException(status_code=400, detail=f"只支持PDF文件: {file.filename}")
+    
+    saved_files = []
+    try:
+        for file in files:
+            # 生成唯一文件ID
+            file_id = str(uuid.uuid4())
+            file_path = os.path.join(UPLOAD_DIR, f"{file_id}.pdf")
+            
+            # 分块流式写入磁盘，不把整个文件读入内存；在线程中执行避免阻塞事件循环
+            try:
+                file_size = await asyncio.to_thread(save_upload_file, file, file_path)
+            finally:
+                await file.close()
+            saved_files.append((file_id, file, file_path, file_size))
+        
+        # 所有文件记录在同一事务中创建，只提交一次
+        await asyncio.to_thread(create_file_records, saved_files)
+    except Exception as e:
+        # 保存或数据库操作失败时，删除本次已保存的文件
+        for _, _, file_path, _ in saved_files:
+            Path(file_path).unlink(missing_ok=True)
+        raise HTTPException(status_code=500, detail=f"数据库操作失败: {str(e)}")
+    
+    uploaded_files = [
+        {
+            "id": file_id,
+            "filename": file.filename,
+            "status": "pending"
+        }
+        for file_id, file, _, _ in saved_files
+    ]
+    
+    return {"files": uploaded_files, "message": f"成功上传 {len(uploaded_files)} 个文件"}
+
+@app.get("/api/files/status")
+def get_all_files_status():
+    """获取所有文件的处理状态"""
+    try:
+        files = db_manager.list_file_statuses()
+        # 行字段固定且均为orjson原生支持的类型（UUID、datetime），直接序列化，跳过jsonable_encoder的逐字段遍历
+        return ORJSONResponse({"files": files})
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"获取文件状态失败: {str(e)}")
+
+@app.get("/api/files/{file_id}/status")
+def get_file_status(file_id: str):
+    """获取单个文件的处理状态"""
+    try:
+        file_record = db_manager.get_file_record(file_id)
+        if not file_record:
+            raise HTTPException(status_code=404, detail="文件不存在")
+        
+        return ORJSONResponse(file_record_to_dict(file_record))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"获取文件状态失败: {str(e)}")
+
+@app.post("/api/files/{file_id}/process")
+def process_file(file_id: str):
+    """开始处理单个文件"""
+    try:
+        # 更新状态为等待处理（文件不存在时不会更新任何记录）
+        if not db_manager.update_file_status(file_id, "pending", 0, "已加入处理队列..."):
+            raise HTTPException(status_code=404, detail="文件不存在")
+        
+        # 提交到Celery队列
+        task = dispatch_document(file_id)
+        
+        return {"message": f"文件 {file_id} 已加入处理队列", "task_id": task.id}
+    except HTTPException:
+        raise
+    except CircuitOpenError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"启动处理失败: {str(e)}")
+
+@app.post("/api/process-all")
+def process_all_files():
+    """开始处理所有待处理的文件"""
+    try:
+        # 只查询待处理文件的ID，不加载全部文件记录
+        pending_file_ids = db_manager.get_file_ids_by_status("pending")
+        
+        task_ids = dispatch_documents(pending_file_ids)
+        
+        return {
+            "message": f"已将 {len(pending_file_ids)} 个文件加入处理队列",
+            "task_ids": task_ids
+        }
+    except CircuitOpenError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"批量处理失败: {str(e)}")
+
+@app.delete("/api/files/{file_id}")
+def delete_file(file_id: str):
+    """删除文件"""
+    try:
+        # 删除数据库记录，同时取回文件路径和块数量
+        file_record = db_manager.delete_file_record(file_id)
+        if not file_record:
+            raise HTTPException(status_code=404, detail="文件不存在")
+        
+        # 删除向量数据库中的数据
+        try:
+            db = get_vector_db()
+            db.delete_file_chunks(file_id, chunks_count=file_record.chunks_count)
+        except Exception as e:
+            print(f"删除向量数据失败: {str(e)}")
+        
+        # 删除物理文件（不存在时忽略，无需先检查）
+        Path(file_record.filepath).unlink(missing_ok=True)
+        
+        return {"message": f"文件 {file_record.filename} 已删除"}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"删除文件失败: {str(e)}")
+
+@app.post("/api/search")
+def search_documents(query: dict):
+    """向量搜索文档"""
+    try:
+        query_text = query.get("query", "")
+        n_results = query.get("n_results", 5)
+        file_id = query.get("file_id")  # 可选：限制搜索特定文件
+        
+        if not query_text.strip():
+            raise HTTPException(status_code=400, detail="查询文本不能为空")
+        
+        # 使用与入库相同的嵌入模型生成查询向量；失败时不能退回其他嵌入方式（维度和语义都与入库向量不一致）
+        try:
+            query_embedding = get_embedding_processor().embed_query(query_text)
+        except Exception as e:
+            print(f"查询向量化失败: {str(e)}")
+            raise HTTPException(status_code=503, detail=f"查询向量化失败，请稍后重试: {str(e)}")
+        
+        db = get_vector_db()
+        results = db.search_similar_documents(
+            query_embedding=query_embedding,
+            n_results=n_results,
+            file_id=file_id
+        )
+        
+        return {"query": query_text, "results": results}
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"搜索失败: {str(e)}")
+
+@app.get("/api/database/stats")
+def get_database_stats():
+    """获取数据库统计信息"""
+    try:
+        # 获取处理统计
+        processing_stats = db_manager.get_processing_statistics()
+        
+        # 获取向量数据库统计
+        try:
+            vector_db_instance = get_vector_db()
+            vector_stats = vector_db_instance.get_collection_stats()
+        except Exception as e:
+            print(f"获取向量数据库统计失败: {str(e)}")
+            vector_stats = {"error": "无法获取向量数据库统计"}
+        
+        return {
+            "stats": {
+                **processing_stats,
+                "vector_db": vector_stats
+            }
+        }
+        
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"获取统计信息失败: {str(e)}")
+
+@app.get("/api/files/{file_id}/chunks")
+def get_file_chunks(file_id: str):
+    """获取文件的所有文档块"""
+    try:
+        # 检查文件是否存在
+        file_record = db_manager.get_file_record(file_id)
+        if not file_record:
+            raise HTTPException(status_code=404, detail="文件不存在")
+        
+        db = get_vector_db()
+        chunks = db.get_file_chunks(file_id, chunks_count=file_record.chunks_count)
+        
+        return {"file_id": file_id, "chunks": chunks}
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"获取文档块失败: {str(e)}")
+
+@app.get("/api/files/{file_id}/logs")
+def get_file_processing_logs(file_id: str):
+    """获取文件处理日志"""
+    try:
+        logs = db_manager.get_processing_logs(file_id)
+        
+        # 有日志时文件必然存在，只有没有日志时才需要检查文件是否存在
+        if not logs and not db_manager.get_file_record(file_id):
+            raise HTTPException(status_code=404, detail="文件不存在")
+        
+        log_data = []
+        for log in logs:
+            log_data.append({
+                "stage": log.stage,
+                "status": log.status,
+                "message": log.message,
+                "duration": log.duration,
+                "created_at": log.created_at.isoformat()
+            })
+        
+        return {"file_id": file_id, "logs": log_data}
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"获取处理日志失败: {str(e)}")
+
+@app.post("/api/database/cleanup")
+def cleanup_old_records():
+    """清理旧记录"""
+    try:
+        result = db_manager.cleanup_old_records(days=7)
+        return {
+            "message": "清理完成",
+            "deleted_files": result["deleted_files"],
+            "deleted_logs": result["deleted_logs"]
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"清理失败: {str(e)}")
+
+if __name__ == "__main__":
+    import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8080)
\ No newline at end of file
@@ -1,141 +1,328 @@
-"""
-PDF文档解析模块
-使用PyPDF2进行PDF文档解析
-"""
-
-import os
-from typing import Dict, Any
-import traceback
-
-
-class MinerUParser:
-    """PDF文档解析器"""
-    
-    def __init__(self, api_host: str = None, api_port: int = None):
-        """
-        初始化PDF解析器
-        """
-        # 保留参数以兼容旧版本调用
-        pass
-        
-    def parse_pdf(self, pdf_path: str) -> Dict[str, Any]:
-        """
-        解析PDF文档
-        
-        Args:
-            pdf_path: PDF文件路径
-            
-        Returns:
-            解析结果字典，包含文本内容、表格、图片等信息
-        """
-        if not os.path.exists(pdf_path):
-            raise FileNotFoundError(f"PDF文件不存在: {pdf_path}")
-            
-        try:
-            print(f"📄 使用PyPDF2解析PDF: {os.path.basename(pdf_path)}")
-            return self._pypdf2_parse(pdf_path)
-            
-        except Exception as e:
-            print(f"PDF解析失败: {str(e)}")
-            print(traceback.format_exc())
-            return {
-                "content": f"解析失败: {str(e)}",
-                "metadata": {"total_pages": 0, "parser": "failed"},
-                "tables": [],
-                "images": [],
-                "structure": {"headings": [], "paragraphs": [], "lists": []}
-            }
-    
-    def _pypdf2_parse(self, pdf_path: str) -> Dict[str, Any]:
-        """使用PyPDF2解析PDF"""
-        try:
-            import PyPDF2
-            
-            with open(pdf_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                content = ""
-                total_pages = len(pdf_reader.pages)
-                
-                print(f"📖 开始解析 {total_pages} 页PDF文档...")
-                
-                for page_num, page in enumerate(pdf_reader.pages):
-                    try:
-                        page_text = page.extract_text()
-                        content += f"\n=== 第 {page_num + 1} 页 ===\n"
-                        content += page_text + "\n"
-                        
-                        if (page_num + 1) % 5 == 0:  # 每5页打印一次进度
-                            print(f"📄 已解析 {page_num + 1}/{total_pages} 页")
-                            
-                    except Exception as e:
-                        print(f"⚠️ 第{page_num + 1}页解析出错: {str(e)}")
-                        content += f"\n=== 第 {page_num + 1} 页 (解析失败) ===\n"
-                        content += f"解析错误: {str(e)}\n"
-                
-                # 简单的内容分析
-                lines = content.split('\n')
-                paragraphs = [line.strip() for line in lines if line.strip() and len(line.strip()) > 10]
-                
-                # 统计信息
-                tables_count = content.count('|') // 10  # 简单估算表格数量
-                
-                result = {
-                    "content": content,
-                    "metadata": {
-                        "total_pages": total_pages,
-                        "tables_count": tables_count,
-                        "images_count": 0,  # PyPDF2无法提取图片
-                        "formulas_count": content.count('$') // 2,  # 简单估算公式
-                        "parser": "PyPDF2",
-                        "content_length": len(content)
-                    },
-                    "tables": [],  # PyPDF2无法提取结构化表格
-                    "images": [],  # PyPDF2无法提取图片
-                    "structure": {
-                        "headings": self._extract_headings(content),
-                        "paragraphs": paragraphs[:50],  # 限制段落数量
-                        "lists": []
-                    }
-                }
-                
-                print(f"✅ PyPDF2解析完成: {total_pages} 页，{len(content)} 字符")
-                return result
-                
-        except ImportError:
-            raise Exception("PyPDF2 未安装，无法解析PDF")
-        except Exception as e:
-            print(f"PyPDF2解析失败: {str(e)}")
-            raise
-    
-    def _extract_headings(self, content: str) -> list:
-        """从内容中提取可能的标题"""
-        lines = content.split('\n')
-        headings = []
-        
-        for line in lines:
-            line = line.strip()
-            # 简单的标题识别规则
-            if (line and len(line) < 100 and  # 不太长
-                any(char.isdigit() for char in line) and  # 包含数字
-                (line.endswith('。') or line.endswith('.') or  # 以句号结尾
-                 any(word in line for word in ['章', '节', '部分', '摘要', '结论', 'Chapter', 'Section']))):  # 包含关键词
-                headings.append({
-                    "level": 1,  # 简单设为1级标题
-                    "title": line[:50]  # 限制标题长度
-                })
-                
-        return headings[:10]  # 限制标题数量
-
-
-def test_mineru_parser():
-    """测试PDF解析器"""
-    parser = MinerUParser()
-    
-    print("PDF解析器测试:")
-    print("✅ 使用PyPDF2作为PDF解析引擎")
-    print("📋 功能: 提取文本内容、基础结构分析")
-    print("⚠️  限制: 无法提取图片、表格结构，但稳定可靠")
-
-
-if __name__ == "__main__":
+"""
+PDF文档解析模块
+优先使用PyMuPDF（MuPDF C库）解析PDF文档，未安装时回退到PyPDF2
+"""
+
+import io
+import os
+import re
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Any, List, Tuple
+import traceback
+
+
+# 字号不小于正文字号该倍数的短行视为标题候选
+HEADING_SIZE_RATIO = 1.15
+
+# 标题识别关键词（编译为一个正则，每行只扫描一次）
+_HEADING_KEYWORD_RE = re.compile(r'章|节|部分|摘要|结论|Chapter|Section')
+_DIGIT_RE = re.compile(r'\d')
+
+# 页数不超过该值时直接在当前进程解析，避免进程池启动开销
+PARALLEL_MIN_PAGES = 8
+
+
+def _get_max_workers() -> int:
+    """页面解析进程数"""
+    return min(os.cpu_count() or 1, 8)
+
+
+def _extract_pages(args: Tuple[str, int, int]) -> List[Tuple[int, str, str]]:
+    """
+    在子进程中解析一段连续页面
+    
+    每个进程自行打开PDF，只传递路径（可pickle），不传递PdfReader对象
+    
+    Returns:
+        (页码, 页面文本, 错误信息) 列表
+    """
+    import PyPDF2
+    
+    pdf_path, start, stop = args
+    results = []
+    with open(pdf_path, 'rb') as file:
+        pdf_reader = PyPDF2.PdfReader(file)
+        for page_num in range(start, stop):
+            try:
+                results.append((page_num, pdf_reader.pages[page_num].extract_text(), ""))
+            except Exception as e:
+                results.append((page_num, "", str(e)))
+    return results
+
+
+class MinerUParser:
+    """PDF文档解析器"""
+    
+    def __init__(self, api_host: str = None, api_port: int = None):
+        """
+        初始化PDF解析器
+        """
+        # 保留参数以兼容旧版本调用
+        pass
+        
+    def parse_pdf(self, pdf_path: str) -> Dict[str, Any]:
+        """
+        解析PDF文档
+        
+        Args:
+            pdf_path: PDF文件路径
+            
+        Returns:
+            解析结果字典，包含文本内容、表格、图片等信息
+        """
+        if not os.path.exists(pdf_path):
+            raise FileNotFoundError(f"PDF文件不存在: {pdf_path}")
+            
+        try:
+            return self._pymupdf_parse(pdf_path)
+            
+        except Exception as e:
+            print(f"PDF解析失败: {str(e)}")
+            print(traceback.format_exc())
+            return {
+                "content": f"解析失败: {str(e)}",
+                "metadata": {"total_pages": 0, "parser": "failed"},
+                "tables": [],
+                "images": [],
+                "structure": {"headings": [], "paragraphs": [], "lists": []}
+            }
+    
+    def _pymupdf_parse(self, pdf_path: str) -> Dict[str, Any]:
+        """使用PyMuPDF解析PDF，同时根据字号识别标题"""
+        try:
+            import fitz
+        except ImportError:
+            print(f"📄 PyMuPDF 未安装，使用PyPDF2解析PDF: {os.path.basename(pdf_path)}")
+            return self._pypdf2_parse(pdf_path)
+        
+        print(f"📄 使用PyMuPDF解析PDF: {os.path.basename(pdf_path)}")
+        try:
+            with fitz.open(pdf_path) as doc:
+                total_pages = doc.page_count
+                print(f"📖 开始解析 {total_pages} 页PDF文档...")
+                
+                parts: List[str] = []
+                images_count = 0
+                text_lines = []  # (字号, 行文本)
+                size_weights = Counter()  # 字号 -> 字符数，用于确定正文字号
+                
+                for page_num, page in enumerate(doc):
+                    try:
+                        page_lines = []
+                        for block in page.get_text("dict")["blocks"]:
+                            if block.get("type") != 0:
+                                images_count += 1
+                                continue
+                            for line in block["lines"]:
+                                spans = line["spans"]
+                                line_text = "".join(span["text"] for span in spans).strip()
+                                if not line_text:
+                                    continue
+                                size = round(max(span["size"] for span in spans), 1)
+                                size_weights[size] += len(line_text)
+                                text_lines.append((size, line_text))
+                                page_lines.append(line_text)
+                        
+                        parts.append(f"\n=== 第 {page_num + 1} 页 ===\n")
+                        parts.append("\n".join(page_lines) + "\n")
+                        
+                        if (page_num + 1) % 5 == 0:  # 每5页打印一次进度
+                            print(f"📄 已解析 {page_num + 1}/{total_pages} 页")
+                    
+                    except Exception as e:
+                        print(f"⚠️ 第{page_num + 1}页解析出错: {str(e)}")
+                        parts.append(f"\n=== 第 {page_num + 1} 页 (解析失败) ===\n")
+                        parts.append(f"解析错误: {str(e)}\n")
+            
+            content = "".join(parts)
+            
+            # 简单的内容分析（标题已按字号识别）
+            analysis = self._analyze_content(content, detect_headings=False)
+            
+            result = {
+                "content": content,
+                "metadata": {
+                    "total_pages": total_pages,
+                    "tables_count": analysis["pipe_count"] // 10,  # 简单估算表格数量
+                    "images_count": images_count,
+                    "formulas_count": analysis["dollar_count"] // 2,  # 简单估算公式
+                    "parser": "pymupdf",
+                    "content_length": len(content)
+                },
+                "tables": [],
+                "images": [],
+                "structure": {
+                    "headings": self._headings_by_font_size(text_lines, size_weights),
+                    "paragraphs": analysis["paragraphs"],
+                    "lists": []
+                }
+            }
+            
+            print(f"✅ PyMuPDF解析完成: {total_pages} 页，{len(content)} 字符")
+            return result
+        
+        except Exception as e:
+            print(f"PyMuPDF解析失败: {str(e)}")
+            raise
+    
+    def _headings_by_font_size(self, text_lines: List[Tuple[float, str]], size_weights: Counter) -> list:
+        """按字号识别标题：明显大于正文字号的短行为标题，字号越大级别越高"""
+        if not size_weights:
+            return []
+        
+        body_size = size_weights.most_common(1)[0][0]
+        threshold = body_size * HEADING_SIZE_RATIO
+        heading_sizes = sorted({size for size in size_weights if size >= threshold}, reverse=True)
+        levels = {size: min(level, 3) for level, size in enumerate(heading_sizes, start=1)}
+        
+        headings = []
+        for size, line_text in text_lines:
+            if size in levels and len(line_text) < 100:
+                headings.append({
+                    "level": levels[size],
+                    "title": line_text[:50]  # 限制标题长度
+                })
+                if len(headings) >= 10:  # 限制标题数量
+                    break
+        
+        return headings
+    
+    def _pypdf2_parse(self, pdf_path: str) -> Dict[str, Any]:
+        """使用PyPDF2解析PDF"""
+        try:
+            import PyPDF2
+            
+            print(f"📄 使用PyPDF2解析PDF: {os.path.basename(pdf_path)}")
+            with open(pdf_path, 'rb') as file:
+                total_pages = len(PyPDF2.PdfReader(file).pages)
+            
+            print(f"📖 开始解析 {total_pages} 页PDF文档...")
+            pages = self._extract_all_pages(pdf_path, total_pages)
+            
+            parts: List[str] = []
+            for page_num, page_text, error in pages:
+                if error:
+                    print(f"⚠️ 第{page_num + 1}页解析出错: {error}")
+                    parts.append(f"\n=== 第 {page_num + 1} 页 (解析失败) ===\n")
+                    parts.append(f"解析错误: {error}\n")
+                else:
+                    parts.append(f"\n=== 第 {page_num + 1} 页 ===\n")
+                    parts.append(page_text + "\n")
+            content = "".join(parts)
+            
+            # 简单的内容分析
+            analysis = self._analyze_content(content)
+            
+            result = {
+                "content": content,
+                "metadata": {
+                    "total_pages": total_pages,
+                    "tables_count": analysis["pipe_count"] // 10,  # 简单估算表格数量
+                    "images_count": 0,  # PyPDF2无法提取图片
+                    "formulas_count": analysis["dollar_count"] // 2,  # 简单估算公式
+                    "parser": "PyPDF2",
+                    "content_length": len(content)
+                },
+                "tables": [],  # PyPDF2无法提取结构化表格
+                "images": [],  # PyPDF2无法提取图片
+                "structure": {
+                    "headings": analysis["headings"],
+                    "paragraphs": analysis["paragraphs"],
+                    "lists": []
+                }
+            }
+            
+            print(f"✅ PyPDF2解析完成: {total_pages} 页，{len(content)} 字符")
+            return result
+            
+        except ImportError:
+            raise Exception("PyPDF2 未安装，无法解析PDF")
+        except Exception as e:
+            print(f"PyPDF2解析失败: {str(e)}")
+            raise
+    
+    def _extract_all_pages(self, pdf_path: str, total_pages: int) -> List[Tuple[int, str, str]]:
+        """
+        按页码顺序提取全部页面文本
+        
+        页数较多时把页面切成连续区间交给进程池并行解析；
+        当前进程不允许创建子进程（如Celery prefork的守护进程）时退回单进程解析
+        """
+        if total_pages <= PARALLEL_MIN_PAGES:
+            return _extract_pages((pdf_path, 0, total_pages))
+        
+        max_workers = _get_max_workers()
+        # 每个进程分到约两个区间，平衡负载同时减少重复打开PDF的次数
+        step = max(1, -(-total_pages // (max_workers * 2)))
+        ranges = [(pdf_path, start, min(start + step, total_pages)) for start in range(0, total_pages, step)]
+        
+        try:
+            pages = []
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                for batch in executor.map(_extract_pages, ranges):
+                    pages.extend(batch)
+                    print(f"📄 已解析 {len(pages)}/{total_pages} 页")
+            return pages
+        except (AssertionError, OSError, RuntimeError) as e:
+            print(f"⚠️ 进程池不可用，改为单进程解析: {str(e)}")
+            return _extract_pages((pdf_path, 0, total_pages))
+    
+    def _analyze_content(self, content: str, detect_headings: bool = True) -> Dict[str, Any]:
+        """
+        单次遍历内容，同时统计特殊字符、收集段落并识别标题
+        
+        Args:
+            content: 解析出的全文
+            detect_headings: 是否按文本规则识别标题
+            
+        Returns:
+            包含paragraphs、headings、pipe_count、dollar_count的字典
+        """
+        paragraphs = []
+        headings = []
+        pipe_count = 0
+        dollar_count = 0
+        
+        # 逐行迭代，避免为大文档一次性分配整个行列表
+        for raw_line in io.StringIO(content):
+            pipe_count += raw_line.count('|')
+            dollar_count += raw_line.count('$')
+            
+            line = raw_line.strip()
+            if not line:
+                continue
+            
+            if len(line) > 10 and len(paragraphs) < 50:  # 限制段落数量
+                paragraphs.append(line)
+            
+            # 简单的标题识别规则
+            if (detect_headings and len(headings) < 10 and  # 限制标题数量
+                len(line) < 100 and  # 不太长
+                _DIGIT_RE.search(line) and  # 包含数字
+                (line.endswith(('。', '.')) or  # 以句号结尾
+                 _HEADING_KEYWORD_RE.search(line))):  # 包含关键词
+                headings.append({
+                    "level": 1,  # 简单设为1级标题
+                    "title": line[:50]  # 限制标题长度
+                })
+        
+        return {
+            "paragraphs": paragraphs,
+            "headings": headings,
+            "pipe_count": pipe_count,
+            "dollar_count": dollar_count
+        }
+
+def test_mineru_parser():
+    """测试PDF解析器"""
+    parser = MinerUParser()
+    
+    print("PDF解析器测试:")
+    print("✅ 使用PyMuPDF作为PDF解析引擎（未安装时回退到PyPDF2）")
+    print("📋 功能: 提取文本内容、按字号识别标题、基础结构分析")
+    print("⚠️  限制: 无法提取表格结构")
+
+
+if __name__ == "__main__":
     test_mineru_parser()
\ No newline at end of file
@@ -1,308 +1,437 @@
-"""
-Ollama API集成模块
-用于文档智能分块和向量化
-"""
-
-import os
-import requests
-from typing import List, Dict, Any, Optional
-import json
-import re
-
-# 优先使用环境变量，不加载.env文件覆盖
-# from dotenv import load_dotenv
-# load_dotenv()
-
-class OllamaProcessor:
-    """Ollama处理器"""
-    
-    def __init__(self):
-        self.base_url = os.getenv('OLLAMA_BASE_URL', 'http://localhost:11434')
-        
-        # 模型配置
-        self.chat_model = os.getenv('OLLAMA_MODEL', 'llama3:8b')
-        self.embedding_model = os.getenv('OLLAMA_EMBEDDING_MODEL', 'nomic-embed-text')
-        
-        # 验证Ollama连接
-        try:
-            self._check_connection()
-            print(f"✅ Ollama连接成功: {self.base_url}")
-        except Exception as e:
-            print(f"❌ Ollama连接失败: {str(e)}")
-            raise ValueError(f"无法连接到Ollama服务: {str(e)}")
-    
-    def _check_connection(self):
-        """检查Ollama连接"""
-        response = requests.get(f"{self.base_url}/api/tags", timeout=10)
-        response.raise_for_status()
-        models = response.json()
-        available_models = [model['name'] for model in models.get('models', [])]
-        
-        # 检查所需模型是否可用
-        if self.chat_model not in available_models:
-            print(f"警告: 聊天模型 {self.chat_model} 不可用，可用模型: {available_models}")
-        if self.embedding_model not in available_models:
-            print(f"警告: 嵌入模型 {self.embedding_model} 不可用，可用模型: {available_models}")
-    
-    def intelligent_chunk_document(self, parsed_content: Dict[str, Any]) -> List[Dict[str, Any]]:
-        """
-        使用大模型进行智能分块
-        
-        Args:
-            parsed_content: MinerU解析的文档内容
-            
-        Returns:
-            智能分块后的内容列表
-        """
-        content = parsed_content.get("content", "")
-        metadata = parsed_content.get("metadata", {})
-        
-        if not content.strip():
-            return []
-        
-        # 如果文档较短，直接返回单个块
-        if len(content) < 500:
-            return [{
-                "title": "完整文档",
-                "content": content.strip(),
-                "type": "complete",
-                "summary": "短文档，无需分块"
-            }]
-        
-        try:
-            # 构建智能分块的提示词
-            prompt = self._build_chunking_prompt(content, metadata)
-            
-            response = self._chat_completion(
-                prompt,
-                system_message="你是一个专业的文档分析专家，擅长将长文档按照语义和逻辑结构进行智能分块。",
-                temperature=0.3,
-                max_tokens=4000
-            )
-            
-            # 解析AI返回的分块结果
-            chunks = self._parse_chunking_result(response)
-            
-            return chunks
-            
-        except Exception as e:
-            print(f"Ollama智能分块失败: {str(e)}")
-            # 降级到简单分块
-            return self._simple_chunk(content)
-    
-    def _chat_completion(self, prompt: str, system_message: str = "", temperature: float = 0.7, max_tokens: int = 2000) -> str:
-        """调用Ollama聊天完成API"""
-        messages = []
-        if system_message:
-            messages.append({"role": "system", "content": system_message})
-        messages.append({"role": "user", "content": prompt})
-        
-        payload = {
-            "model": self.chat_model,
-            "messages": messages,
-            "stream": False,
-            "options": {
-                "temperature": temperature,
-                "num_predict": max_tokens
-            }
-        }
-        
-        response = requests.post(
-            f"{self.base_url}/api/chat",
-            json=payload,
-            timeout=120
-        )
-        response.raise_for_status()
-        
-        result = response.json()
-        return result["message"]["content"]
-    
-    def _build_chunking_prompt(self, content: str, metadata: Dict) -> str:
-        """构建智能分块的提示词"""
-        
-        prompt = f"""
-请对以下文档进行智能分块，要求：
-
-1. 按照文档的逻辑结构和语义相关性进行分块
-2. 每个块应该保持完整的语义单元（如一个完整的章节、段落组合等）
-3. 块的大小应该适中（建议300-1500字符）
-4. 为每个块提供有意义的标题和简要摘要
-5. 保持原文的重要信息不丢失
-
-文档元信息：
-- 总页数: {metadata.get('total_pages', '未知')}
-- 表格数: {metadata.get('tables_count', 0)}
-- 图片数: {metadata.get('images_count', 0)}
-
-请以以下JSON格式返回分块结果：
-```json
-[
-  {{
-    "title": "块标题",
-    "content": "块内容",
-    "summary": "块摘要",
-    "type": "chunk"
-  }}
-]
-```
-
-文档内容：
-{content[:3000]}{"..." if len(content) > 3000 else ""}
-"""
-        return prompt
-    
-    def _parse_chunking_result(self, ai_response: str) -> List[Dict[str, Any]]:
-        """解析AI返回的分块结果"""
-        try:
-            # 提取JSON部分
-            json_match = re.search(r'```json\s*(.*?)\s*```', ai_response, re.DOTALL)
-            if json_match:
-                json_str = json_match.group(1)
-                chunks = json.loads(json_str)
-                
-                # 验证和清理数据
-                valid_chunks = []
-                for i, chunk in enumerate(chunks):
-                    if isinstance(chunk, dict) and 'content' in chunk:
-                        valid_chunks.append({
-                            "title": chunk.get('title', f'文档块 {i+1}'),
-                            "content": chunk.get('content', '').strip(),
-                            "summary": chunk.get('summary', ''),
-                            "type": chunk.get('type', 'chunk')
-                        })
-                
-                return valid_chunks if valid_chunks else self._simple_chunk(ai_response)
-                
-        except Exception as e:
-            print(f"解析AI分块结果失败: {str(e)}")
-            
-        # 如果解析失败，返回简单分块
-        return self._simple_chunk(ai_response)
-    
-    def _simple_chunk(self, content: str) -> List[Dict[str, Any]]:
-        """简单分块作为备选方案"""
-        chunks = []
-        chunk_size = 1000
-        
-        for i in range(0, len(content), chunk_size):
-            chunk_content = content[i:i + chunk_size]
-            if chunk_content.strip():
-                chunks.append({
-                    "title": f"文档片段 {len(chunks) + 1}",
-                    "content": chunk_content.strip(),
-                    "summary": f"文档的第{len(chunks) + 1}个片段",
-                    "type": "simple_chunk"
-                })
-        
-        return chunks
-    
-    def generate_embeddings(self, chunks: List[Dict[str, Any]]) -> List[List[float]]:
-        """
-        生成文本向量嵌入
-        
-        Args:
-            chunks: 文档块列表
-            
-        Returns:
-            向量嵌入列表
-        """
-        if not chunks:
-            return []
-        
-        try:
-            embeddings = []
-            
-            for chunk in chunks:
-                # 组合标题和内容
-                text = f"{chunk.get('title', '')}\n{chunk.get('content', '')}"
-                text = text.strip()
-                
-                # 调用Ollama Embedding API
-                payload = {
-                    "model": self.embedding_model,
-                    "prompt": text
-                }
-                
-                response = requests.post(
-                    f"{self.base_url}/api/embeddings",
-                    json=payload,
-                    timeout=60
-                )
-                response.raise_for_status()
-                
-                result = response.json()
-                embeddings.append(result["embedding"])
-            
-            print(f"生成向量嵌入完成: {len(embeddings)} 个向量")
-            return embeddings
-            
-        except Exception as e:
-            print(f"Ollama向量化失败: {str(e)}")
-            # 返回随机向量作为备选
-            import random
-            dimension = 768  # nomic-embed-text默认维度
-            return [[random.random() for _ in range(dimension)] for _ in chunks]
-    
-    def enhance_chunk_with_ai(self, chunk_content: str) -> Dict[str, str]:
-        """
-        使用AI增强单个块的信息（可选功能）
-        
-        Args:
-            chunk_content: 块内容
-            
-        Returns:
-            增强后的信息（标题、摘要、关键词等）
-        """
-        try:
-            prompt = f"""
-请分析以下文档片段，提供：
-1. 一个准确的标题
-2. 简要摘要（50字以内）
-3. 3-5个关键词
-
-文档片段：
-{chunk_content[:800]}
-
-请以JSON格式返回：
-{{"title": "标题", "summary": "摘要", "keywords": ["关键词1", "关键词2"]}}
-"""
-            
-            response = self._chat_completion(
-                prompt,
-                temperature=0.3,
-                max_tokens=200
-            )
-            
-            result = json.loads(response)
-            return result
-            
-        except Exception as e:
-            print(f"AI增强块信息失败: {str(e)}")
-            return {
-                "title": "文档片段",
-                "summary": "无法生成摘要",
-                "keywords": []
-            }
-
-
-def test_ollama_processor():
-    """测试Ollama处理器"""
-    try:
-        processor = OllamaProcessor()
-        print("✅ Ollama处理器初始化成功")
-        
-        # 测试简单文本
-        test_content = {
-            "content": "这是一个测试文档。包含多个段落和信息。用于测试智能分块功能。",
-            "metadata": {"total_pages": 1}
-        }
-        
-        chunks = processor.intelligent_chunk_document(test_content)
-        print(f"✅ 测试分块成功: {len(chunks)} 个块")
-        
-    except Exception as e:
-        print(f"❌ Ollama处理器测试失败: {str(e)}")
-
-
-if __name__ == "__main__":
+"""
+Ollama API集成模块
+用于文档智能分块和向量化
+"""
+
+import os
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional
+from embed_cache import get_embedding_cache
+from error_handler import EmbeddingError, ChunkParseError
+import orjson
+import re
+
+# 优先使用环境变量，不加载.env文件覆盖
+# from dotenv import load_dotenv
+# load_dotenv()
+
+# 智能分块的系统提示词（尽量简短以减少预填充计算）
+CHUNKING_SYSTEM_PROMPT = (
+    "你是文档分块专家。按语义和逻辑结构把用户给出的文档切成300-1500字的块，保持语义完整、不丢失信息。"
+    '只返回```json代码块包裹的数组，元素格式：{"title":"标题","content":"原文","summary":"摘要","type":"chunk"}'
+)
+# 分块时发送给模型的最大文档长度
+CHUNKING_MAX_CONTENT = 3000
+
+# 连续空白和空行压缩为单个，减少提示词token数
+_INLINE_SPACE_RE = re.compile(r'[ \t\u3000]+')
+_BLANK_LINES_RE = re.compile(r'\s*\n\s*')
+
+# 匹配AI回复中的```json代码块
+_JSON_BLOCK_RE = re.compile(r'```json\s*(.*?)\s*```', re.DOTALL)
+
+
+def _json_block_closed(text: str) -> bool:
+    """流式接收时判断```json代码块是否已经结束"""
+    start = text.find('```json')
+    return start != -1 and text.find('```', start + 7) != -1
+
+# 单次批量向量化请求包含的文本数量
+EMBED_BATCH_SIZE = int(os.getenv("OLLAMA_EMBED_BATCH", "64"))
+# 同时发出的批量向量化请求数
+EMBED_BATCH_CONCURRENCY = int(os.getenv("OLLAMA_EMBED_CONCURRENCY", "4"))
+# 逐条向量化时的并发请求数
+EMBED_MAX_WORKERS = 8
+
+class OllamaProcessor:
+    """Ollama处理器"""
+    
+    def __init__(self):
+        self.base_url = os.getenv('OLLAMA_BASE_URL', 'http://localhost:11434')
+        
+        # 模型配置
+        self.chat_model = os.getenv('OLLAMA_MODEL', 'llama3:8b')
+        self.embedding_model = os.getenv('OLLAMA_EMBEDDING_MODEL', 'nomic-embed-text')
+        
+        # 复用HTTP连接（keep-alive），避免每次请求重新建立连接；
+        # Ollama重载模型时短暂返回的502/503/504及连接失败自动退避重试（请求均为幂等，POST也重试）；
+        # 读超时不在此重试，避免长时间卡住的请求被重复发送，交给上层retry_with_backoff和熔断器处理
+        self._session = requests.Session()
+        retry = Retry(
+            total=3,
+            connect=3,
+            read=0,
+            status=3,
+            backoff_factor=0.3,
+            status_forcelist=[502, 503, 504],
+            allowed_methods=["GET", "POST"],
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(max_retries=retry, pool_connections=16, pool_maxsize=16)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        # 服务端是否支持批量向量化接口/api/embed（旧版Ollama只有/api/embeddings）
+        self._batch_embed_supported = True
+        # 连接在首次使用时检查，成功后不再重复检查
+        self._connected = False
+    
+    def _ensure_connected(self):
+        """首次使用时验证Ollama连接，失败时抛出ValueError（下次使用会重新检查）"""
+        if self._connected:
+            return
+        
+        try:
+            self._check_connection()
+            print(f"✅ Ollama连接成功: {self.base_url}")
+        except Exception as e:
+            print(f"❌ Ollama连接失败: {str(e)}")
+            raise ValueError(f"无法连接到Ollama服务: {str(e)}")
+        self._connected = True
+    
+    def _check_connection(self):
+        """检查Ollama连接"""
+        # (连接超时, 读取超时)：服务不可达时快速失败
+        response = self._session.get(f"{self.base_url}/api/tags", timeout=(0.25, 2.0))
+        response.raise_for_status()
+        models = orjson.loads(response.content)
+        available_models = [model['name'] for model in models.get('models', [])]
+        
+        # 检查所需模型是否可用
+        if self.chat_model not in available_models:
+            print(f"警告: 聊天模型 {self.chat_model} 不可用，可用模型: {available_models}")
+        if self.embedding_model not in available_models:
+            print(f"警告: 嵌入模型 {self.embedding_model} 不可用，可用模型: {available_models}")
+    
+    def intelligent_chunk_document(self, parsed_content: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """
+        使用大模型进行智能分块
+        
+        Args:
+            parsed_content: MinerU解析的文档内容
+            
+        Returns:
+            智能分块后的内容列表
+        """
+        content = parsed_content.get("content", "")
+        metadata = parsed_content.get("metadata", {})
+        
+        if not content.strip():
+            return []
+        
+        self._ensure_connected()
+        
+        # 如果文档较短，直接返回单个块
+        if len(content) < 500:
+            return [{
+                "title": "完整文档",
+                "content": content.strip(),
+                "type": "complete",
+                "summary": "短文档，无需分块"
+            }]
+        
+        try:
+            # 构建智能分块的提示词
+            prompt = self._build_chunking_prompt(content, metadata)
+            
+            response = self._chat_completion(
+                prompt,
+                system_message=CHUNKING_SYSTEM_PROMPT,
+                temperature=0.3,
+                max_tokens=4000,
+                stop_after_json_block=True
+            )
+            
+            # 解析AI返回的分块结果
+            chunks = self._parse_chunking_result(response)
+            
+            return chunks
+            
+        except ChunkParseError as e:
+            print(f"解析AI分块结果失败: {str(e)}")
+            # 对原文而不是AI回复做简单分块
+            return self._simple_chunk(content)
+            
+        except Exception as e:
+            print(f"Ollama智能分块失败: {str(e)}")
+            # 降级到简单分块
+            return self._simple_chunk(content)
+    
+    def _chat_completion(self, prompt: str, system_message: str = "", temperature: float = 0.7, max_tokens: int = 2000,
+                         stop_after_json_block: bool = False) -> str:
+        """
+        以流式方式调用Ollama聊天完成API
+        
+        Args:
+            stop_after_json_block: 为True时```json代码块结束后立即断开，不再等待其余输出
+        """
+        messages = []
+        if system_message:
+            messages.append({"role": "system", "content": system_message})
+        messages.append({"role": "user", "content": prompt})
+        
+        payload = {
+            "model": self.chat_model,
+            "messages": messages,
+            "stream": True,
+            "options": {
+                "temperature": temperature,
+                "num_predict": max_tokens
+            }
+        }
+        
+        parts = []
+        with self._session.post(
+            f"{self.base_url}/api/chat",
+            json=payload,
+            timeout=120,
+            stream=True
+        ) as response:
+            response.raise_for_status()
+            
+            # 每行是一个JSON对象，携带一段增量内容
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                chunk = orjson.loads(line)
+                piece = chunk.get("message", {}).get("content", "")
+                if piece:
+                    parts.append(piece)
+                    if stop_after_json_block and '`' in piece and _json_block_closed("".join(parts)):
+                        break
+                if chunk.get("done"):
+                    break
+        
+        return "".join(parts)
+    
+    def _build_chunking_prompt(self, content: str, metadata: Dict) -> str:
+        """构建智能分块的用户消息：压缩空白后的文档内容（分块要求在系统提示词中）"""
+        content = _BLANK_LINES_RE.sub('\n', _INLINE_SPACE_RE.sub(' ', content)).strip()
+        if len(content) > CHUNKING_MAX_CONTENT:
+            return content[:CHUNKING_MAX_CONTENT] + "..."
+        return content
+    
+    def _parse_chunking_result(self, ai_response: str) -> List[Dict[str, Any]]:
+        """
+        解析AI返回的分块结果
+        
+        Raises:
+            ChunkParseError: 回复中没有可用的分块结果
+        """
+        # 提取JSON部分
+        # 先用find定位代码块起点，没有代码块时不必运行正则
+        start = ai_response.find('```json')
+        json_match = _JSON_BLOCK_RE.match(ai_response, start) if start != -1 else None
+        if not json_match:
+            raise ChunkParseError("AI回复中没有JSON代码块")
+        
+        try:
+            chunks = orjson.loads(json_match.group(1))
+        except orjson.JSONDecodeError as e:
+            raise ChunkParseError(f"JSON格式错误: {str(e)}") from e
+        if not isinstance(chunks, list):
+            raise ChunkParseError("分块结果不是数组")
+        
+        # 验证和清理数据
+        valid_chunks = []
+        for i, chunk in enumerate(chunks):
+            if isinstance(chunk, dict) and 'content' in chunk:
+                valid_chunks.append({
+                    "title": chunk.get('title', f'文档块 {i+1}'),
+                    "content": chunk.get('content', '').strip(),
+                    "summary": chunk.get('summary', ''),
+                    "type": chunk.get('type', 'chunk')
+                })
+        
+        if not valid_chunks:
+            raise ChunkParseError("分块结果中没有有效的块")
+        return valid_chunks
+    
+    def _simple_chunk(self, content: str) -> List[Dict[str, Any]]:
+        """简单分块作为备选方案"""
+        chunks = []
+        chunk_size = 1000
+        
+        for i in range(0, len(content), chunk_size):
+            chunk_content = content[i:i + chunk_size]
+            if chunk_content.strip():
+                chunks.append({
+                    "title": f"文档片段 {len(chunks) + 1}",
+                    "content": chunk_content.strip(),
+                    "summary": f"文档的第{len(chunks) + 1}个片段",
+                    "type": "simple_chunk"
+                })
+        
+        return chunks
+    
+    def generate_embeddings(self, chunks: List[Dict[str, Any]]) -> np.ndarray:
+        """
+        生成文本向量嵌入
+        
+        Args:
+            chunks: 文档块列表
+            
+        Returns:
+            形状为(块数, 维度)的float32向量矩阵
+            
+        Raises:
+            EmbeddingError: 调用嵌入接口失败
+        """
+        if not chunks:
+            return np.empty((0, 0), dtype=np.float32)
+        
+        self._ensure_connected()
+        
+        try:
+            # 组合标题和内容
+            texts = [f"{chunk.get('title', '')}\n{chunk.get('content', '')}".strip() for chunk in chunks]
+            
+            # 已向量化过的相同文本直接使用缓存
+            embeddings = np.asarray(get_embedding_cache().embed(self.embedding_model, texts, self._embed_texts), dtype=np.float32)
+            
+            print(f"生成向量嵌入完成: {len(embeddings)} 个向量")
+            return embeddings
+            
+        except Exception as e:
+            print(f"Ollama向量化失败: {str(e)}")
+            raise EmbeddingError(f"Ollama向量化失败: {str(e)}", e) from e
+    
+    def embed_query(self, query_text: str) -> List[float]:
+        """
+        生成查询文本的向量嵌入
+        
+        失败时直接抛出异常，避免用无意义的向量执行搜索
+        
+        Args:
+            query_text: 查询文本
+            
+        Returns:
+            查询向量
+        """
+        return self._embed_one(query_text.strip())
+    
+    def _embed_texts(self, texts: List[str]) -> np.ndarray:
+        """按批调用嵌入接口（多个批次并发请求），返回与texts顺序一致的float32向量矩阵"""
+        batches = [texts[start:start + EMBED_BATCH_SIZE] for start in range(0, len(texts), EMBED_BATCH_SIZE)]
+        if self._batch_embed_supported and batches:
+            with ThreadPoolExecutor(max_workers=min(EMBED_BATCH_CONCURRENCY, len(batches))) as executor:
+                results = list(executor.map(self._embed_batch, batches))
+        else:
+            results = [None] * len(batches)
+        
+        embeddings = []
+        for batch, batch_embeddings in zip(batches, results):
+            if batch_embeddings is None:
+                # 不支持批量接口时逐条并发调用，map保持顺序
+                with ThreadPoolExecutor(max_workers=EMBED_MAX_WORKERS) as executor:
+                    batch_embeddings = list(executor.map(self._embed_one, batch))
+            embeddings.extend(batch_embeddings)
+        return np.asarray(embeddings, dtype=np.float32)
+    
+    def _embed_batch(self, texts: List[str]) -> Optional[List[List[float]]]:
+        """
+        调用/api/embed一次生成多个文本的向量
+        
+        Returns:
+            与texts顺序一致的向量列表；服务端不支持该接口（404）时返回None
+        """
+        payload = {
+            "model": self.embedding_model,
+            "input": texts
+        }
+        
+        response = self._session.post(
+            f"{self.base_url}/api/embed",
+            json=payload,
+            timeout=60 + 5 * len(texts)
+        )
+        if response.status_code == 404:
+            print("Ollama不支持/api/embed批量接口，改为逐条向量化")
+            self._batch_embed_supported = False
+            return None
+        response.raise_for_status()
+        
+        return orjson.loads(response.content)["embeddings"]
+    
+    def _embed_one(self, text: str) -> List[float]:
+        """调用/api/embeddings生成单个文本的向量"""
+        payload = {
+            "model": self.embedding_model,
+            "prompt": text
+        }
+        
+        response = self._session.post(
+            f"{self.base_url}/api/embeddings",
+            json=payload,
+            timeout=60
+        )
+        response.raise_for_status()
+        
+        return orjson.loads(response.content)["embedding"]
+    
+    def enhance_chunk_with_ai(self, chunk_content: str) -> Dict[str, str]:
+        """
+        使用AI增强单个块的信息（可选功能）
+        
+        Args:
+            chunk_content: 块内容
+            
+        Returns:
+            增强后的信息（标题、摘要、关键词等）
+        """
+        try:
+            prompt = f"""
+请分析以下文档片段，提供：
+1. 一个准确的标题
+2. 简要摘要（50字以内）
+3. 3-5个关键词
+
+文档片段：
+{chunk_content[:800]}
+
+请以JSON格式返回：
+{{"title": "标题", "summary": "摘要", "keywords": ["关键词1", "关键词2"]}}
+"""
+            
+            response = self._chat_completion(
+                prompt,
+                temperature=0.3,
+                max_tokens=200
+            )
+            
+            result = orjson.loads(response)
+            return result
+            
+        except Exception as e:
+            print(f"AI增强块信息失败: {str(e)}")
+            return {
+                "title": "文档片段",
+                "summary": "无法生成摘要",
+                "keywords": []
+            }
+
+
+def test_ollama_processor():
+    """测试Ollama处理器"""
+    try:
+        processor = OllamaProcessor()
+        print("✅ Ollama处理器初始化成功")
+        
+        # 测试简单文本
+        test_content = {
+            "content": "这是一个测试文档。包含多个段落和信息。用于测试智能分块功能。",
+            "metadata": {"total_pages": 1}
+        }
+        
+        chunks = processor.intelligent_chunk_document(test_content)
+        print(f"✅ 测试分块成功: {len(chunks)} 个块")
+        
+    except Exception as e:
+        print(f"❌ Ollama处理器测试失败: {str(e)}")
+
+
+if __name__ == "__main__":
     test_ollama_processor()
\ No newline at end of file
@@ -1,269 +1,355 @@
-"""
-OpenAI API集成模块
-用于文档智能分块和向量化
-"""
-
-import os
-import openai
-from typing import List, Dict, Any
-from dotenv import load_dotenv
-
-# 加载环境变量
-load_dotenv()
-
-class OpenAIProcessor:
-    """OpenAI处理器"""
-    
-    def __init__(self):
-        self.api_key = os.getenv('OPENAI_API_KEY')
-        if not self.api_key:
-            raise ValueError("请在.env文件中设置OPENAI_API_KEY")
-            
-        openai.api_key = self.api_key
-        self.client = openai.OpenAI(api_key=self.api_key)
-        
-        # 模型配置
-        self.chat_model = os.getenv('OPENAI_MODEL', 'gpt-4o-mini')
-        self.embedding_model = os.getenv('OPENAI_EMBEDDING_MODEL', 'text-embedding-3-small')
-    
-    def intelligent_chunk_document(self, parsed_content: Dict[str, Any]) -> List[Dict[str, Any]]:
-        """
-        使用大模型进行智能分块
-        
-        Args:
-            parsed_content: MinerU解析的文档内容
-            
-        Returns:
-            智能分块后的内容列表
-        """
-        content = parsed_content.get("content", "")
-        metadata = parsed_content.get("metadata", {})
-        
-        if not content.strip():
-            return []
-        
-        # 如果文档较短，直接返回单个块
-        if len(content) < 500:
-            return [{
-                "title": "完整文档",
-                "content": content.strip(),
-                "type": "complete",
-                "summary": "短文档，无需分块"
-            }]
-        
-        try:
-            # 构建智能分块的提示词
-            prompt = self._build_chunking_prompt(content, metadata)
-            
-            response = self.client.chat.completions.create(
-                model=self.chat_model,
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "你是一个专业的文档分析专家，擅长将长文档按照语义和逻辑结构进行智能分块。"
-                    },
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
-                temperature=0.3,
-                max_tokens=4000
-            )
-            
-            # 解析AI返回的分块结果
-            chunks = self._parse_chunking_result(response.choices[0].message.content)
-            
-            return chunks
-            
-        except Exception as e:
-            print(f"OpenAI智能分块失败: {str(e)}")
-            # 降级到简单分块
-            return self._simple_chunk(content)
-    
-    def _build_chunking_prompt(self, content: str, metadata: Dict) -> str:
-        """构建智能分块的提示词"""
-        
-        prompt = f"""
-请对以下文档进行智能分块，要求：
-
-1. 按照文档的逻辑结构和语义相关性进行分块
-2. 每个块应该保持完整的语义单元（如一个完整的章节、段落组合等）
-3. 块的大小应该适中（建议300-1500字符）
-4. 为每个块提供有意义的标题和简要摘要
-5. 保持原文的重要信息不丢失
-
-文档元信息：
-- 总页数: {metadata.get('total_pages', '未知')}
-- 表格数: {metadata.get('tables_count', 0)}
-- 图片数: {metadata.get('images_count', 0)}
-
-请以以下JSON格式返回分块结果：
-```json
-[
-  {{
-    "title": "块标题",
-    "content": "块内容",
-    "summary": "块摘要",
-    "type": "chunk"
-  }}
-]
-```
-
-文档内容：
-{content[:3000]}{"..." if len(content) > 3000 else ""}
-"""
-        return prompt
-    
-    def _parse_chunking_result(self, ai_response: str) -> List[Dict[str, Any]]:
-        """解析AI返回的分块结果"""
-        try:
-            import json
-            import re
-            
-            # 提取JSON部分
-            json_match = re.search(r'```json\s*(.*?)\s*```', ai_response, re.DOTALL)
-            if json_match:
-                json_str = json_match.group(1)
-                chunks = json.loads(json_str)
-                
-                # 验证和清理数据
-                valid_chunks = []
-                for i, chunk in enumerate(chunks):
-                    if isinstance(chunk, dict) and 'content' in chunk:
-                        valid_chunks.append({
-                            "title": chunk.get('title', f'文档块 {i+1}'),
-                            "content": chunk.get('content', '').strip(),
-                            "summary": chunk.get('summary', ''),
-                            "type": chunk.get('type', 'chunk')
-                        })
-                
-                return valid_chunks if valid_chunks else self._simple_chunk(ai_response)
-                
-        except Exception as e:
-            print(f"解析AI分块结果失败: {str(e)}")
-            
-        # 如果解析失败，返回简单分块
-        return self._simple_chunk(ai_response)
-    
-    def _simple_chunk(self, content: str) -> List[Dict[str, Any]]:
-        """简单分块作为备选方案"""
-        chunks = []
-        chunk_size = 1000
-        
-        for i in range(0, len(content), chunk_size):
-            chunk_content = content[i:i + chunk_size]
-            if chunk_content.strip():
-                chunks.append({
-                    "title": f"文档片段 {len(chunks) + 1}",
-                    "content": chunk_content.strip(),
-                    "summary": f"文档的第{len(chunks) + 1}个片段",
-                    "type": "simple_chunk"
-                })
-        
-        return chunks
-    
-    def generate_embeddings(self, chunks: List[Dict[str, Any]]) -> List[List[float]]:
-        """
-        生成文本向量嵌入
-        
-        Args:
-            chunks: 文档块列表
-            
-        Returns:
-            向量嵌入列表
-        """
-        if not chunks:
-            return []
-        
-        try:
-            # 准备要向量化的文本
-            texts = []
-            for chunk in chunks:
-                # 组合标题和内容
-                text = f"{chunk.get('title', '')}\n{chunk.get('content', '')}"
-                texts.append(text.strip())
-            
-            # 调用OpenAI Embedding API
-            response = self.client.embeddings.create(
-                model=self.embedding_model,
-                input=texts
-            )
-            
-            embeddings = [data.embedding for data in response.data]
-            print(f"生成向量嵌入完成: {len(embeddings)} 个向量")
-            
-            return embeddings
-            
-        except Exception as e:
-            print(f"OpenAI向量化失败: {str(e)}")
-            # 返回随机向量作为备选
-            import random
-            dimension = 1536 if 'text-embedding-3' in self.embedding_model else 1536
-            return [[random.random() for _ in range(dimension)] for _ in chunks]
-    
-    def enhance_chunk_with_ai(self, chunk_content: str) -> Dict[str, str]:
-        """
-        使用AI增强单个块的信息（可选功能）
-        
-        Args:
-            chunk_content: 块内容
-            
-        Returns:
-            增强后的信息（标题、摘要、关键词等）
-        """
-        try:
-            prompt = f"""
-请分析以下文档片段，提供：
-1. 一个准确的标题
-2. 简要摘要（50字以内）
-3. 3-5个关键词
-
-文档片段：
-{chunk_content[:800]}
-
-请以JSON格式返回：
-{{"title": "标题", "summary": "摘要", "keywords": ["关键词1", "关键词2"]}}
-"""
-            
-            response = self.client.chat.completions.create(
-                model=self.chat_model,
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.3,
-                max_tokens=200
-            )
-            
-            import json
-            result = json.loads(response.choices[0].message.content)
-            return result
-            
-        except Exception as e:
-            print(f"AI增强块信息失败: {str(e)}")
-            return {
-                "title": "文档片段",
-                "summary": "无法生成摘要",
-                "keywords": []
-            }
-
-
-def test_openai_processor():
-    """测试OpenAI处理器"""
-    try:
-        processor = OpenAIProcessor()
-        print("✅ OpenAI处理器初始化成功")
-        
-        # 测试简单文本
-        test_content = {
-            "content": "这是一个测试文档。包含多个段落和信息。用于测试智能分块功能。",
-            "metadata": {"total_pages": 1}
-        }
-        
-        chunks = processor.intelligent_chunk_document(test_content)
-        print(f"✅ 测试分块成功: {len(chunks)} 个块")
-        
-    except Exception as e:
-        print(f"❌ OpenAI处理器测试失败: {str(e)}")
-
-
-if __name__ == "__main__":
+"""
+OpenAI API集成模块
+用于文档智能分块和向量化
+"""
+
+import os
+import re
+import numpy as np
+import openai
+import orjson
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any
+from embed_cache import get_embedding_cache
+from error_handler import retry_with_backoff, EmbeddingError, ChunkParseError
+from dotenv import load_dotenv
+
+# 加载环境变量
+load_dotenv()
+
+# 智能分块的系统提示词（尽量简短以减少预填充计算）
+CHUNKING_SYSTEM_PROMPT = (
+    "你是文档分块专家。按语义和逻辑结构把用户给出的文档切成300-1500字的块，保持语义完整、不丢失信息。"
+    '只返回```json代码块包裹的数组，元素格式：{"title":"标题","content":"原文","summary":"摘要","type":"chunk"}'
+)
+# 分块时发送给模型的最大文档长度
+CHUNKING_MAX_CONTENT = 3000
+
+# 连续空白和空行压缩为单个，减少提示词token数
+_INLINE_SPACE_RE = re.compile(r'[ \t\u3000]+')
+_BLANK_LINES_RE = re.compile(r'\s*\n\s*')
+
+# 匹配AI回复中的```json代码块
+_JSON_BLOCK_RE = re.compile(r'```json\s*(.*?)\s*```', re.DOTALL)
+
+# 单次嵌入请求的输入条数和总token数上限（接口限制为2048条、30万token，留出余量）
+EMBED_MAX_INPUTS = 96
+EMBED_MAX_TOKENS = 250_000
+# 单条输入的token上限
+EMBED_INPUT_MAX_TOKENS = 8191
+# 并发发送的子批次数
+EMBED_MAX_WORKERS = 4
+
+# 限流、连接失败和服务端错误可以重试
+OPENAI_RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+
+try:
+    import tiktoken
+    _token_encoding = tiktoken.get_encoding("cl100k_base")
+except ImportError:
+    _token_encoding = None
+
+
+def _json_block_closed(text: str) -> bool:
+    """流式接收时判断```json代码块是否已经结束"""
+    start = text.find('```json')
+    return start != -1 and text.find('```', start + 7) != -1
+
+
+def _truncate_to_tokens(text: str) -> tuple:
+    """
+    截断超过单条token上限的文本
+    
+    Returns:
+        (截断后的文本, token数)；未安装tiktoken时按字符数保守估计token数
+    """
+    if _token_encoding is None:
+        text = text[:EMBED_INPUT_MAX_TOKENS]
+        return text, len(text)
+    
+    tokens = _token_encoding.encode(text)
+    if len(tokens) > EMBED_INPUT_MAX_TOKENS:
+        tokens = tokens[:EMBED_INPUT_MAX_TOKENS]
+        text = _token_encoding.decode(tokens)
+    return text, len(tokens)
+
+class OpenAIProcessor:
+    """OpenAI处理器"""
+    
+    def __init__(self):
+        self.api_key = os.getenv('OPENAI_API_KEY')
+        if not self.api_key:
+            raise ValueError("请在.env文件中设置OPENAI_API_KEY")
+            
+        openai.api_key = self.api_key
+        self.client = openai.OpenAI(api_key=self.api_key)
+        
+        # 模型配置
+        self.chat_model = os.getenv('OPENAI_MODEL', 'gpt-4o-mini')
+        self.embedding_model = os.getenv('OPENAI_EMBEDDING_MODEL', 'text-embedding-3-small')
+    
+    def intelligent_chunk_document(self, parsed_content: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """
+        使用大模型进行智能分块
+        
+        Args:
+            parsed_content: MinerU解析的文档内容
+            
+        Returns:
+            智能分块后的内容列表
+        """
+        content = parsed_content.get("content", "")
+        metadata = parsed_content.get("metadata", {})
+        
+        if not content.strip():
+            return []
+        
+        # 如果文档较短，直接返回单个块
+        if len(content) < 500:
+            return [{
+                "title": "完整文档",
+                "content": content.strip(),
+                "type": "complete",
+                "summary": "短文档，无需分块"
+            }]
+        
+        try:
+            # 构建智能分块的提示词
+            prompt = self._build_chunking_prompt(content, metadata)
+            
+            response = self.client.chat.completions.create(
+                model=self.chat_model,
+                messages=[
+                    {
+                        "role": "system",
+                        "content": CHUNKING_SYSTEM_PROMPT
+                    },
+                    {
+                        "role": "user",
+                        "content": prompt
+                    }
+                ],
+                temperature=0.3,
+                max_tokens=4000,
+                stream=True
+            )
+            
+            # 流式接收，```json代码块结束后立即断开，不再等待其余输出
+            parts = []
+            for event in response:
+                if not event.choices:
+                    continue
+                piece = event.choices[0].delta.content
+                if piece:
+                    parts.append(piece)
+                    if '`' in piece and _json_block_closed("".join(parts)):
+                        break
+            response.response.close()
+            
+            # 解析AI返回的分块结果
+            chunks = self._parse_chunking_result("".join(parts))
+            
+            return chunks
+            
+        except ChunkParseError as e:
+            print(f"解析AI分块结果失败: {str(e)}")
+            # 对原文而不是AI回复做简单分块
+            return self._simple_chunk(content)
+            
+        except Exception as e:
+            print(f"OpenAI智能分块失败: {str(e)}")
+            # 降级到简单分块
+            return self._simple_chunk(content)
+    
+    def _build_chunking_prompt(self, content: str, metadata: Dict) -> str:
+        """构建智能分块的用户消息：压缩空白后的文档内容（分块要求在系统提示词中）"""
+        content = _BLANK_LINES_RE.sub('\n', _INLINE_SPACE_RE.sub(' ', content)).strip()
+        if len(content) > CHUNKING_MAX_CONTENT:
+            return content[:CHUNKING_MAX_CONTENT] + "..."
+        return content
+    
+    def _parse_chunking_result(self, ai_response: str) -> List[Dict[str, Any]]:
+        """
+        解析AI返回的分块结果
+        
+        Raises:
+            ChunkParseError: 回复中没有可用的分块结果
+        """
+        # 提取JSON部分
+        # 先用find定位代码块起点，没有代码块时不必运行正则
+        start = ai_response.find('```json')
+        json_match = _JSON_BLOCK_RE.match(ai_response, start) if start != -1 else None
+        if not json_match:
+            raise ChunkParseError("AI回复中没有JSON代码块")
+        
+        try:
+            chunks = orjson.loads(json_match.group(1))
+        except orjson.JSONDecodeError as e:
+            raise ChunkParseError(f"JSON格式错误: {str(e)}") from e
+        if not isinstance(chunks, list):
+            raise ChunkParseError("分块结果不是数组")
+        
+        # 验证和清理数据
+        valid_chunks = []
+        for i, chunk in enumerate(chunks):
+            if isinstance(chunk, dict) and 'content' in chunk:
+                valid_chunks.append({
+                    "title": chunk.get('title', f'文档块 {i+1}'),
+                    "content": chunk.get('content', '').strip(),
+                    "summary": chunk.get('summary', ''),
+                    "type": chunk.get('type', 'chunk')
+                })
+        
+        if not valid_chunks:
+            raise ChunkParseError("分块结果中没有有效的块")
+        return valid_chunks
+    
+    def _simple_chunk(self, content: str) -> List[Dict[str, Any]]:
+        """简单分块作为备选方案"""
+        chunks = []
+        chunk_size = 1000
+        
+        for i in range(0, len(content), chunk_size):
+            chunk_content = content[i:i + chunk_size]
+            if chunk_content.strip():
+                chunks.append({
+                    "title": f"文档片段 {len(chunks) + 1}",
+                    "content": chunk_content.strip(),
+                    "summary": f"文档的第{len(chunks) + 1}个片段",
+                    "type": "simple_chunk"
+                })
+        
+        return chunks
+    
+    def generate_embeddings(self, chunks: List[Dict[str, Any]]) -> np.ndarray:
+        """
+        生成文本向量嵌入
+        
+        Args:
+            chunks: 文档块列表
+            
+        Returns:
+            形状为(块数, 维度)的float32向量矩阵
+            
+        Raises:
+            EmbeddingError: 调用嵌入接口失败
+        """
+        if not chunks:
+            return np.empty((0, 0), dtype=np.float32)
+        
+        try:
+            # 准备要向量化的文本
+            texts = []
+            for chunk in chunks:
+                # 组合标题和内容
+                text = f"{chunk.get('title', '')}\n{chunk.get('content', '')}"
+                texts.append(text.strip())
+            
+            # 已向量化过的相同文本直接使用缓存，其余调用OpenAI Embedding API
+            embeddings = np.asarray(get_embedding_cache().embed(self.embedding_model, texts, self._embed_texts), dtype=np.float32)
+            print(f"生成向量嵌入完成: {len(embeddings)} 个向量")
+            
+            return embeddings
+            
+        except Exception as e:
+            print(f"OpenAI向量化失败: {str(e)}")
+            raise EmbeddingError(f"OpenAI向量化失败: {str(e)}", e) from e
+    
+    def _embed_texts(self, texts: List[str]) -> np.ndarray:
+        """按token预算拆分子批次并发调用OpenAI Embedding API，返回与texts顺序一致的float32向量矩阵"""
+        batches = []
+        batch, batch_tokens = [], 0
+        for text in texts:
+            text, token_count = _truncate_to_tokens(text)
+            if batch and (len(batch) >= EMBED_MAX_INPUTS or batch_tokens + token_count > EMBED_MAX_TOKENS):
+                batches.append(batch)
+                batch, batch_tokens = [], 0
+            batch.append(text)
+            batch_tokens += token_count
+        if batch:
+            batches.append(batch)
+        
+        if len(batches) == 1:
+            return self._embed_batch(batches[0])
+        
+        # map保持子批次顺序
+        with ThreadPoolExecutor(max_workers=EMBED_MAX_WORKERS) as executor:
+            return np.concatenate(list(executor.map(self._embed_batch, batches)))
+    
+    @retry_with_backoff(max_retries=5, base_delay=1.0, retryable_exceptions=OPENAI_RETRYABLE_ERRORS)
+    def _embed_batch(self, texts: List[str]) -> np.ndarray:
+        """调用一次OpenAI Embedding API，限流和服务端错误时指数退避重试"""
+        response = self.client.embeddings.create(
+            model=self.embedding_model,
+            input=texts
+        )
+        return np.asarray([data.embedding for data in response.data], dtype=np.float32)
+    
+    def enhance_chunk_with_ai(self, chunk_content: str) -> Dict[str, str]:
+        """
+        使用AI增强单个块的信息（可选功能）
+        
+        Args:
+            chunk_content: 块内容
+            
+        Returns:
+            增强后的信息（标题、摘要、关键词等）
+        """
+        try:
+            prompt = f"""
+请分析以下文档片段，提供：
+1. 一个准确的标题
+2. 简要摘要（50字以内）
+3. 3-5个关键词
+
+文档片段：
+{chunk_content[:800]}
+
+请以JSON格式返回：
+{{"title": "标题", "summary": "摘要", "keywords": ["关键词1", "关键词2"]}}
+"""
+            
+            response = self.client.chat.completions.create(
+                model=self.chat_model,
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0.3,
+                max_tokens=200
+            )
+            
+            result = orjson.loads(response.choices[0].message.content)
+            return result
+            
+        except Exception as e:
+            print(f"AI增强块信息失败: {str(e)}")
+            return {
+                "title": "文档片段",
+                "summary": "无法生成摘要",
+                "keywords": []
+            }
+
+
+def test_openai_processor():
+    """测试OpenAI处理器"""
+    try:
+        processor = OpenAIProcessor()
+        print("✅ OpenAI处理器初始化成功")
+        
+        # 测试简单文本
+        test_content = {
+            "content": "这是一个测试文档。包含多个段落和信息。用于测试智能分块功能。",
+            "metadata": {"total_pages": 1}
+        }
+        
+        chunks = processor.intelligent_chunk_document(test_content)
+        print(f"✅ 测试分块成功: {len(chunks)} 个块")
+        
+    except Exception as e:
+        print(f"❌ OpenAI处理器测试失败: {str(e)}")
+
+
+if __name__ == "__main__":
     test_openai_processor()
\ No newline at end of file
@@ -1,258 +1,505 @@
-"""
-数据库任务队列 - 作为 Redis 的替代方案
-使用 SQLite 作为消息代理，提供更好的持久化保证
-"""
-
-import sqlite3
-import json
-import time
-import uuid
-from datetime import datetime, timedelta
-from typing import Optional, Dict, Any, List
-from threading import Lock
-import os
-
-class SQLiteTaskQueue:
-    """基于SQLite的任务队列"""
-    
-    def __init__(self, db_path: str = "task_queue.db"):
-        self.db_path = db_path
-        self.lock = Lock()
-        self._init_db()
-    
-    def _init_db(self):
-        """初始化数据库表"""
-        with sqlite3.connect(self.db_path) as conn:
-            conn.execute('''
-                CREATE TABLE IF NOT EXISTS task_queue (
-                    id TEXT PRIMARY KEY,
-                    task_name TEXT NOT NULL,
-                    args TEXT NOT NULL,
-                    kwargs TEXT NOT NULL,
-                    status TEXT DEFAULT 'pending',
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    started_at TIMESTAMP NULL,
-                    completed_at TIMESTAMP NULL,
-                    retry_count INTEGER DEFAULT 0,
-                    max_retries INTEGER DEFAULT 3,
-                    next_retry_at TIMESTAMP NULL,
-                    result TEXT NULL,
-                    error_message TEXT NULL
-                )
-            ''')
-            
-            # 创建索引优化查询
-            conn.execute('CREATE INDEX IF NOT EXISTS idx_status ON task_queue(status)')
-            conn.execute('CREATE INDEX IF NOT EXISTS idx_next_retry ON task_queue(next_retry_at)')
-    
-    def enqueue(self, task_name: str, *args, **kwargs) -> str:
-        """添加任务到队列"""
-        task_id = str(uuid.uuid4())
-        
-        with sqlite3.connect(self.db_path) as conn:
-            conn.execute('''
-                INSERT INTO task_queue (id, task_name, args, kwargs)
-                VALUES (?, ?, ?, ?)
-            ''', (task_id, task_name, json.dumps(args), json.dumps(kwargs)))
-        
-        print(f"任务入队: {task_name} ({task_id})")
-        return task_id
-    
-    def dequeue(self) -> Optional[Dict[str, Any]]:
-        """从队列中获取下一个任务"""
-        with self.lock:
-            with sqlite3.connect(self.db_path) as conn:
-                conn.row_factory = sqlite3.Row
-                
-                # 获取待处理的任务（包括需要重试的任务）
-                cursor = conn.execute('''
-                    SELECT * FROM task_queue 
-                    WHERE status IN ('pending', 'retry') 
-                    AND (next_retry_at IS NULL OR next_retry_at <= ?)
-                    ORDER BY created_at ASC 
-                    LIMIT 1
-                ''', (datetime.now(),))
-                
-                row = cursor.fetchone()
-                if not row:
-                    return None
-                
-                task = dict(row)
-                
-                # 标记任务为执行中
-                conn.execute('''
-                    UPDATE task_queue 
-                    SET status = 'processing', started_at = ?
-                    WHERE id = ?
-                ''', (datetime.now(), task['id']))
-                
-                return {
-                    'id': task['id'],
-                    'task_name': task['task_name'],
-                    'args': json.loads(task['args']),
-                    'kwargs': json.loads(task['kwargs']),
-                    'retry_count': task['retry_count']
-                }
-    
-    def complete_task(self, task_id: str, result: Any = None):
-        """标记任务完成"""
-        with sqlite3.connect(self.db_path) as conn:
-            conn.execute('''
-                UPDATE task_queue 
-                SET status = 'completed', completed_at = ?, result = ?
-                WHERE id = ?
-            ''', (datetime.now(), json.dumps(result) if result else None, task_id))
-        
-        print(f"任务完成: {task_id}")
-    
-    def fail_task(self, task_id: str, error_message: str, retry: bool = True):
-        """标记任务失败"""
-        with sqlite3.connect(self.db_path) as conn:
-            conn.row_factory = sqlite3.Row
-            
-            # 获取当前任务信息
-            cursor = conn.execute('''
-                SELECT retry_count, max_retries FROM task_queue WHERE id = ?
-            ''', (task_id,))
-            
-            row = cursor.fetchone()
-            if not row:
-                return
-            
-            retry_count = row['retry_count']
-            max_retries = row['max_retries']
-            
-            if retry and retry_count < max_retries:
-                # 安排重试
-                next_retry = datetime.now() + timedelta(minutes=2 ** retry_count)  # 指数退避
-                conn.execute('''
-                    UPDATE task_queue 
-                    SET status = 'retry', retry_count = ?, 
-                        next_retry_at = ?, error_message = ?
-                    WHERE id = ?
-                ''', (retry_count + 1, next_retry, error_message, task_id))
-                
-                print(f"任务安排重试: {task_id} (第 {retry_count + 1} 次)")
-            else:
-                # 彻底失败
-                conn.execute('''
-                    UPDATE task_queue 
-                    SET status = 'failed', error_message = ?
-                    WHERE id = ?
-                ''', (error_message, task_id))
-                
-                print(f"任务彻底失败: {task_id}")
-    
-    def get_task_status(self, task_id: str) -> Optional[Dict[str, Any]]:
-        """获取任务状态"""
-        with sqlite3.connect(self.db_path) as conn:
-            conn.row_factory = sqlite3.Row
-            cursor = conn.execute('''
-                SELECT * FROM task_queue WHERE id = ?
-            ''', (task_id,))
-            
-            row = cursor.fetchone()
-            return dict(row) if row else None
-    
-    def get_queue_stats(self) -> Dict[str, int]:
-        """获取队列统计信息"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.execute('''
-                SELECT status, COUNT(*) as count 
-                FROM task_queue 
-                GROUP BY status
-            ''')
-            
-            stats = {row[0]: row[1] for row in cursor.fetchall()}
-            return stats
-    
-    def cleanup_old_tasks(self, days: int = 7):
-        """清理旧任务"""
-        cutoff_date = datetime.now() - timedelta(days=days)
-        
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.execute('''
-                DELETE FROM task_queue 
-                WHERE status IN ('completed', 'failed') 
-                AND completed_at < ?
-            ''', (cutoff_date,))
-            
-            deleted_count = cursor.rowcount
-            print(f"清理了 {deleted_count} 个旧任务")
-            return deleted_count
-
-
-# 简单的任务处理器
-class SQLiteTaskWorker:
-    """SQLite任务队列的工作进程"""
-    
-    def __init__(self, queue: SQLiteTaskQueue):
-        self.queue = queue
-        self.running = False
-        self.task_registry = {}
-    
-    def register_task(self, name: str, func):
-        """注册任务函数"""
-        self.task_registry[name] = func
-    
-    def start(self):
-        """开始处理任务"""
-        self.running = True
-        print("SQLite 任务工作进程启动")
-        
-        while self.running:
-            try:
-                task = self.queue.dequeue()
-                if not task:
-                    time.sleep(1)  # 没有任务时等待1秒
-                    continue
-                
-                self.process_task(task)
-                
-            except KeyboardInterrupt:
-                print("接收到停止信号")
-                self.running = False
-                break
-            except Exception as e:
-                print(f"工作进程错误: {e}")
-                time.sleep(5)  # 出错时等待5秒
-    
-    def stop(self):
-        """停止任务处理"""
-        self.running = False
-    
-    def process_task(self, task: Dict[str, Any]):
-        """处理单个任务"""
-        task_id = task['id']
-        task_name = task['task_name']
-        args = task['args']
-        kwargs = task['kwargs']
-        
-        print(f"处理任务: {task_name} ({task_id})")
-        
-        if task_name not in self.task_registry:
-            self.queue.fail_task(task_id, f"未知任务类型: {task_name}", retry=False)
-            return
-        
-        try:
-            func = self.task_registry[task_name]
-            result = func(*args, **kwargs)
-            self.queue.complete_task(task_id, result)
-            
-        except Exception as e:
-            error_msg = f"任务执行失败: {str(e)}"
-            print(error_msg)
-            self.queue.fail_task(task_id, error_msg)
-
-
-if __name__ == "__main__":
-    # 测试用例
-    queue = SQLiteTaskQueue()
-    
-    # 添加测试任务
-    task_id = queue.enqueue("test_task", "arg1", keyword="value1")
-    print(f"添加任务: {task_id}")
-    
-    # 查看队列状态
-    stats = queue.get_queue_stats()
+"""
+数据库任务队列 - 作为 Redis 的替代方案
+使用 SQLite 作为消息代理，提供更好的持久化保证
+"""
+
+import sqlite3
+import msgspec
+import orjson
+import time
+import uuid
+from typing import Optional, Dict, Any, List, Tuple
+from threading import Condition, Lock, local
+from contextlib import contextmanager
+import os
+
+# 每个连接都要设置的PRAGMA：synchronous=NORMAL在WAL模式下只在检查点fsync，
+# 临时表放内存，mmap读取数据页，64MB页缓存
+CONNECTION_PRAGMAS = (
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA cache_size=-65536",
+    "PRAGMA wal_autocheckpoint=1000",
+)
+
+# 任务参数和结果以msgpack编码后存为BLOB，比JSON文本编解码更快、占用空间更小
+_payload_encoder = msgspec.msgpack.Encoder()
+_payload_decoder = msgspec.msgpack.Decoder()
+
+def _decode_payload(value: Any) -> Any:
+    """解码任务参数/结果（兼容旧版本以JSON文本写入的任务）"""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        return orjson.loads(value)
+    return _payload_decoder.decode(value)
+
+# 常用SQL语句：持久连接上的sqlite3语句缓存按SQL文本复用已编译的语句（模块常量保证各调用处文本完全一致）
+# 参数一律使用命名占位符
+# 时间戳统一由SQLite生成（UTC，与created_at的默认值一致），不在Python侧构造datetime
+INSERT_TASK_SQL = '''
+    INSERT INTO task_queue (id, task_name, args, kwargs)
+    VALUES (:id, :task_name, :args, :kwargs)
+'''
+
+# 一条语句原子地认领最早的若干个可执行任务并返回其内容
+CLAIM_TASKS_SQL = '''
+    UPDATE task_queue 
+    SET status = 'processing', started_at = CURRENT_TIMESTAMP
+    WHERE id IN (
+        SELECT id FROM task_queue 
+        WHERE status IN ('pending', 'retry') 
+        AND (next_retry_at IS NULL OR next_retry_at <= datetime('now'))
+        ORDER BY created_at ASC 
+        LIMIT :limit
+    )
+    RETURNING id, task_name, args, kwargs, retry_count, created_at
+'''
+
+COMPLETE_TASK_SQL = '''
+    UPDATE task_queue 
+    SET status = 'completed', completed_at = CURRENT_TIMESTAMP, result = :result
+    WHERE id = :id
+'''
+
+SELECT_RETRY_INFO_SQL = '''
+    SELECT retry_count, max_retries FROM task_queue WHERE id = :id
+'''
+
+SCHEDULE_RETRY_SQL = '''
+    UPDATE task_queue 
+    SET status = 'retry', retry_count = :retry_count, 
+        next_retry_at = datetime('now', :retry_delay), error_message = :error_message
+    WHERE id = :id
+'''
+
+FAIL_TASK_SQL = '''
+    UPDATE task_queue 
+    SET status = 'failed', completed_at = CURRENT_TIMESTAMP, error_message = :error_message
+    WHERE id = :id
+'''
+
+# 显式列出查询的列，行以元组返回并按位置解包
+TASK_STATUS_COLUMNS = (
+    'id', 'task_name', 'args', 'kwargs', 'status',
+    'created_at', 'started_at', 'completed_at',
+    'retry_count', 'max_retries', 'next_retry_at',
+    'result', 'error_message',
+)
+
+SELECT_TASK_SQL = f'''
+    SELECT {', '.join(TASK_STATUS_COLUMNS)} FROM task_queue WHERE id = :id
+'''
+
+QUEUE_STATS_SQL = '''
+    SELECT status, COUNT(*) as count 
+    FROM task_queue 
+    GROUP BY status
+'''
+
+# 未结束（待执行、待重试、执行中）的任务数，用于初始化进程内计数
+UNFINISHED_COUNT_SQL = '''
+    SELECT COUNT(*) FROM task_queue 
+    WHERE status IN ('pending', 'retry', 'processing')
+'''
+
+# 其他连接提交修改后该值会变化，本连接自己的修改不影响
+DATA_VERSION_SQL = "PRAGMA data_version"
+
+# 判定队列为空后，最长多久无条件重新查询一次（等待到期的重试任务）
+EMPTY_RECHECK_INTERVAL = 30.0
+
+CLEANUP_TASKS_SQL = '''
+    DELETE FROM task_queue 
+    WHERE status IN ('completed', 'failed') 
+    AND completed_at < datetime('now', :age)
+'''
+
+# 清理旧任务后每次最多归还的空闲页数
+INCREMENTAL_VACUUM_SQL = "PRAGMA incremental_vacuum(1024);"
+
+class SQLiteTaskQueue:
+    """
+    基于SQLite的任务队列
+    
+    每个线程在实例生命周期内复用自己的连接；写事务以BEGIN IMMEDIATE开始，
+    由SQLite在进程内外统一串行化，WAL模式下读不会被写阻塞
+    """
+    
+    def __init__(self, db_path: str = "task_queue.db"):
+        self.db_path = db_path
+        self._local = local()
+        self._conns = []
+        self._conns_lock = Lock()  # 只保护连接列表，不参与任务读写
+        # 入队时唤醒同进程内等待任务的工作线程；计数用于避免错过两次检查之间的通知
+        self._cv = Condition()
+        self._enqueued = 0
+        # 本进程已知的未结束任务数（同样由self._cv保护），为0时空闲工作线程可以跳过出队查询
+        self._pending = 0
+        self._init_db()
+    
+    def _connect(self) -> sqlite3.Connection:
+        """打开数据库连接并应用连接级PRAGMA（自动提交模式，事务显式开启）"""
+        conn = sqlite3.connect(
+            self.db_path,
+            check_same_thread=False,
+            isolation_level=None,
+            cached_statements=256  # 足够容纳所有常用语句，避免被淘汰后重新编译
+        )
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+    
+    def _conn(self) -> sqlite3.Connection:
+        """获取当前线程的连接（首次使用时创建）"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+            with self._conns_lock:
+                self._conns.append(conn)
+        return conn
+    
+    @contextmanager
+    def _write(self):
+        """在当前线程的连接上执行一个写事务，异常时回滚"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+            conn.execute("COMMIT")
+        except BaseException:
+            # COMMIT失败（如SQLITE_BUSY）时事务仍处于打开状态，同样要回滚，否则该连接无法再开启事务
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+    
+    def close(self):
+        """关闭所有连接"""
+        with self._conns_lock:
+            for conn in self._conns:
+                conn.close()
+            self._conns.clear()
+        self._local = local()
+    
+    def _init_db(self):
+        """初始化数据库表"""
+        # 增量回收空闲页只能在建表前设置（对已有数据库不生效），清理旧任务后按需回收
+        self._conn().execute("PRAGMA auto_vacuum=INCREMENTAL")
+        # WAL模式持久保存在数据库文件中：读不阻塞写，写不阻塞读（不能在事务中切换）
+        self._conn().execute("PRAGMA journal_mode=WAL")
+        
+        with self._write() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS task_queue (
+                    id TEXT PRIMARY KEY,
+                    task_name TEXT NOT NULL,
+                    args BLOB NOT NULL,
+                    kwargs BLOB NOT NULL,
+                    status TEXT DEFAULT 'pending',
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    started_at TIMESTAMP NULL,
+                    completed_at TIMESTAMP NULL,
+                    retry_count INTEGER DEFAULT 0,
+                    max_retries INTEGER DEFAULT 3,
+                    next_retry_at TIMESTAMP NULL,
+                    result BLOB NULL,
+                    error_message TEXT NULL
+                )
+            ''')
+            
+            # 部分索引只包含出队和清理关心的行，不随已完成任务的积累而变大
+            conn.execute('DROP INDEX IF EXISTS idx_status')
+            conn.execute('DROP INDEX IF EXISTS idx_next_retry')
+            conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_pending ON task_queue(created_at, next_retry_at)
+                WHERE status IN ('pending', 'retry')
+            ''')
+            conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_cleanup ON task_queue(completed_at)
+                WHERE status IN ('completed', 'failed')
+            ''')
+            
+            self._pending = conn.execute(UNFINISHED_COUNT_SQL).fetchone()[0]
+    
+    def _finish_pending(self):
+        """任务结束（完成或彻底失败）时减少未结束任务计数"""
+        with self._cv:
+            self._pending = max(self._pending - 1, 0)
+    
+    def _known_empty(self, conn: sqlite3.Connection) -> bool:
+        """
+        判断无需查询即可确定没有可认领的任务
+        
+        需同时满足：本进程没有未结束任务；当前线程上次查到空队列后，数据库没有被其他连接
+        （包括其他进程的入队）修改过；距上次查询不超过EMPTY_RECHECK_INTERVAL
+        """
+        if self._pending > 0:
+            return False
+        empty_state = getattr(self._local, "empty_state", None)
+        if empty_state is None:
+            return False
+        data_version, checked_at = empty_state
+        if time.monotonic() - checked_at > EMPTY_RECHECK_INTERVAL:
+            return False
+        return conn.execute(DATA_VERSION_SQL).fetchone()[0] == data_version
+    
+    def enqueue(self, task_name: str, *args, **kwargs) -> str:
+        """添加任务到队列"""
+        task_id = str(uuid.uuid4())
+        
+        with self._write() as conn:
+            conn.execute(INSERT_TASK_SQL, {
+                'id': task_id,
+                'task_name': task_name,
+                'args': _payload_encoder.encode(args),
+                'kwargs': _payload_encoder.encode(kwargs)
+            })
+        
+        with self._cv:
+            self._enqueued += 1
+            self._pending += 1
+            self._cv.notify()
+        
+        print(f"任务入队: {task_name} ({task_id})")
+        return task_id
+    
+    def enqueue_many(self, items: List[Tuple[str, tuple, Dict[str, Any]]]) -> List[str]:
+        """批量添加任务到队列（单个事务内executemany）
+        
+        Args:
+            items: (task_name, args, kwargs) 元组列表
+        
+        Returns:
+            与items顺序一致的任务ID列表
+        """
+        rows = [
+            {
+                'id': str(uuid.uuid4()),
+                'task_name': task_name,
+                'args': _payload_encoder.encode(args),
+                'kwargs': _payload_encoder.encode(kwargs)
+            }
+            for task_name, args, kwargs in items
+        ]
+        if not rows:
+            return []
+        
+        with self._write() as conn:
+            conn.executemany(INSERT_TASK_SQL, rows)
+        
+        with self._cv:
+            self._enqueued += len(rows)
+            self._pending += len(rows)
+            self._cv.notify_all()
+        
+        print(f"批量任务入队: {len(rows)} 个")
+        return [row['id'] for row in rows]
+    
+    @property
+    def enqueue_count(self) -> int:
+        """本实例累计入队的任务数"""
+        return self._enqueued
+    
+    def wait_for_task(self, seen_count: int, timeout: float) -> bool:
+        """
+        等待新任务入队
+        
+        Args:
+            seen_count: 上次出队前读取的enqueue_count，期间已有新任务入队时立即返回
+            timeout: 最长等待时间（秒），作为其他进程入队时的兜底轮询
+            
+        Returns:
+            是否被新任务唤醒
+        """
+        with self._cv:
+            return self._cv.wait_for(lambda: self._enqueued != seen_count, timeout)
+    
+    def dequeue(self) -> Optional[Dict[str, Any]]:
+        """从队列中获取下一个任务"""
+        tasks = self.dequeue_batch(1)
+        return tasks[0] if tasks else None
+    
+    def dequeue_batch(self, limit: int) -> List[Dict[str, Any]]:
+        """
+        原子地认领最多limit个任务（包括到期需要重试的任务），按入队顺序返回
+        
+        认领和读取在同一条UPDATE ... RETURNING中完成，多个线程或进程同时出队也不会拿到同一任务；
+        已知队列为空时直接返回，不开启写事务
+        """
+        conn = self._conn()
+        if self._known_empty(conn):
+            return []
+        
+        # 在认领前读取，期间其他连接的提交会使下次检查重新查询
+        data_version = conn.execute(DATA_VERSION_SQL).fetchone()[0]
+        with self._write() as conn:
+            rows = conn.execute(CLAIM_TASKS_SQL, {'limit': limit}).fetchall()
+        self._local.empty_state = None if rows else (data_version, time.monotonic())
+        
+        # RETURNING的列顺序: id, task_name, args, kwargs, retry_count, created_at
+        rows.sort(key=lambda row: row[5])
+        return [
+            {
+                'id': task_id,
+                'task_name': task_name,
+                'args': _decode_payload(args),
+                'kwargs': _decode_payload(kwargs),
+                'retry_count': retry_count
+            }
+            for task_id, task_name, args, kwargs, retry_count, _ in rows
+        ]
+    
+    def complete_task(self, task_id: str, result: Any = None):
+        """标记任务完成"""
+        with self._write() as conn:
+            cursor = conn.execute(COMPLETE_TASK_SQL, {
+                'id': task_id,
+                'result': _payload_encoder.encode(result) if result else None
+            })
+        
+        if cursor.rowcount:
+            self._finish_pending()
+        print(f"任务完成: {task_id}")
+    
+    def fail_task(self, task_id: str, error_message: str, retry: bool = True):
+        """标记任务失败"""
+        with self._write() as conn:
+            # 获取当前任务信息
+            row = conn.execute(SELECT_RETRY_INFO_SQL, {'id': task_id}).fetchone()
+            if not row:
+                return
+            
+            retry_count, max_retries = row
+            
+            if retry and retry_count < max_retries:
+                # 安排重试
+                retry_delay = f'+{2 ** retry_count} minutes'  # 指数退避
+                conn.execute(SCHEDULE_RETRY_SQL, {
+                    'id': task_id,
+                    'retry_count': retry_count + 1,
+                    'retry_delay': retry_delay,
+                    'error_message': error_message
+                })
+                
+                print(f"任务安排重试: {task_id} (第 {retry_count + 1} 次)")
+            else:
+                # 彻底失败
+                conn.execute(FAIL_TASK_SQL, {'id': task_id, 'error_message': error_message})
+                self._finish_pending()
+                
+                print(f"任务彻底失败: {task_id}")
+    
+    def get_task_status(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """获取任务状态"""
+        row = self._conn().execute(SELECT_TASK_SQL, {'id': task_id}).fetchone()
+        if not row:
+            return None
+        
+        task = dict(zip(TASK_STATUS_COLUMNS, row))
+        for column in ('args', 'kwargs', 'result'):
+            task[column] = _decode_payload(task[column])
+        return task
+    
+    def get_queue_stats(self) -> Dict[str, int]:
+        """获取队列统计信息"""
+        cursor = self._conn().execute(QUEUE_STATS_SQL)
+        
+        stats = {row[0]: row[1] for row in cursor.fetchall()}
+        return stats
+    
+    def cleanup_old_tasks(self, days: int = 7):
+        """清理旧任务"""
+        with self._write() as conn:
+            cursor = conn.execute(CLEANUP_TASKS_SQL, {'age': f'-{days} days'})
+            
+            deleted_count = cursor.rowcount
+            print(f"清理了 {deleted_count} 个旧任务")
+        
+        if deleted_count:
+            # 归还删除后留下的空闲页并截断WAL文件；incremental_vacuum每执行一步只释放一页，
+            # execute()只执行一步，需用executescript()执行到底
+            conn = self._conn()
+            conn.executescript(INCREMENTAL_VACUUM_SQL)
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return deleted_count
+
+
+# 简单的任务处理器
+class SQLiteTaskWorker:
+    """SQLite任务队列的工作进程"""
+    
+    def __init__(self, queue: SQLiteTaskQueue, batch_size: int = 1):
+        self.queue = queue
+        self.batch_size = batch_size  # 每次认领的任务数，大于1时减少出队往返次数
+        self.running = False
+        self.task_registry = {}
+    
+    def register_task(self, name: str, func):
+        """注册任务函数"""
+        self.task_registry[name] = func
+    
+    def start(self):
+        """开始处理任务"""
+        self.running = True
+        print("SQLite 任务工作进程启动")
+        
+        while self.running:
+            try:
+                seen_count = self.queue.enqueue_count
+                tasks = self.queue.dequeue_batch(self.batch_size)
+                if not tasks:
+                    # 没有任务时等待入队通知，其他进程入队的任务最多5秒后被发现
+                    self.queue.wait_for_task(seen_count, timeout=5.0)
+                    continue
+                
+                for task in tasks:
+                    self.process_task(task)
+                
+            except KeyboardInterrupt:
+                print("接收到停止信号")
+                self.running = False
+                break
+            except Exception as e:
+                print(f"工作进程错误: {e}")
+                time.sleep(5)  # 出错时等待5秒
+    
+    def stop(self):
+        """停止任务处理"""
+        self.running = False
+    
+    def process_task(self, task: Dict[str, Any]):
+        """处理单个任务"""
+        task_id = task['id']
+        task_name = task['task_name']
+        args = task['args']
+        kwargs = task['kwargs']
+        
+        print(f"处理任务: {task_name} ({task_id})")
+        
+        if task_name not in self.task_registry:
+            self.queue.fail_task(task_id, f"未知任务类型: {task_name}", retry=False)
+            return
+        
+        try:
+            func = self.task_registry[task_name]
+            result = func(*args, **kwargs)
+            self.queue.complete_task(task_id, result)
+            
+        except Exception as e:
+            error_msg = f"任务执行失败: {str(e)}"
+            print(error_msg)
+            self.queue.fail_task(task_id, error_msg)
+
+
+if __name__ == "__main__":
+    # 测试用例
+    queue = SQLiteTaskQueue()
+    
+    # 添加测试任务
+    task_id = queue.enqueue("test_task", "arg1", keyword="value1")
+    print(f"添加任务: {task_id}")
+    
+    # 查看队列状态
+    stats = queue.get_queue_stats()
     print(f"队列统计: {stats}")
\ No newline at end of file
@@ -1,358 +1,583 @@
-from celery import Celery
-import os
-import json
-from datetime import datetime
-import time
-import traceback
-from error_handler import (
-    retry_with_backoff, 
-    log_and_handle_error, 
-    error_tracker,
-    ErrorHandler,
-    RetryableError,
-    NonRetryableError
-)
-from dotenv import load_dotenv
-from chroma_db import ChromaVectorDB
-
-# 加载环境变量
-load_dotenv()
-
-# 全局ChromaDB实例（对于Celery worker）
-_vector_db = None
-
-def get_vector_db():
-    """获取ChromaDB实例（单例模式）"""
-    global _vector_db
-    if _vector_db is None:
-        print("🔗 初始化ChromaDB连接...")
-        _vector_db = ChromaVectorDB()
-    return _vector_db
-
-# 获取Redis URL，支持环境变量配置
-REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
-
-# 创建Celery实例
-celery_app = Celery(
-    'doc_processor',
-    broker=REDIS_URL,
-    backend=REDIS_URL
-)
-
-# Celery配置 - 增强可靠性
-celery_app.conf.update(
-    task_serializer='json',
-    accept_content=['json'],
-    result_serializer='json',
-    timezone='UTC',
-    enable_utc=True,
-    worker_concurrency=3,  # 并发处理3个任务
-    
-    # 任务可靠性配置
-    task_acks_late=True,  # 任务完成后才确认，避免任务丢失
-    worker_prefetch_multiplier=1,  # 每个worker一次只处理一个任务
-    task_reject_on_worker_lost=True,  # worker丢失时拒绝任务
-    
-    # 结果持久化配置
-    result_expires=3600,  # 结果保存1小时
-    result_persistent=True,  # 结果持久化
-    
-    # 重试配置
-    task_default_retry_delay=60,  # 默认重试延迟60秒
-    task_max_retries=3,  # 最大重试次数
-    
-    # Redis连接配置
-    broker_connection_retry=True,
-    broker_connection_retry_on_startup=True,
-    broker_connection_max_retries=10,
-)
-
-def update_file_status(file_id: str, status: str, progress: int, message: str):
-    """更新文件处理状态"""
-    try:
-        from database import get_database_manager
-        db_manager = get_database_manager()
-        
-        success = db_manager.update_file_status(file_id, status, progress, message)
-        if not success:
-            print(f"Warning: Failed to update status for file {file_id}")
-            
-        # 记录处理阶段日志
-        if status in ["parsing", "chunking", "embedding", "storing"]:
-            db_manager.log_processing_stage(file_id, status, "started", message)
-        elif status == "completed":
-            db_manager.log_processing_stage(file_id, "processing", "completed", message)
-        elif status == "error":
-            db_manager.log_processing_stage(file_id, "processing", "failed", message)
-            
-    except Exception as e:
-        print(f"Error updating file status: {e}")
-        import traceback
-        traceback.print_exc()
-
-@celery_app.task(bind=True)
-def process_document(self, file_id: str):
-    """处理单个文档的主任务（带错误处理和重试）"""
-    try:
-        from database import get_database_manager
-        db_manager = get_database_manager()
-        
-        # 检查是否应该跳过此任务
-        if error_tracker.should_skip_task(file_id, max_errors=3):
-            error_msg = f"❌ 任务跳过: 错误次数过多 ({error_tracker.get_error_count(file_id)} 次)"
-            update_file_status(file_id, "error", 0, error_msg)
-            return {"file_id": file_id, "status": "skipped", "reason": "too_many_errors"}
-        
-        # 获取文件信息
-        file_record = db_manager.get_file_record(file_id)
-        if not file_record:
-            raise NonRetryableError("文件信息不存在", "file_error")
-        
-        filepath = file_record.filepath
-        filename = file_record.filename
-        
-        print(f"🚀 [CELERY] 开始处理文档任务: {file_id}")
-        print(f"📄 [CELERY] 文件信息: {filename} ({filepath})")
-        
-        # 记录开始时间
-        import time
-        start_time = time.time()
-        
-        # 阶段1: MinerU解析文档（带重试）
-        print(f"🔍 [CELERY] 阶段1: 开始MinerU解析...")
-        update_file_status(file_id, "parsing", 10, "MinerU解析中...")
-        parsing_start = time.time()
-        extracted_content = parse_document_with_retry(file_id, filepath)
-        parsing_duration = time.time() - parsing_start
-        print(f"✅ [CELERY] 阶段1完成: 解析耗时 {parsing_duration:.2f}s")
-        db_manager.log_processing_stage(file_id, "parsing", "completed", "文档解析完成", parsing_duration)
-        
-        # 更新文档页数
-        if extracted_content.get("metadata", {}).get("total_pages"):
-            db_manager.update_file_results(file_id, total_pages=extracted_content["metadata"]["total_pages"])
-        
-        update_file_status(file_id, "parsing", 30, "文档解析完成")
-        
-        # 阶段2: 智能分块（带重试）
-        print(f"✂️ [CELERY] 阶段2: 开始智能分块...")
-        update_file_status(file_id, "chunking", 40, "智能分块中...")
-        chunking_start = time.time()
-        chunks = chunk_document_with_retry(file_id, extracted_content)
-        chunking_duration = time.time() - chunking_start
-        print(f"✅ [CELERY] 阶段2完成: 分块耗时 {chunking_duration:.2f}s，共生成 {len(chunks)} 块")
-        db_manager.log_processing_stage(file_id, "chunking", "completed", f"分块完成，共{len(chunks)}块", chunking_duration)
-        
-        # 更新块数量
-        db_manager.update_file_results(file_id, chunks_count=len(chunks))
-        
-        update_file_status(file_id, "chunking", 60, f"分块完成，共{len(chunks)}块")
-        print(f"📊 [CELERY] 分块统计: {len(chunks)} 个文档块")
-        
-        # 阶段3: 向量化（带重试）
-        print(f"🧮 [CELERY] 阶段3: 开始向量化...")
-        update_file_status(file_id, "embedding", 70, "向量化中...")
-        embedding_start = time.time()
-        embeddings = generate_embeddings_with_retry(file_id, chunks)
-        embedding_duration = time.time() - embedding_start
-        print(f"✅ [CELERY] 阶段3完成: 向量化耗时 {embedding_duration:.2f}s，共{len(embeddings)}个向量")
-        db_manager.log_processing_stage(file_id, "embedding", "completed", "向量化完成", embedding_duration)
-        
-        update_file_status(file_id, "embedding", 90, "向量化完成")
-        
-        # 阶段4: 存储到向量数据库（带重试）
-        print(f"💾 [CELERY] 阶段4: 开始存储向量...")
-        update_file_status(file_id, "storing", 95, "存储向量中...")
-        storing_start = time.time()
-        store_with_retry(file_id, chunks, embeddings)
-        storing_duration = time.time() - storing_start
-        print(f"✅ [CELERY] 阶段4完成: 存储耗时 {storing_duration:.2f}s")
-        db_manager.log_processing_stage(file_id, "storing", "completed", "向量存储完成", storing_duration)
-        
-        # 完成
-        total_duration = time.time() - start_time
-        completion_message = f"✅ 处理完成 (耗时: {total_duration:.1f}秒)"
-        update_file_status(file_id, "completed", 100, completion_message)
-        
-        print(f"🎉 [CELERY] 任务完成: {filename} 处理成功，总耗时 {total_duration:.2f}s")
-        print(f"📈 [CELERY] 处理统计: {len(chunks)} 块，{total_duration:.1f}s 完成")
-        
-        return {
-            "file_id": file_id,
-            "filename": filename,
-            "chunks_count": len(chunks),
-            "total_duration": total_duration,
-            "status": "completed"
-        }
-        
-    except NonRetryableError as e:
-        error_msg = f"❌ 处理失败 (不可重试): {str(e)}"
-        update_file_status(file_id, "error", 0, error_msg)
-        print(f"文件处理失败 (不可重试): {file_id}, 错误: {str(e)}")
-        raise
-        
-    except Exception as e:
-        # 记录和处理错误
-        handled_error = log_and_handle_error(file_id, e, "document_processing")
-        
-        error_msg = f"❌ 处理失败: {str(handled_error)}"
-        update_file_status(file_id, "error", 0, error_msg)
-        print(f"文件处理失败: {file_id}, 错误: {str(e)}")
-        print(traceback.format_exc())
-        
-        # 如果是可重试错误，重新抛出让Celery重试
-        if isinstance(handled_error, RetryableError):
-            self.retry(countdown=60, max_retries=2)
-        
-        raise
-
-@retry_with_backoff(max_retries=2, base_delay=1.0)
-def parse_document_with_retry(file_id: str, filepath: str) -> dict:
-    """带重试的文档解析"""
-    try:
-        return mineru_parse_document(filepath)
-    except Exception as e:
-        handled_error = log_and_handle_error(file_id, e, "parsing")
-        raise handled_error
-
-@retry_with_backoff(max_retries=2, base_delay=0.5)
-def chunk_document_with_retry(file_id: str, parsed_content: dict) -> list:
-    """带重试的文档分块"""
-    try:
-        return intelligent_chunking(parsed_content)
-    except Exception as e:
-        handled_error = log_and_handle_error(file_id, e, "chunking")
-        raise handled_error
-
-@retry_with_backoff(max_retries=3, base_delay=2.0)
-def generate_embeddings_with_retry(file_id: str, chunks: list) -> list:
-    """带重试的向量生成"""
-    try:
-        return generate_embeddings(chunks)
-    except Exception as e:
-        handled_error = log_and_handle_error(file_id, e, "embedding")
-        raise handled_error
-
-@retry_with_backoff(max_retries=2, base_delay=1.0)
-def store_with_retry(file_id: str, chunks: list, embeddings: list):
-    """带重试的数据库存储"""
-    try:
-        return store_to_vector_db(file_id, chunks, embeddings)
-    except Exception as e:
-        handled_error = log_and_handle_error(file_id, e, "storing")
-        raise handled_error
-
-def mineru_parse_document(filepath: str) -> dict:
-    """使用MinerU解析文档"""
-    from mineru_parser import MinerUParser
-    
-    print(f"MinerU解析文档: {filepath}")
-    parser = MinerUParser()
-    
-    try:
-        result = parser.parse_pdf(filepath)
-        print(f"解析完成: 页数={result['metadata']['total_pages']}, 表格={result['metadata']['tables_count']}")
-        return result
-    except Exception as e:
-        print(f"MinerU解析失败: {str(e)}")
-        raise
-
-def intelligent_chunking(parsed_content: dict) -> list:
-    """使用Ollama进行智能分块"""
-    try:
-        from ollama_processor import OllamaProcessor
-        
-        print("使用Ollama进行智能分块...")
-        processor = OllamaProcessor()
-        chunks = processor.intelligent_chunk_document(parsed_content)
-        
-        print(f"智能分块完成，共 {len(chunks)} 块")
-        return chunks
-        
-    except Exception as e:
-        print(f"Ollama智能分块失败，使用备用方案: {str(e)}")
-        return fallback_chunking(parsed_content)
-
-def fallback_chunking(parsed_content: dict) -> list:
-    """备用分块方案"""
-    content = parsed_content.get("content", "")
-    chunks = []
-    
-    if not content.strip():
-        return chunks
-    
-    # 简单按长度分块
-    chunk_size = 1000
-    for i in range(0, len(content), chunk_size):
-        chunk_content = content[i:i + chunk_size]
-        if chunk_content.strip():
-            chunks.append({
-                "title": f"文档片段 {len(chunks) + 1}",
-                "content": chunk_content.strip(),
-                "summary": f"文档的第{len(chunks) + 1}个片段",
-                "type": "fallback_chunk"
-            })
-    
-    return chunks
-
-def generate_embeddings(chunks: list) -> list:
-    """生成向量嵌入"""
-    try:
-        from ollama_processor import OllamaProcessor
-        
-        print("使用Ollama生成向量嵌入...")
-        processor = OllamaProcessor()
-        embeddings = processor.generate_embeddings(chunks)
-        
-        print(f"向量化完成，生成 {len(embeddings)} 个向量")
-        return embeddings
-        
-    except Exception as e:
-        print(f"Ollama向量化失败，使用随机向量: {str(e)}")
-        return fallback_embeddings(chunks)
-
-def fallback_embeddings(chunks: list) -> list:
-    """备用向量生成方案"""
-    import random
-    embeddings = []
-    for chunk in chunks:
-        # 生成随机向量（实际应用中不建议）
-        embedding = [random.random() for _ in range(768)]  # Ollama nomic-embed-text维度
-        embeddings.append(embedding)
-    return embeddings
-
-def store_to_vector_db(file_id: str, chunks: list, embeddings: list):
-    """存储到向量数据库"""
-    try:
-        from database import get_database_manager
-        
-        print("存储到ChromaDB向量数据库...")
-        db = get_vector_db()
-        db_manager = get_database_manager()
-        
-        # 获取文件信息
-        file_record = db_manager.get_file_record(file_id)
-        if not file_record:
-            raise Exception("无法获取文件信息")
-            
-        filename = file_record.filename
-        
-        # 存储到向量数据库
-        success = db.store_document_chunks(
-            file_id=file_id,
-            filename=filename,
-            chunks=chunks,
-            embeddings=embeddings
-        )
-        
-        if success:
-            print(f"✅ 已将 {len(chunks)} 个文档块存储到向量数据库")
-        else:
-            raise Exception("向量数据库存储失败")
-            
-    except Exception as e:
-        print(f"❌ 存储到向量数据库失败: {str(e)}")
-        raise
-
-if __name__ == '__main__':
-    # 启动Celery worker
+from celery import Celery
+from celery.signals import worker_process_init
+import os
+import asyncio
+from datetime import datetime
+import time
+import hashlib
+import numpy as np
+import traceback
+from error_handler import (
+    retry_with_backoff, 
+    log_and_handle_error, 
+    error_tracker,
+    ErrorHandler,
+    RetryableError,
+    NonRetryableError,
+    CircuitOpenError
+)
+from dotenv import load_dotenv
+from database import get_database_manager, ProcessingLogBuffer
+from faiss_db import create_vector_db
+from mineru_parser import MinerUParser
+from ollama_processor import OllamaProcessor
+
+# 加载环境变量
+load_dotenv()
+
+# 全局ChromaDB实例（对于Celery worker）
+_vector_db = None
+
+def get_vector_db():
+    """获取向量数据库实例（单例模式）"""
+    global _vector_db
+    if _vector_db is None:
+        print("🔗 初始化ChromaDB连接...")
+        _vector_db = create_vector_db()
+    return _vector_db
+
+# 全局处理日志缓冲区（对于Celery worker）
+_log_buffer = None
+
+def get_log_buffer():
+    """获取处理日志缓冲区（单例模式）"""
+    global _log_buffer
+    if _log_buffer is None:
+        _log_buffer = ProcessingLogBuffer(get_database_manager())
+    return _log_buffer
+
+# 全局Ollama处理器（对于Celery worker，复用连接池和连接检查结果）
+_ollama_processor = None
+
+def get_ollama_processor():
+    """获取Ollama处理器实例（单例模式）"""
+    global _ollama_processor
+    if _ollama_processor is None:
+        _ollama_processor = OllamaProcessor()
+    return _ollama_processor
+
+# 获取Redis URL，支持环境变量配置
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+
+# 创建Celery实例
+celery_app = Celery(
+    'doc_processor',
+    broker=REDIS_URL,
+    backend=REDIS_URL
+)
+
+# Celery配置 - 增强可靠性
+celery_app.conf.update(
+    # msgpack比JSON编解码更快、消息更小；保留json以便处理升级前已入队的任务
+    task_serializer='msgpack',
+    accept_content=['msgpack', 'json'],
+    result_serializer='msgpack',
+    timezone='UTC',
+    enable_utc=True,
+    worker_concurrency=3,  # 并发处理3个任务
+    
+    # 任务可靠性配置
+    task_acks_late=True,  # 任务完成后才确认，避免任务丢失
+    worker_prefetch_multiplier=1,  # 每个worker一次只处理一个任务
+    task_reject_on_worker_lost=True,  # worker丢失时拒绝任务
+    
+    # 结果持久化配置
+    result_expires=3600,  # 结果保存1小时
+    result_persistent=True,  # 结果持久化
+    
+    # 重试配置
+    task_default_retry_delay=60,  # 默认重试延迟60秒
+    task_max_retries=3,  # 最大重试次数
+    
+    # Redis连接配置
+    broker_connection_retry=True,
+    broker_connection_retry_on_startup=True,
+    broker_connection_max_retries=10,
+)
+
+@worker_process_init.connect
+def warm_up_worker_process(**kwargs):
+    """Worker子进程启动时预先创建各单例，首个文档不再承担初始化耗时"""
+    try:
+        get_vector_db()
+        get_log_buffer()
+        get_ollama_processor()
+        print("🔥 [CELERY] Worker进程预热完成")
+    except Exception as e:
+        # 预热失败不影响Worker启动，任务执行时会再次初始化
+        print(f"⚠️ [CELERY] Worker进程预热失败: {e}")
+
+def update_file_status(file_id: str, status: str, progress: int, message: str, db=None):
+    """更新文件处理状态（db为可选的共享会话，由调用方提交）"""
+    try:
+        db_manager = get_database_manager()
+        
+        success = db_manager.update_file_status(file_id, status, progress, message, db=db)
+        if not success:
+            print(f"Warning: Failed to update status for file {file_id}")
+            
+        # 记录处理阶段日志（缓冲后批量写入）
+        log_buffer = get_log_buffer()
+        if status in ["parsing", "chunking", "embedding", "storing"]:
+            log_buffer.add(file_id, status, "started", message)
+        elif status == "completed":
+            log_buffer.add(file_id, "processing", "completed", message)
+        elif status == "error":
+            log_buffer.add(file_id, "processing", "failed", message)
+            
+    except Exception as e:
+        print(f"Error updating file status: {e}")
+        traceback.print_exc()
+
+# 依赖熔断期间文档重新排队的最大次数（熔断不是文档本身的问题，不应直接判为永久失败）
+CIRCUIT_OPEN_MAX_RETRIES = int(os.getenv('CIRCUIT_OPEN_MAX_RETRIES', 10))
+
+@celery_app.task(bind=True)
+def process_document(self, file_id: str):
+    """处理单个文档的主任务（带错误处理和重试）"""
+    try:
+        db_manager = get_database_manager()
+        
+        # 检查是否应该跳过此任务
+        if error_tracker.should_skip_task(file_id, max_errors=3):
+            error_msg = f"❌ 任务跳过: 错误次数过多 ({error_tracker.get_error_count(file_id)} 次)"
+            update_file_status(file_id, "error", 0, error_msg)
+            return {"file_id": file_id, "status": "skipped", "reason": "too_many_errors"}
+        
+        # 获取文件信息
+        file_record = db_manager.get_file_record(file_id)
+        if not file_record:
+            raise NonRetryableError("文件信息不存在", "file_error")
+        
+        filepath = file_record.filepath
+        filename = file_record.filename
+        
+        print(f"🚀 [CELERY] 开始处理文档任务: {file_id}")
+        print(f"📄 [CELERY] 文件信息: {filename} ({filepath})")
+        
+        # 记录开始时间
+        start_time = time.time()
+        
+        # 阶段1: MinerU解析文档（带重试）
+        print(f"🔍 [CELERY] 阶段1: 开始MinerU解析...")
+        update_file_status(file_id, "parsing", 10, "MinerU解析中...")
+        parsing_start = time.time()
+        extracted_content = parse_document_with_retry(file_id, filepath)
+        parsing_duration = time.time() - parsing_start
+        print(f"✅ [CELERY] 阶段1完成: 解析耗时 {parsing_duration:.2f}s")
+        get_log_buffer().add(file_id, "parsing", "completed", "文档解析完成", parsing_duration)
+        
+        # 更新文档页数，并在同一事务中进入分块阶段（阶段完成只记日志，状态行只在阶段切换时写一次）
+        print(f"✂️ [CELERY] 阶段2: 开始智能分块...")
+        with db_manager.session() as db:
+            if extracted_content.get("metadata", {}).get("total_pages"):
+                db_manager.update_file_results(file_id, total_pages=extracted_content["metadata"]["total_pages"], db=db)
+            
+            update_file_status(file_id, "chunking", 40, "智能分块中...", db=db)
+        chunking_start = time.time()
+        chunks = dedupe_chunks(chunk_document_with_retry(file_id, extracted_content))
+        chunking_duration = time.time() - chunking_start
+        print(f"✅ [CELERY] 阶段2完成: 分块耗时 {chunking_duration:.2f}s，共生成 {len(chunks)} 块")
+        get_log_buffer().add(file_id, "chunking", "completed", f"分块完成，共{len(chunks)}块", chunking_duration)
+        
+        # 更新块数量，并在同一事务中进入向量化阶段
+        print(f"📊 [CELERY] 分块统计: {len(chunks)} 个文档块")
+        print(f"🧮 [CELERY] 阶段3: 开始向量化...")
+        with db_manager.session() as db:
+            db_manager.update_file_results(file_id, chunks_count=len(chunks), db=db)
+            
+            update_file_status(file_id, "embedding", 70, "向量化中...", db=db)
+        embedding_start = time.time()
+        embeddings = generate_embeddings_with_retry(file_id, chunks)
+        embedding_duration = time.time() - embedding_start
+        print(f"✅ [CELERY] 阶段3完成: 向量化耗时 {embedding_duration:.2f}s，共{len(embeddings)}个向量")
+        get_log_buffer().add(file_id, "embedding", "completed", "向量化完成", embedding_duration)
+        
+        # 阶段4: 存储到向量数据库（带重试）
+        print(f"💾 [CELERY] 阶段4: 开始存储向量...")
+        update_file_status(file_id, "storing", 95, "存储向量中...")
+        storing_start = time.time()
+        store_with_retry(file_id, chunks, embeddings)
+        storing_duration = time.time() - storing_start
+        print(f"✅ [CELERY] 阶段4完成: 存储耗时 {storing_duration:.2f}s")
+        get_log_buffer().add(file_id, "storing", "completed", "向量存储完成", storing_duration)
+        
+        # 完成
+        total_duration = time.time() - start_time
+        completion_message = f"✅ 处理完成 (耗时: {total_duration:.1f}秒)"
+        update_file_status(file_id, "completed", 100, completion_message)
+        error_tracker.clear_task(file_id)
+        
+        print(f"🎉 [CELERY] 任务完成: {filename} 处理成功，总耗时 {total_duration:.2f}s")
+        print(f"📈 [CELERY] 处理统计: {len(chunks)} 块，{total_duration:.1f}s 完成")
+        
+        return {
+            "file_id": file_id,
+            "filename": filename,
+            "chunks_count": len(chunks),
+            "total_duration": total_duration,
+            "status": "completed"
+        }
+        
+    except CircuitOpenError as e:
+        # 依赖熔断中：等冷却结束后重新排队（必须在NonRetryableError之前捕获）
+        if self.request.retries >= CIRCUIT_OPEN_MAX_RETRIES:
+            update_file_status(file_id, "error", 0, f"❌ 处理失败 (依赖持续不可用): {str(e)}")
+            raise
+        countdown = int(e.retry_after) + 1
+        update_file_status(file_id, "pending", 0, f"⏳ {str(e)}，{countdown}秒后重试")
+        print(f"⏳ [CELERY] 依赖熔断中，{countdown}s 后重试: {file_id}")
+        raise self.retry(exc=e, countdown=countdown, max_retries=CIRCUIT_OPEN_MAX_RETRIES)
+        
+    except NonRetryableError as e:
+        error_msg = f"❌ 处理失败 (不可重试): {str(e)}"
+        update_file_status(file_id, "error", 0, error_msg)
+        print(f"文件处理失败 (不可重试): {file_id}, 错误: {str(e)}")
+        raise
+        
+    except Exception as e:
+        # 记录和处理错误
+        handled_error = log_and_handle_error(file_id, e, "document_processing")
+        
+        error_msg = f"❌ 处理失败: {str(handled_error)}"
+        update_file_status(file_id, "error", 0, error_msg)
+        print(f"文件处理失败: {file_id}, 错误: {str(e)}")
+        print(traceback.format_exc())
+        
+        # 如果是可重试错误，重新抛出让Celery重试
+        if isinstance(handled_error, RetryableError):
+            self.retry(countdown=60, max_retries=2)
+        
+        raise
+    
+    finally:
+        # 确保本次任务缓冲的日志全部落库
+        try:
+            get_log_buffer().flush()
+        except Exception as e:
+            print(f"Error flushing processing logs: {e}")
+
+# 流水线各阶段之间的队列容量（背压：限制内存中积压的文档数）
+PIPELINE_QUEUE_SIZE = int(os.getenv('PIPELINE_QUEUE_SIZE', 4))
+# 每个流水线任务处理的文件数
+PIPELINE_BATCH_SIZE = int(os.getenv('PIPELINE_BATCH_SIZE', 8))
+# 向量化阶段合并的最大文档数及凑批最长等待时间（秒）
+PIPELINE_EMBED_BATCH = 8
+PIPELINE_EMBED_WAIT = 0.1
+
+# 阶段结束标记
+_PIPELINE_DONE = object()
+
+@celery_app.task
+def process_documents_pipelined(file_ids: list):
+    """
+    批量处理文档：解析、分块、向量化存储三个阶段流水线并行
+    
+    阶段之间用有界队列连接，后一个文档解析时前一个文档已在分块或向量化，
+    向量化阶段把同时就绪的多个文档合并为一次嵌入调用
+    """
+    print(f"🚀 [CELERY] 开始流水线处理 {len(file_ids)} 个文档")
+    results = asyncio.run(run_document_pipeline(file_ids))
+    print(f"🎉 [CELERY] 流水线处理结束: {results}")
+    return results
+
+def _pipeline_fail(results: dict, file_id: str, stage: str, e: Exception):
+    """
+    记录流水线中单个文档的失败，不影响其他文档
+    
+    与process_document的错误处理一致：依赖熔断或可重试错误时把该文档交给
+    process_document延迟重新处理，不可重试错误才标记为失败
+    """
+    if isinstance(e, CircuitOpenError):
+        countdown = int(e.retry_after) + 1
+        update_file_status(file_id, "pending", 0, f"⏳ {str(e)}，{countdown}秒后重试")
+        process_document.apply_async(args=[file_id], countdown=countdown)
+        results[file_id] = "retrying"
+        return
+    
+    if isinstance(e, NonRetryableError):
+        update_file_status(file_id, "error", 0, f"❌ 处理失败 (不可重试): {str(e)}")
+        results[file_id] = "error"
+        return
+    
+    handled_error = log_and_handle_error(file_id, e, stage)
+    if isinstance(handled_error, RetryableError):
+        update_file_status(file_id, "pending", 0, f"⏳ 处理失败，60秒后重试: {str(handled_error)}")
+        process_document.apply_async(args=[file_id], countdown=60)
+        results[file_id] = "retrying"
+        return
+    
+    update_file_status(file_id, "error", 0, f"❌ 处理失败: {str(handled_error)}")
+    results[file_id] = "error"
+
+async def run_document_pipeline(file_ids: list) -> dict:
+    """运行三阶段流水线，返回 文件ID -> 处理结果"""
+    db_manager = get_database_manager()
+    
+    parsed_queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    chunked_queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    results = {}
+    start_times = {}
+    
+    async def parse_stage():
+        for file_id in file_ids:
+            # 检查是否应该跳过此任务
+            if error_tracker.should_skip_task(file_id, max_errors=3):
+                error_msg = f"❌ 任务跳过: 错误次数过多 ({error_tracker.get_error_count(file_id)} 次)"
+                await asyncio.to_thread(update_file_status, file_id, "error", 0, error_msg)
+                results[file_id] = "skipped"
+                continue
+            start_times[file_id] = time.time()
+            file_record = await asyncio.to_thread(db_manager.get_file_record, file_id)
+            if not file_record:
+                results[file_id] = "missing"
+                continue
+            try:
+                await asyncio.to_thread(update_file_status, file_id, "parsing", 10, "MinerU解析中...")
+                parsed = await asyncio.to_thread(parse_document_with_retry, file_id, file_record.filepath)
+            except Exception as e:
+                await asyncio.to_thread(_pipeline_fail, results, file_id, "parsing", e)
+                continue
+            await parsed_queue.put((file_id, parsed))
+        await parsed_queue.put(_PIPELINE_DONE)
+    
+    def chunk_one(file_id: str, parsed: dict) -> list:
+        total_pages = parsed.get("metadata", {}).get("total_pages")
+        with db_manager.session() as db:
+            if total_pages:
+                db_manager.update_file_results(file_id, total_pages=total_pages, db=db)
+            update_file_status(file_id, "chunking", 40, "智能分块中...", db=db)
+        chunks = dedupe_chunks(chunk_document_with_retry(file_id, parsed))
+        with db_manager.session() as db:
+            db_manager.update_file_results(file_id, chunks_count=len(chunks), db=db)
+            update_file_status(file_id, "embedding", 70, "向量化中...", db=db)
+        return chunks
+    
+    async def chunk_stage():
+        while (item := await parsed_queue.get()) is not _PIPELINE_DONE:
+            file_id, parsed = item
+            try:
+                chunks = await asyncio.to_thread(chunk_one, file_id, parsed)
+            except Exception as e:
+                await asyncio.to_thread(_pipeline_fail, results, file_id, "chunking", e)
+                continue
+            await chunked_queue.put((file_id, chunks))
+        await chunked_queue.put(_PIPELINE_DONE)
+    
+    def embed_and_store(batch: list):
+        # 合并多个文档的块一次向量化；合并调用失败时逐个文档重试，避免一个文档拖累整批
+        # 合并调用不属于任何单个文档，不记录错误，错误只在逐个文档重试时按文档记录
+        try:
+            all_chunks = [chunk for _, chunks in batch for chunk in chunks]
+            embeddings = generate_embeddings_merged(all_chunks) if len(batch) > 1 else None
+        except Exception as e:
+            print(f"合并向量化失败，改为逐个文档向量化: {str(e)}")
+            embeddings = None
+        
+        offset = 0
+        for file_id, chunks in batch:
+            try:
+                if embeddings is None:
+                    file_embeddings = generate_embeddings_with_retry(file_id, chunks)
+                else:
+                    file_embeddings = embeddings[offset:offset + len(chunks)]
+                update_file_status(file_id, "storing", 95, "存储向量中...")
+                store_with_retry(file_id, chunks, file_embeddings)
+                total_duration = time.time() - start_times[file_id]
+                update_file_status(file_id, "completed", 100, f"✅ 处理完成 (耗时: {total_duration:.1f}秒)")
+                error_tracker.clear_task(file_id)
+                results[file_id] = "completed"
+            except Exception as e:
+                _pipeline_fail(results, file_id, "embedding", e)
+            offset += len(chunks)
+    
+    async def embed_stage():
+        loop = asyncio.get_running_loop()
+        done = False
+        while not done:
+            # 凑批：达到文档数上限或等待超时即开始向量化
+            batch = [await chunked_queue.get()]
+            batch_deadline = loop.time() + PIPELINE_EMBED_WAIT
+            while len(batch) < PIPELINE_EMBED_BATCH and batch[-1] is not _PIPELINE_DONE:
+                timeout = batch_deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(chunked_queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            if batch[-1] is _PIPELINE_DONE:
+                done = True
+                batch.pop()
+            if batch:
+                await asyncio.to_thread(embed_and_store, batch)
+    
+    await asyncio.gather(parse_stage(), chunk_stage(), embed_stage())
+    get_log_buffer().flush()
+    return results
+
+@retry_with_backoff(max_retries=2, base_delay=1.0)
+def parse_document_with_retry(file_id: str, filepath: str) -> dict:
+    """带重试的文档解析"""
+    try:
+        return mineru_parse_document(filepath)
+    except Exception as e:
+        handled_error = log_and_handle_error(file_id, e, "parsing")
+        raise handled_error
+
+@retry_with_backoff(max_retries=2, base_delay=0.5)
+def chunk_document_with_retry(file_id: str, parsed_content: dict) -> list:
+    """带重试的文档分块"""
+    try:
+        return intelligent_chunking(parsed_content)
+    except Exception as e:
+        handled_error = log_and_handle_error(file_id, e, "chunking")
+        raise handled_error
+
+@retry_with_backoff(max_retries=3, base_delay=2.0, target="embedding")
+def generate_embeddings_with_retry(file_id: str, chunks: list) -> np.ndarray:
+    """带重试的向量生成"""
+    try:
+        return generate_embeddings(chunks)
+    except Exception as e:
+        handled_error = log_and_handle_error(file_id, e, "embedding")
+        raise handled_error
+
+@retry_with_backoff(max_retries=0, target="embedding")
+def generate_embeddings_merged(chunks: list) -> np.ndarray:
+    """多个文档合并的向量生成：只尝试一次，受embedding熔断器保护并向其报告结果，不按文档记录错误"""
+    return generate_embeddings(chunks)
+
+@retry_with_backoff(max_retries=2, base_delay=1.0, target="vector_db")
+def store_with_retry(file_id: str, chunks: list, embeddings: np.ndarray):
+    """带重试的数据库存储"""
+    try:
+        return store_to_vector_db(file_id, chunks, embeddings)
+    except Exception as e:
+        handled_error = log_and_handle_error(file_id, e, "storing")
+        raise handled_error
+
+def mineru_parse_document(filepath: str) -> dict:
+    """使用MinerU解析文档"""
+    print(f"MinerU解析文档: {filepath}")
+    parser = MinerUParser()
+    
+    try:
+        result = parser.parse_pdf(filepath)
+        print(f"解析完成: 页数={result['metadata']['total_pages']}, 表格={result['metadata']['tables_count']}")
+        return result
+    except Exception as e:
+        print(f"MinerU解析失败: {str(e)}")
+        raise
+
+def intelligent_chunking(parsed_content: dict) -> list:
+    """使用Ollama进行智能分块"""
+    try:
+        print("使用Ollama进行智能分块...")
+        processor = get_ollama_processor()
+        chunks = processor.intelligent_chunk_document(parsed_content)
+        
+        print(f"智能分块完成，共 {len(chunks)} 块")
+        return chunks
+        
+    except Exception as e:
+        print(f"Ollama智能分块失败，使用备用方案: {str(e)}")
+        return fallback_chunking(parsed_content)
+
+def fallback_chunking(parsed_content: dict) -> list:
+    """备用分块方案"""
+    content = parsed_content.get("content", "")
+    chunks = []
+    
+    if not content.strip():
+        return chunks
+    
+    # 简单按长度分块
+    chunk_size = 1000
+    for i in range(0, len(content), chunk_size):
+        chunk_content = content[i:i + chunk_size]
+        if chunk_content.strip():
+            chunks.append({
+                "title": f"文档片段 {len(chunks) + 1}",
+                "content": chunk_content.strip(),
+                "summary": f"文档的第{len(chunks) + 1}个片段",
+                "type": "fallback_chunk"
+            })
+    
+    return chunks
+
+def chunk_content_hash(content: str) -> bytes:
+    """计算文档块内容哈希（sha256前16字节）"""
+    return hashlib.sha256(content.encode('utf-8')).digest()[:16]
+
+def dedupe_chunks(chunks: list) -> list:
+    """
+    去除文件内内容完全相同的块（如重复的页眉页脚），保留首次出现的块
+    
+    跨文件的相同内容不在这里复用：向量嵌入缓存按(嵌入模型, 实际向量化的文本)缓存向量本身
+    """
+    seen = set()
+    unique_chunks = []
+    for chunk in chunks:
+        chunk_hash = chunk_content_hash(chunk.get('content', ''))
+        if chunk_hash not in seen:
+            seen.add(chunk_hash)
+            unique_chunks.append(chunk)
+    
+    if len(unique_chunks) < len(chunks):
+        print(f"去除重复块: {len(chunks) - len(unique_chunks)} 个")
+    return unique_chunks
+
+def generate_embeddings(chunks: list) -> np.ndarray:
+    """生成向量嵌入，失败时抛出EmbeddingError由上层重试，不写入随机向量"""
+    print("使用Ollama生成向量嵌入...")
+    embeddings = get_ollama_processor().generate_embeddings(chunks)
+    
+    print(f"向量化完成，生成 {len(embeddings)} 个向量")
+    return embeddings
+
+def store_to_vector_db(file_id: str, chunks: list, embeddings: np.ndarray):
+    """存储到向量数据库"""
+    try:
+        print("存储到ChromaDB向量数据库...")
+        db = get_vector_db()
+        db_manager = get_database_manager()
+        
+        # 获取文件信息
+        file_record = db_manager.get_file_record(file_id)
+        if not file_record:
+            raise Exception("无法获取文件信息")
+            
+        filename = file_record.filename
+        
+        success = db.store_document_chunks(
+            file_id=file_id,
+            filename=filename,
+            chunks=chunks,
+            embeddings=embeddings
+        )
+        
+        if success:
+            print(f"✅ 已将 {len(chunks)} 个文档块存储到向量数据库")
+        else:
+            raise Exception("向量数据库存储失败")
+        
+        # 索引训练耗时较长，交给单独的任务执行，不阻塞文档存储
+        try:
+            if db.needs_training():
+                train_vector_index.delay()
+        except Exception as e:
+            print(f"Warning: Failed to schedule vector index training: {e}")
+            
+    except Exception as e:
+        print(f"❌ 存储到向量数据库失败: {str(e)}")
+        raise
+
+@celery_app.task
+def train_vector_index():
+    """训练向量索引（FAISS向量足够时迁移到IVF-PQ）"""
+    return get_vector_db().train_index()
+
+if __name__ == '__main__':
+    # 启动Celery worker
     celery_app.start()
\ No newline at end of file
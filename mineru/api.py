@@ -1,152 +1,188 @@
-"""
-MinerU API服务
-提供HTTP API接口用于PDF文档解析
-"""
-
-import os
-import tempfile
-import shutil
-from pathlib import Path
-from typing import Dict, Any
-from fastapi import FastAPI, File, UploadFile, HTTPException
-from fastapi.responses import JSONResponse
-import uvicorn
-import traceback
-
-try:
-    from magic_pdf.api import convert_pdf_to_markdown
-    MINERU_AVAILABLE = True
-except ImportError:
-    MINERU_AVAILABLE = False
-    print("Warning: MinerU not available")
-
-app = FastAPI(title="MinerU API", version="1.0.0")
-
-@app.get("/health")
-async def health_check():
-    """健康检查接口"""
-    return {
-        "status": "healthy",
-        "mineru_available": MINERU_AVAILABLE
-    }
-
-@app.post("/parse")
-async def parse_pdf(file: UploadFile = File(...)):
-    """解析PDF文档"""
-    if not file.filename.endswith('.pdf'):
-        raise HTTPException(status_code=400, detail="Only PDF files are supported")
-    
-    if not MINERU_AVAILABLE:
-        raise HTTPException(status_code=503, detail="MinerU not available")
-    
-    temp_dir = None
-    try:
-        # 创建临时目录
-        temp_dir = tempfile.mkdtemp(prefix="mineru_")
-        
-        # 保存上传的文件
-        pdf_path = os.path.join(temp_dir, file.filename)
-        with open(pdf_path, "wb") as f:
-            content = await file.read()
-            f.write(content)
-        
-        # 创建输出目录
-        output_dir = os.path.join(temp_dir, "output")
-        os.makedirs(output_dir, exist_ok=True)
-        
-        # 使用MinerU解析
-        result = convert_pdf_to_markdown(
-            pdf_path=pdf_path,
-            output_dir=output_dir,
-            ocr_lang="zh-CN",
-            parse_method="auto",
-            output_format="markdown"
-        )
-        
-        # 处理结果
-        parsed_result = process_mineru_result(result, output_dir)
-        
-        return JSONResponse(content=parsed_result)
-        
-    except Exception as e:
-        print(f"MinerU解析错误: {str(e)}")
-        print(traceback.format_exc())
-        raise HTTPException(status_code=500, detail=f"Parse error: {str(e)}")
-        
-    finally:
-        # 清理临时文件
-        if temp_dir and os.path.exists(temp_dir):
-            try:
-                shutil.rmtree(temp_dir)
-            except Exception as e:
-                print(f"清理临时文件失败: {str(e)}")
-
-def process_mineru_result(result: Any, output_dir: str) -> Dict[str, Any]:
-    """处理MinerU解析结果"""
-    parsed_data = {
-        "content": "",
-        "metadata": {
-            "total_pages": 0,
-            "tables_count": 0,
-            "images_count": 0,
-            "formulas_count": 0
-        },
-        "tables": [],
-        "images": [],
-        "structure": {
-            "headings": [],
-            "paragraphs": [],
-            "lists": []
-        }
-    }
-    
-    try:
-        # 查找输出的markdown文件
-        markdown_files = list(Path(output_dir).glob("*.md"))
-        if markdown_files:
-            markdown_path = markdown_files[0]
-            with open(markdown_path, 'r', encoding='utf-8') as f:
-                content = f.read()
-                
-            parsed_data["content"] = content
-            
-            # 简单统计
-            parsed_data["metadata"]["total_pages"] = content.count("---")
-            parsed_data["metadata"]["tables_count"] = content.count("|")
-            parsed_data["metadata"]["images_count"] = content.count("![")
-            parsed_data["metadata"]["formulas_count"] = content.count("$$")
-            
-            # 提取结构信息
-            lines = content.split('\n')
-            for line in lines:
-                line = line.strip()
-                if line.startswith('#'):
-                    # 标题
-                    level = len(line) - len(line.lstrip('#'))
-                    title = line.lstrip('# ').strip()
-                    if title:
-                        parsed_data["structure"]["headings"].append({
-                            "level": level,
-                            "title": title
-                        })
-                elif line and not line.startswith('#') and not line.startswith('|'):
-                    # 段落
-                    if len(line) > 10:  # 忽略太短的行
-                        parsed_data["structure"]["paragraphs"].append(line)
-        
-    except Exception as e:
-        print(f"处理MinerU结果时出错: {str(e)}")
-        
-    return parsed_data
-
-if __name__ == "__main__":
-    host = os.getenv("MINERU_API_HOST", "0.0.0.0")
-    port = int(os.getenv("MINERU_API_PORT", "8888"))
-    
-    uvicorn.run(
-        "api:app",
-        host=host,
-        port=port,
-        reload=False,
-        workers=1
+"""
+MinerU API服务
+提供HTTP API接口用于PDF文档解析
+"""
+
+import importlib.util
+import io
+import os
+import re
+import tempfile
+import shutil
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Any
+from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi.responses import JSONResponse
+import uvicorn
+import traceback
+
+# 只检查是否安装，不在启动时导入（magic_pdf会连带导入torch等重量级依赖）
+MINERU_AVAILABLE = importlib.util.find_spec("magic_pdf") is not None
+if not MINERU_AVAILABLE:
+    print("Warning: MinerU not available")
+
+app = FastAPI(title="MinerU API", version="1.0.0")
+
+UPLOAD_CHUNK_SIZE = 1 << 20  # 上传文件按1 MiB分块落盘
+_LIST_ITEM_RE = re.compile(r'(?:[-*+]|\d+[.)])\s')
+
+# 所有工作目录都建在该根目录下；TemporaryDirectory在对象回收和解释器退出时自动删除
+_workdir_root = tempfile.TemporaryDirectory(prefix="mineru_")
+# 可复用的工作目录池，减少反复创建目录的开销
+WORKDIR_POOL_SIZE = 4
+_workdir_pool = deque()
+
+def _release_workdir(path: str):
+    """清空工作目录后放回池中，池已满时直接删除"""
+    try:
+        if len(_workdir_pool) >= WORKDIR_POOL_SIZE:
+            shutil.rmtree(path)
+            return
+        
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    shutil.rmtree(entry.path)
+                else:
+                    os.unlink(entry.path)
+        _workdir_pool.append(path)
+    except Exception as e:
+        print(f"清理临时文件失败: {str(e)}")
+
+@contextmanager
+def workdir():
+    """获取一个空的临时工作目录，用完后清空回收"""
+    try:
+        path = _workdir_pool.pop()
+    except IndexError:
+        path = tempfile.mkdtemp(dir=_workdir_root.name)
+    try:
+        yield path
+    finally:
+        _release_workdir(path)
+
+@app.get("/health")
+async def health_check():
+    """健康检查接口"""
+    return {
+        "status": "healthy",
+        "mineru_available": MINERU_AVAILABLE
+    }
+
+@app.post("/parse")
+async def parse_pdf(file: UploadFile = File(...)):
+    """解析PDF文档"""
+    if not file.filename.endswith('.pdf'):
+        raise HTTPException(status_code=400, detail="Only PDF files are supported")
+    
+    if not MINERU_AVAILABLE:
+        raise HTTPException(status_code=503, detail="MinerU not available")
+    
+    try:
+        from magic_pdf.api import convert_pdf_to_markdown
+        
+        with workdir() as temp_dir:
+            # 保存上传的文件
+            pdf_path = os.path.join(temp_dir, os.path.basename(file.filename))
+            with open(pdf_path, "wb") as f:
+                # 分块写入，内存占用与文件大小无关
+                while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                    f.write(chunk)
+            
+            # 创建输出目录
+            output_dir = os.path.join(temp_dir, "output")
+            os.makedirs(output_dir, exist_ok=True)
+            
+            # 使用MinerU解析
+            result = convert_pdf_to_markdown(
+                pdf_path=pdf_path,
+                output_dir=output_dir,
+                ocr_lang="zh-CN",
+                parse_method="auto",
+                output_format="markdown"
+            )
+            
+            # 处理结果
+            parsed_result = process_mineru_result(result, output_dir)
+        
+        return JSONResponse(content=parsed_result)
+        
+    except Exception as e:
+        print(f"MinerU解析错误: {str(e)}")
+        print(traceback.format_exc())
+        raise HTTPException(status_code=500, detail=f"Parse error: {str(e)}")
+
+def process_mineru_result(result: Any, output_dir: str) -> Dict[str, Any]:
+    """处理MinerU解析结果"""
+    parsed_data = {
+        "content": "",
+        "metadata": {
+            "total_pages": 0,
+            "tables_count": 0,
+            "images_count": 0,
+            "formulas_count": 0
+        },
+        "tables": [],
+        "images": [],
+        "structure": {
+            "headings": [],
+            "paragraphs": [],
+            "lists": []
+        }
+    }
+    
+    try:
+        # 查找输出的markdown文件
+        # 只需要第一个文件，取到即停止遍历目录
+        markdown_path = next(Path(output_dir).glob("*.md"), None)
+        if markdown_path:
+            with open(markdown_path, 'r', encoding='utf-8') as f:
+                content = f.read()
+                
+            parsed_data["content"] = content
+            
+            # 单次逐行遍历：同时完成简单统计和结构信息提取
+            metadata = parsed_data["metadata"]
+            structure = parsed_data["structure"]
+            for raw_line in io.StringIO(content):
+                metadata["total_pages"] += raw_line.count("---")
+                metadata["tables_count"] += raw_line.count("|")
+                metadata["images_count"] += raw_line.count("![")
+                metadata["formulas_count"] += raw_line.count("$$")
+                
+                line = raw_line.strip()
+                if not line or line.startswith('|'):
+                    continue
+                if line.startswith('#'):
+                    # 标题
+                    level = len(line) - len(line.lstrip('#'))
+                    title = line.lstrip('# ').strip()
+                    if title:
+                        structure["headings"].append({
+                            "level": level,
+                            "title": title
+                        })
+                elif _LIST_ITEM_RE.match(line):
+                    # 列表项
+                    structure["lists"].append(line)
+                elif len(line) > 10:  # 段落，忽略太短的行
+                    structure["paragraphs"].append(line)
+        
+    except Exception as e:
+        print(f"处理MinerU结果时出错: {str(e)}")
+        
+    return parsed_data
+
+if __name__ == "__main__":
+    host = os.getenv("MINERU_API_HOST", "0.0.0.0")
+    port = int(os.getenv("MINERU_API_PORT", "8888"))
+    
+    uvicorn.run(
+        "api:app",
+        host=host,
+        port=port,
+        reload=False,
+        workers=1
     )
\ No newline at end of file